@@ -0,0 +1,122 @@
+import db
+import analysis
+
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Asyncio counterparts of the db and analysis functions. They run the sync
+# functions on thread pools, so the event loop is not blocked: reads on a
+# pool of reader threads, writes on a single writer thread, which keeps
+# them in the order they were awaited and spares them "database is locked"
+# retries against each other. Every worker keeps its own connection, see
+# db.enable_connection_pool. Results are the same as those of the sync
+# functions, e.g.
+#
+#     streaks = await asyncio.gather(*(aio.get_current_streak_series(name) for name in names))
+#
+# A database in memory is not shared between the workers, use a file.
+
+# reader threads, sqlite and numpy release the GIL while they work
+readers = int(os.environ.get("HABIT_TRACKER_ASYNC_READERS", min(8, (os.cpu_count() or 1) + 4)))
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _executor(kind: str) -> ThreadPoolExecutor:
+
+    """ Returns the reader or writer pool, started on first use. """
+
+    with _executors_lock:
+        if kind not in _executors:
+            _executors[kind] = ThreadPoolExecutor(
+                max_workers = readers if kind == "read" else 1,
+                thread_name_prefix = f"habit-{kind}",
+                initializer = db.enable_connection_pool,
+                initargs = (True, True)
+            )
+        return _executors[kind]
+
+
+def _wrap(function, kind: str):
+
+    """ Returns an async function running function on the reader or writer pool. """
+
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor(kind), functools.partial(function, *args, **kwargs))
+
+    return wrapper
+
+
+def reader(function):
+
+    """ Makes an async function of a sync function which only reads, see _wrap. """
+
+    return _wrap(function, "read")
+
+
+def writer(function):
+
+    """ Makes an async function of a sync function which writes, see _wrap. """
+
+    return _wrap(function, "write")
+
+
+def shutdown(wait: bool = True):
+
+    """ Stops the pools after the running calls, the next call starts them again. """
+
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+
+    for executor in executors:
+        executor.shutdown(wait=wait)
+
+
+# db
+
+get_tracking_data = reader(db.get_tracking_data)
+get_last_entry = reader(db.get_last_entry)
+get_active = reader(db.get_active)
+get_inactive = reader(db.get_inactive)
+get_habit_data = reader(db.get_habit_data)
+get_habits_page = reader(db.get_habits_page)
+count_habits = reader(db.count_habits)
+get_snapshot = reader(db.get_snapshot)
+get_snapshots = reader(db.get_snapshots)
+get_last_tracking_id = reader(db.get_last_tracking_id)
+get_tracking_rewrites = reader(db.get_tracking_rewrites)
+get_write_version = reader(db.get_write_version)
+get_rollups = reader(db.get_rollups)
+export_data = reader(db.export_data)
+
+ensure_schema = writer(db.ensure_schema)
+add_habit = writer(db.add_habit)
+modify_habit = writer(db.modify_habit)
+delete_habit = writer(db.delete_habit)
+streak_complete = writer(db.streak_complete)
+streak_complete_batch = writer(db.streak_complete_batch)
+import_data = writer(db.import_data)
+archive_tracking = writer(db.archive_tracking)
+rebuild_rollups = writer(db.rebuild_rollups)
+
+# analysis, the snapshot functions only read, stale snapshots are computed
+# live and stored by refresh_snapshots
+
+get_current_streak_series = reader(analysis.get_current_streak_series)
+get_habits_series = reader(analysis.get_habits_series)
+get_active_habits_for_period = reader(analysis.get_active_habits_for_period)
+get_habit_snapshot = reader(analysis.get_habit_snapshot)
+get_habit_snapshots = reader(analysis.get_habit_snapshots)
+get_habits_series_from_snapshots = reader(analysis.get_habits_series_from_snapshots)
+get_streaks_from_cache = reader(analysis.get_streaks_from_cache)
+get_habits_series_from_cache = reader(analysis.get_habits_series_from_cache)
+get_completions_per_period = reader(analysis.get_completions_per_period)
+
+refresh_snapshots = writer(analysis.refresh_snapshots)
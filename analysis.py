@@ -1,8 +1,16 @@
+from __future__ import annotations
+
 import db
-import pandas as pd
+import metrics
 from datetime import datetime, timedelta
 import calendar
-from dateutil.relativedelta import relativedelta
+from typing import TYPE_CHECKING
+
+# pandas and dateutil are imported where they are needed, so importing
+# this module for _dynamic_periods stays cheap
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
 
 # start of analysis
 
@@ -63,6 +71,7 @@ def _dynamic_periods(
         end = timestamp.replace(day=last_day, hour=23, minute=59, second=59)
         
         if previous_period:
+            from dateutil.relativedelta import relativedelta
             start = start - relativedelta(months=1)
             start.replace(hour=0, minute=0, second=0)
             last_day = calendar.monthrange(
@@ -75,8 +84,7 @@ def _dynamic_periods(
 
     elif period =="quarter":
         start_quarter = ((timestamp.month - 1) // 3) * 3 + 1
-        start = timestamp.replace(month=start_quarter, day=1)
-        start.replace(hour=0, minute=0, second=0)
+        start = timestamp.replace(month=start_quarter, day=1, hour=0, minute=0, second=0)
         end_quarter_month = ((timestamp.month - 1) // 3 + 1) * 3 
         end_quarter_day = calendar.monthrange(
             timestamp.year, 
@@ -92,15 +100,16 @@ def _dynamic_periods(
         )
         
         if previous_period:
+            from dateutil.relativedelta import relativedelta
             start = start - relativedelta(months=3)
-            start.replace(hour=0, minute=0, second=0)
             end_month = start.month + 2
             end_day = calendar.monthrange(
                 start.year, 
                 end_month
             )[1]
 
-            end = end.replace(
+            # from start, end keeps the year of the current quarter otherwise
+            end = start.replace(
                 month=end_month,
                 day=end_day,
                 hour=23,
@@ -119,9 +128,183 @@ def _dynamic_periods(
     return start, end
  
 
+def _completions(tracking_df: pd.DataFrame) -> list:
+
+    """ Returns (timestamp, period) of every completion in tracking data, the latest first. """
+
+    completed = tracking_df[tracking_df["status"] == "streak complete"]
+    timestamps = completed["timestamp"].dt.to_pydatetime()
+
+    return sorted(
+        zip(timestamps, completed["current_period"]),
+        key = lambda completion: completion[0],
+        reverse = True
+    )
+
+
+def _period_index(period: str, timestamp: datetime) -> int:
+
+    """ Numbers the periods, so consecutive periods have consecutive numbers. """
+
+    if period == "day":
+        return timestamp.toordinal()
+    if period == "week":
+        # ordinal 1 is a monday
+        return (timestamp.toordinal() - 1) // 7
+    if period == "month":
+        return timestamp.year * 12 + timestamp.month - 1
+    if period == "quarter":
+        return timestamp.year * 4 + (timestamp.month - 1) // 3
+    return timestamp.year
+
+
+def _period_indices(period: str, timestamps: np.ndarray) -> np.ndarray:
+
+    """ Vectorized _period_index for a datetime64 array. """
+
+    import numpy as np
+
+    if period in ("day", "week"):
+        # days since 1970-01-01 plus the ordinal of 1970-01-01
+        ordinals = timestamps.astype("datetime64[D]").astype(np.int64) + 719163
+        return ordinals if period == "day" else (ordinals - 1) // 7
+
+    months = timestamps.astype("datetime64[M]").astype(np.int64) + 1970 * 12
+    if period == "month":
+        return months
+    if period == "quarter":
+        return months // 3
+    return months // 12
+
+
+def _current_streak(
+        completions: list,
+        period: str,
+        today: datetime
+) -> int:
+
+    """ Counts the periods completed in a row back from the current period.
+
+    Parameter:
+    -----
+        completions (list): 
+            (timestamp, period) of the completions, the latest first.
+
+        period (str): 
+            The period of the habit.
+
+        today (datetime): 
+            The reference timestamp.
+
+    Returns:
+    --------
+        int: 
+            The current streak count, 0 if the current period is not completed.
+
+    """
+
+    count = 0
+    start, end = _dynamic_periods(
+        period = period,
+        timestamp = today,
+        previous_period = False
+    )
+
+    for timestamp, completion_period in completions:
+        # a second completion of a counted period
+        if timestamp > end:
+            continue
+
+        if timestamp < start:
+            break
+
+        count += 1
+        start, end = _dynamic_periods(
+            period = completion_period,
+            timestamp = timestamp,
+            previous_period = True
+        )
+
+    return count
+
+
+def _streak_series(
+        completions: list,
+        period: str,
+        today: datetime
+) -> list:
+
+    """ Splits the history of a habit into streaks and breaks, the latest first.
+
+    A streak is a run of completed periods, a break the number of periods
+    missed between two streaks. The current period is not missed until it
+    has ended.
+
+    Parameter:
+    -----
+        completions (list): 
+            (timestamp, period) of the completions, the latest first.
+
+        period (str): 
+            The period of the habit.
+
+        today (datetime): 
+            The reference timestamp.
+
+    Returns:
+    --------
+        list: 
+            (streak, 0) per streak and (0, missed periods) per break.
+
+    """
+
+    collector = []
+    streak_count = 0
+    current_period = True
+
+    start, end = _dynamic_periods(
+        period = period, 
+        timestamp = today, 
+        previous_period = False
+    )
+
+    for timestamp, completion_period in completions:
+        if timestamp > end:
+            continue
+
+        if timestamp < start:
+            if streak_count > 0:
+                collector.append((streak_count, 0))
+                streak_count = 0
+
+            missed = (
+                _period_index(completion_period, start) 
+                - _period_index(completion_period, timestamp)
+                - current_period
+            )
+            if missed > 0:
+                collector.append((0, missed))
+
+        streak_count += 1
+        current_period = False
+
+        start, end = _dynamic_periods(
+            period = completion_period, 
+            timestamp = timestamp, 
+            previous_period = True
+        )
+
+    if streak_count > 0:
+        collector.append((streak_count, 0))
+
+    return collector
+
+
+@metrics.timed(metrics.analysis_duration, "get_current_streak_series")
 def get_current_streak_series(
     name: str,
-    db_name: str = "main.db" 
+    db_name: str = "main.db",
+    full_history: bool = False
 ) -> int:
 
     """
@@ -135,6 +318,10 @@ def get_current_streak_series(
         db_name (str, optional): 
             Database file name. Defaults to "main.db".
 
+        full_history (bool, optional): 
+            Also count archived tracking data, see db.archive_tracking. 
+            Defaults to False.
+
     Returns:
     -------
         int: 
@@ -142,13 +329,10 @@ def get_current_streak_series(
 
     """
 
-    start = None
-    end = None
-    count = 0
-
     tracking_df = db.get_tracking_data(
         name = name,
-        db_name = db_name 
+        db_name = db_name,
+        full_history = full_history
     )
 
     habit_period = db.get_habit_data(
@@ -159,44 +343,20 @@ def get_current_streak_series(
     if tracking_df.empty:
         return 0 
 
-    tracking_df["timestamp"] = pd.to_datetime(tracking_df["timestamp"])
-    tracking_df.sort_values(
-        by="timestamp", 
-        ascending=False, 
-        inplace=True
-    )
-    
-    today = datetime.now().replace(microsecond=0)
-    start, end = _dynamic_periods(
+    return _current_streak(
+        completions = _completions(tracking_df),
         period = habit_period.iloc[0]["period"],
-        timestamp = today,
-        previous_period=False
+        today = datetime.now().replace(microsecond=0)
     )
-    
-    for index, row in tracking_df.iterrows():
-        if row["status"] != "streak complete":
-            continue
-
-        if row["status"] == "streak complete":
-            if start <= row["timestamp"] <= end:
-                count += 1
-                start, end = _dynamic_periods(
-                    period = row["current_period"],
-                    timestamp = row["timestamp"],
-                    previous_period=True
-                )
-
-            else:
-                break
-
-    return count
 
 
+@metrics.timed(metrics.analysis_duration, "get_habits_series")
 def get_habits_series(
         name: str = "all",
         period: str = None,
         all_series: bool = False,
-        db_name: str = "main.db"
+        db_name: str = "main.db",
+        full_history: bool = False
 ) -> pd.DataFrame:
 
     """ Retrieves habit tracking data with streaks and breaks.
@@ -212,6 +372,10 @@ def get_habits_series(
         all_series (bool, optional): 
             Whether to include all streaks and breaks. Defaults to False.
 
+        full_history (bool, optional): 
+            Also count archived tracking data, see db.archive_tracking. 
+            Defaults to False.
+
     Returns:
     --------
         pd.DataFrame: 
@@ -219,6 +383,8 @@ def get_habits_series(
 
     """
 
+    import pandas as pd
+
     today = datetime.now().replace(microsecond=0)
 
     df_all_habits = get_active_habits_for_period(period, db_name)
@@ -230,57 +396,20 @@ def get_habits_series(
     collector = []
 
     for habit in ls_habit_names:
-        streak_count = 0
-        break_count = 0
-
         habit_data = db.get_habit_data(name=habit, db_name=db_name)
         if habit_data.empty:
             continue  
         
-        tracking_df = db.get_tracking_data(name=habit, db_name=db_name)
+        tracking_df = db.get_tracking_data(name=habit, db_name=db_name, full_history=full_history)
         if tracking_df.empty:
             continue  
 
-        tracking_df["timestamp"] = pd.to_datetime(tracking_df["timestamp"])
-        tracking_df.sort_values(by="timestamp", ascending=False, inplace=True)
-
-        start, end = _dynamic_periods(
-            period=habit_data.iloc[0]["period"], 
-            timestamp=today, 
-            previous_period=False
+        series = _streak_series(
+            completions = _completions(tracking_df),
+            period = habit_data.iloc[0]["period"],
+            today = today
         )
-
-        for _, row in tracking_df.iterrows():
-            if row["status"] != "streak complete":
-                continue
-
-            if start <= row["timestamp"] <= end:
-                streak_count += 1
-
-                start, end = _dynamic_periods(
-                    period=row["current_period"], 
-                    timestamp=row["timestamp"], 
-                    previous_period=True
-                )
-
-                if break_count > 0:
-                    collector.append((habit, 0, break_count))    
-                    break_count = 0
-
-            else:
-                if streak_count > 0:
-                    collector.append((habit, streak_count, 0))
-                    streak_count = 0
-
-                break_count += 1
-
-                start, end = _dynamic_periods(
-                    period=row["current_period"], 
-                    timestamp=row["timestamp"], 
-                    previous_period=True
-                )
-            
-            collector.append((habit, streak_count, break_count))
+        collector.extend((habit, streak, breaks) for streak, breaks in series)
 
     df_result = pd.DataFrame(collector, columns=["name", "streak_series", "break_series"])
 
@@ -313,8 +442,10 @@ def get_active_habits_for_period(
     
     """
 
+    import pandas as pd
+
     all_habits = db.get_habit_data(db_name=db_name)
-    all_habits = all_habits[all_habits["active"] == 1]
+    all_habits = all_habits[all_habits["active"]]
 
     if not isinstance(all_habits, pd.DataFrame) or all_habits.empty:
         return pd.DataFrame(columns=["name", "period"])
@@ -331,3 +462,441 @@ def get_active_habits_for_period(
         
         else:
             return pd.DataFrame(columns=["name", "period"])
+
+
+# precomputed analysis snapshots
+
+def _is_snapshot_fresh(
+        snapshot: dict,
+        today: datetime
+) -> bool:
+
+    """ Checks if a snapshot still matches the data it was computed from.
+
+    A snapshot turns stale when the habit got new tracking data, when any
+    tracking row was updated or deleted, when its period was changed or
+    when a new period started since it was computed.
+
+    """
+
+    if snapshot is None:
+        return False
+
+    start, _ = _dynamic_periods(
+        period = snapshot["habit_period"],
+        timestamp = today,
+        previous_period = False
+    )
+
+    return (
+        snapshot["period"] == snapshot["habit_period"]
+        and snapshot["last_tracking_id"] == (snapshot["current_tracking_id"] or 0)
+        and snapshot["rewrites"] == snapshot["current_rewrites"]
+        and snapshot["period_start"] == start.strftime("%Y-%m-%d %H:%M:%S")
+    )
+
+
+@metrics.timed(metrics.analysis_duration, "compute_snapshot")
+def compute_snapshot(
+        name: str,
+        db_name: str = "main.db",
+        store: bool = True
+) -> dict:
+
+    """ Computes the analysis results of a habit live and stores them as snapshot.
+
+    Parameter:
+    -----
+        name (str): 
+            Name of the habit.
+
+        db_name (str, optional): 
+            Database file name. Defaults to "main.db".
+
+        store (bool, optional): 
+            Whether to store the results as snapshot. Defaults to True.
+
+    Returns:
+    --------
+        dict: 
+            The snapshot with current_streak, longest_streak and series,
+            or None if the habit is not in the database.
+
+    """
+
+    habit_data = db.get_habit_data(name=name, db_name=db_name)
+    if habit_data.empty:
+        return None
+
+    period = habit_data.iloc[0]["period"]
+    today = datetime.now().replace(microsecond=0)
+
+    # read before computing, a write in between makes the snapshot stale
+    last_tracking_id = db.get_last_tracking_id(name=name, db_name=db_name)
+    rewrites = db.get_tracking_rewrites(db_name=db_name)
+
+    # archived streaks still count for the longest streak
+    current_streak = get_current_streak_series(name=name, db_name=db_name, full_history=True)
+    df_series = get_habits_series(name=name, all_series=True, db_name=db_name, full_history=True)
+    series = [
+        [int(streak), int(breaks)] 
+        for streak, breaks in zip(df_series["streak_series"], df_series["break_series"])
+    ]
+    longest_streak = max((streak for streak, _ in series), default=0)
+
+    start, _ = _dynamic_periods(
+        period = period,
+        timestamp = today,
+        previous_period = False
+    )
+
+    if store:
+        db.save_snapshot(
+            name = name,
+            period = period,
+            period_start = start,
+            last_tracking_id = last_tracking_id,
+            rewrites = rewrites,
+            current_streak = current_streak,
+            longest_streak = longest_streak,
+            series = series,
+            db_name = db_name
+        )
+
+    return {
+        "name": name,
+        "current_streak": current_streak,
+        "longest_streak": longest_streak,
+        "series": series
+    }
+
+
+def get_habit_snapshot(
+        name: str,
+        db_name: str = "main.db"
+) -> dict:
+
+    """ Retrieves the analysis results of a habit from its snapshot.
+
+    Falls back to a live computation, when there is no snapshot or the
+    snapshot is stale. Reading stores nothing, snapshots are written by
+    refresh_snapshots, see precompute.SnapshotWorker.
+
+    Parameter:
+    -----
+        name (str): 
+            Name of the habit.
+
+        db_name (str, optional): 
+            Database file name. Defaults to "main.db".
+
+    Returns:
+    --------
+        dict: 
+            The snapshot with current_streak, longest_streak and series,
+            or None if the habit is not in the database.
+
+    """
+
+    snapshot = db.get_snapshot(name=name, db_name=db_name)
+    today = datetime.now().replace(microsecond=0)
+    fresh = _is_snapshot_fresh(snapshot, today)
+
+    if metrics.enabled:
+        metrics.snapshot_requests.inc(1, "hit" if fresh else "miss")
+
+    if fresh:
+        return snapshot
+
+    return compute_snapshot(name=name, db_name=db_name, store=False)
+
+
+def get_habit_snapshots(
+        names: list,
+        db_name: str = "main.db"
+) -> dict:
+
+    """ Same as get_habit_snapshot for several habits, reading all snapshots at once.
+
+    Parameter:
+    -----
+        names (list): 
+            Names of the habits.
+
+        db_name (str, optional): 
+            Database file name. Defaults to "main.db".
+
+    Returns:
+    --------
+        dict: 
+            The snapshot of every habit in the database, by name.
+
+    """
+
+    snapshots = db.get_snapshots(names=names, db_name=db_name)
+    today = datetime.now().replace(microsecond=0)
+
+    results = {}
+    for name in names:
+        snapshot = snapshots.get(name)
+        fresh = _is_snapshot_fresh(snapshot, today)
+
+        if metrics.enabled:
+            metrics.snapshot_requests.inc(1, "hit" if fresh else "miss")
+
+        if not fresh:
+            snapshot = compute_snapshot(name=name, db_name=db_name, store=False)
+        if snapshot is not None:
+            results[name] = snapshot
+
+    return results
+
+
+def get_habits_series_from_snapshots(
+        period: str = None,
+        db_name: str = "main.db"
+) -> pd.DataFrame:
+
+    """ Same result as get_habits_series(all_series=True), read from snapshots.
+
+    Parameter:
+    -----
+        period (str, optional): 
+            Specific period to filter habits. Defaults to None.
+
+        db_name (str, optional): 
+            Database file name. Defaults to "main.db".
+
+    Returns:
+    --------
+        pd.DataFrame: 
+            DataFrame containing habit streak and break data.
+
+    """
+
+    import pandas as pd
+
+    collector = []
+    snapshots = get_habit_snapshots(
+        names = get_active_habits_for_period(period, db_name)["name"].tolist(),
+        db_name = db_name
+    )
+    for habit, snapshot in snapshots.items():
+        collector.extend(
+            (habit, streak, breaks) for streak, breaks in snapshot["series"]
+        )
+
+    return pd.DataFrame(collector, columns=["name", "streak_series", "break_series"])
+
+
+# analysis on the period cache, see periodcache.py
+
+def _current_streak_indices(indices: np.ndarray, today_index: int) -> int:
+
+    """ _current_streak on the sorted, unique period indices of the completions. """
+
+    import numpy as np
+
+    indices = indices[:np.searchsorted(indices, today_index, side="right")]
+    if len(indices) == 0 or indices[-1] != today_index:
+        return 0
+
+    # index minus position is the same for all periods of a streak
+    runs = indices - np.arange(len(indices))
+    return int(len(indices) - np.searchsorted(runs, runs[-1]))
+
+
+def _streak_series_indices(indices: np.ndarray, today_index: int) -> list:
+
+    """ _streak_series on the sorted, unique period indices of the completions. """
+
+    import numpy as np
+
+    indices = indices[:np.searchsorted(indices, today_index, side="right")]
+    if len(indices) == 0:
+        return []
+
+    ends = np.append(np.flatnonzero(np.diff(indices) > 1) + 1, len(indices))
+    starts = np.insert(ends[:-1], 0, 0)
+    lengths = (ends - starts).tolist()
+    missed = (indices[starts[1:]] - indices[ends[:-1] - 1] - 1).tolist()
+
+    collector = []
+    if today_index - 1 - indices[-1] > 0:
+        collector.append((0, int(today_index - 1 - indices[-1])))
+
+    for run in range(len(lengths) - 1, -1, -1):
+        collector.append((lengths[run], 0))
+        if run > 0:
+            collector.append((0, missed[run - 1]))
+
+    return collector
+
+
+@metrics.timed(metrics.analysis_duration, "get_streaks_from_cache")
+def get_streaks_from_cache(
+        names: list = None,
+        db_name: str = "main.db"
+) -> dict:
+
+    """ Computes the streaks of habits on the memory-mapped period cache.
+
+    The cache is brought up to date first, which reads only the tracking 
+    rows written since its last update. The completions are counted in the 
+    current period of the habit.
+
+    Parameter:
+    -----
+        names (list, optional): 
+            Names of the habits. Defaults to None, meaning all habits.
+
+        db_name (str, optional): 
+            Database file name. Defaults to "main.db".
+
+    Returns:
+    --------
+        dict: 
+            current_streak, longest_streak and series by name, like a 
+            snapshot. Habits not in the database are left out.
+
+    """
+
+    import periodcache
+
+    cache = periodcache.open_cache(db_name)
+    cache.update()
+    today = datetime.now().replace(microsecond=0)
+
+    results = {}
+    for name in cache.names() if names is None else names:
+        period = cache.period(name)
+        if period is None:
+            continue
+
+        indices = cache.indices(name)
+        today_index = _period_index(period, today)
+        series = _streak_series_indices(indices, today_index)
+        results[name] = {
+            "current_streak": _current_streak_indices(indices, today_index),
+            "longest_streak": max((streak for streak, _ in series), default=0),
+            "series": [list(entry) for entry in series],
+        }
+
+    return results
+
+
+def get_habits_series_from_cache(
+        period: str = None,
+        db_name: str = "main.db"
+) -> pd.DataFrame:
+
+    """ Same result as get_habits_series(all_series=True), computed on the period cache.
+
+    Parameter:
+    -----
+        period (str, optional): 
+            Specific period to filter habits. Defaults to None.
+
+        db_name (str, optional): 
+            Database file name. Defaults to "main.db".
+
+    Returns:
+    --------
+        pd.DataFrame: 
+            DataFrame containing habit streak and break data.
+
+    """
+
+    import pandas as pd
+
+    collector = []
+    streaks = get_streaks_from_cache(
+        names = get_active_habits_for_period(period, db_name)["name"].tolist(),
+        db_name = db_name
+    )
+    for habit, result in streaks.items():
+        collector.extend(
+            (habit, streak, breaks) for streak, breaks in result["series"]
+        )
+
+    return pd.DataFrame(collector, columns=["name", "streak_series", "break_series"])
+
+
+@metrics.timed(metrics.analysis_duration, "get_completions_per_period")
+def get_completions_per_period(
+        granularity: str = "month",
+        period: str = None,
+        db_name: str = "main.db"
+) -> pd.DataFrame:
+
+    """ Counts the completions of the active habits per week, month, quarter or year.
+
+    Reads tracking_rollups instead of the tracking rows, so years of history,
+    including the archive, are counted from one row per habit and period.
+    Habits with a longer period than granularity count at the start of their
+    own period.
+
+    Parameter:
+    -----
+        granularity (str, optional): 
+            week, month, quarter or year. Defaults to "month".
+
+        period (str, optional): 
+            Specific period to filter habits. Defaults to None.
+
+        db_name (str, optional): 
+            Database file name. Defaults to "main.db".
+
+    Returns:
+    --------
+        pd.DataFrame: 
+            One row per bucket and one column per habit, the completions,
+            0 where a habit has none.
+
+    """
+
+    names = get_active_habits_for_period(period, db_name)["name"].tolist()
+    rollups = db.get_rollups(names = names, granularity = granularity, db_name = db_name)
+
+    counts = rollups.pivot_table(
+        index = "bucket",
+        columns = "name",
+        values = "completions",
+        aggfunc = "sum",
+        fill_value = 0,
+        observed = True
+    )
+    counts.columns = counts.columns.astype(str)
+    counts.columns.name = None
+
+    return counts.reindex(columns = [name for name in names if name in counts.columns])
+
+
+def refresh_snapshots(db_name: str = "main.db") -> int:
+
+    """ Recomputes all stale snapshots of active habits.
+
+    Parameter:
+    -----
+        db_name (str, optional): 
+            Database file name. Defaults to "main.db".
+
+    Returns:
+    --------
+        int: 
+            The number of recomputed snapshots.
+
+    """
+
+    today = datetime.now().replace(microsecond=0)
+    count = 0
+
+    habits = db.get_active(db_name=db_name)
+    snapshots = db.get_snapshots(names=habits, db_name=db_name)
+
+    for habit in habits:
+        if not _is_snapshot_fresh(snapshots.get(habit), today):
+            compute_snapshot(name=habit, db_name=db_name)
+            count += 1
+
+    return count
@@ -0,0 +1,305 @@
+import db
+import analysis
+import metrics
+import precompute
+from habit import Habit
+
+import argparse
+import json
+import select
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+# Endpoints:
+#   GET  /habits?active=true|false       list habits
+#   GET  /habits/<name>/streak           current and longest streak of a habit
+#   GET  /series?period=<period>         streak and break series of active habits
+#   POST /habits/<name>/complete         mark a habit as complete, body {"date": ...} optional
+#   POST /complete                       mark several habits complete, body {"names": [...], "date": ...}
+
+
+class HabitRequestHandler(BaseHTTPRequestHandler):
+
+    """ Serves the habit tracker operations as JSON endpoints. 
+
+    Connections are kept alive, but closed after timeout seconds without a
+    request and as soon as other connections wait for a worker, so idle
+    clients do not hold the workers of PooledHTTPServer.
+
+    """
+
+    protocol_version = "HTTP/1.1"
+    db_name = "main.db"
+    timeout = 5.0
+
+
+    def handle(self):
+
+        """ Handles the requests of a connection while it is not idle too long. """
+
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self._wait_for_request():
+            self.handle_one_request()
+
+
+    def _wait_for_request(self) -> bool:
+
+        """ Waits for the next request, False after timeout or when the workers are needed. """
+
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            if self.server.saturated():
+                return False
+            readable, _, _ = select.select([self.connection], [], [], 0.1)
+            if readable:
+                return True
+        return False
+
+
+    def do_GET(self):
+
+        """ Handles the read endpoints, answering 304 while the data is unchanged. """
+
+        url = urlparse(self.path)
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        query = parse_qs(url.query)
+
+        if parts == ["habits"]:
+            handler = self._list_habits
+        elif len(parts) == 3 and parts[0] == "habits" and parts[2] == "streak":
+            handler = self._streak
+        elif parts == ["series"]:
+            handler = self._series
+        else:
+            return self._send_json(404, {"error": "not found"})
+
+        # streaks also change when a new day starts
+        etag = f'"{db.get_write_version(self.db_name)}-{date.today().isoformat()}"'
+        if self.headers.get("If-None-Match") == etag:
+            return self._send_json(304, None, etag)
+
+        status, body = handler(parts, query)
+        self._send_json(status, body, etag if status == 200 else None)
+
+
+    def do_POST(self):
+
+        """ Handles the write endpoints. """
+
+        parts = [unquote(part) for part in urlparse(self.path).path.strip("/").split("/")]
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._send_json(400, {"error": "invalid JSON body"})
+        if not isinstance(payload, dict):
+            return self._send_json(400, {"error": "the body must be a JSON object"})
+
+        if len(parts) == 3 and parts[0] == "habits" and parts[2] == "complete":
+            names = [parts[1]]
+        elif parts == ["complete"]:
+            names = payload.get("names")
+            if not isinstance(names, list) or not names:
+                return self._send_json(400, {"error": "names must be a non empty list"})
+        else:
+            return self._send_json(404, {"error": "not found"})
+
+        timestamp = payload.get("date")
+        if timestamp is not None:
+            timestamp = db.parse_date(timestamp)
+            if timestamp is None:
+                return self._send_json(400, {"error": 'date must be "YYYY-MM-DD" or "YYYY-MM-DD HH:MM:SS"'})
+
+        try:
+            results = db.streak_complete_batch(
+                names = names,
+                date = timestamp,
+                db_name = self.db_name
+            )
+        except sqlite3.Error as e:
+            return self._send_json(500, {"error": str(e)})
+
+        completed = [result.endswith("streak completed") for result in results]
+        status = 404 if len(names) == 1 and not completed[0] else 200
+        self._send_json(status, {"results": results})
+
+
+    def _list_habits(self, parts, query):
+        habits = db.get_habit_data(db_name=self.db_name)
+
+        if "active" in query:
+            active = query["active"][0].lower() in ("1", "true", "yes")
+            habits = habits[habits["active"] == active]
+
+        return 200, [
+            {
+                "name": row["name"],
+                "description": row["description"],
+                "period": row["period"],
+                "active": bool(row["active"])
+            }
+            for _, row in habits.iterrows()
+        ]
+
+
+    def _streak(self, parts, query):
+        snapshot = analysis.get_habit_snapshot(name=parts[1], db_name=self.db_name)
+        if snapshot is None:
+            return 404, {"error": f"{parts[1]} not in database"}
+
+        return 200, {
+            "name": parts[1],
+            "current_streak": snapshot["current_streak"],
+            "longest_streak": snapshot["longest_streak"]
+        }
+
+
+    def _series(self, parts, query):
+        period = query.get("period", ["all"])[0]
+        if period not in Habit.valid_periods + ("all", ):
+            return 400, {"error": f"period must be one of {Habit.valid_periods + ('all', )}"}
+        series = analysis.get_habits_series_from_snapshots(
+            period = period,
+            db_name = self.db_name
+        )
+        return 200, series.to_dict(orient="records")
+
+
+    def _send_json(self, status, body, etag=None):
+        data = b"" if body is None else json.dumps(body, default=int).encode()
+
+        self.send_response(status)
+        if self.server.saturated():
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        if etag:
+            self.send_header("ETag", etag)
+        if body is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    def log_message(self, format, *args):
+        # keep load tests quiet
+        pass
+
+
+class PooledHTTPServer(HTTPServer):
+
+    """ HTTP server handling requests on a fixed pool of threads.
+
+    Together with db.enable_connection_pool every worker thread keeps its
+    database connection open, instead of opening one per request.
+
+    """
+
+    def __init__(self, server_address, handler_class, workers: int = 8):
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._connections = 0
+        self._connections_lock = threading.Lock()
+
+
+    def saturated(self) -> bool:
+
+        """ Whether connections are waiting for a worker. """
+
+        return self._connections > self.workers
+
+
+    def process_request(self, request, client_address):
+        with self._connections_lock:
+            self._connections += 1
+        self.executor.submit(self._process_request, request, client_address)
+
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._connections_lock:
+                self._connections -= 1
+
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+def create_server(
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    db_name: str = "main.db",
+    workers: int = 8,
+    timeout: float = HabitRequestHandler.timeout
+) -> PooledHTTPServer:
+
+    """ Creates the API server, the database tables and switches on connection pooling.
+
+    Parameter:
+    ----------
+        host (str, optional):
+            Address to listen on. Defaults to '127.0.0.1'.
+
+        port (int, optional):
+            Port to listen on, 0 picks a free port. Defaults to 8000.
+
+        db_name (str, optional):
+            Database file name. Defaults to 'main.db'.
+
+        workers (int, optional):
+            Number of worker threads. Defaults to 8.
+
+        timeout (float, optional):
+            Seconds an idle keep-alive connection stays open. Defaults to 5.0.
+
+    Returns:
+    --------
+        PooledHTTPServer:
+            The server, not yet serving.
+
+    """
+
+    db.ensure_schema(db_name)
+    db.enable_connection_pool()
+
+    handler = type("HabitRequestHandler", (HabitRequestHandler, ), {"db_name": db_name, "timeout": timeout})
+    return PooledHTTPServer((host, port), handler, workers=workers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="JSON API of the habit tracker")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--db", default="main.db")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+    parser.add_argument("--precompute", action="store_true", help="keep the streak snapshots up to date in a worker thread")
+    args = parser.parse_args()
+
+    if args.metrics_port is not None:
+        metrics.serve(args.host, args.metrics_port)
+
+    server = create_server(args.host, args.port, args.db, args.workers)
+    if args.precompute:
+        precompute.SnapshotWorker(db_name=args.db).start()
+    print(f"Serving the habit tracker API on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,163 @@
+import argparse
+import http.client
+import json
+import threading
+import time
+from urllib.parse import quote
+
+# Load test for api.py. Every client thread keeps one HTTP connection open
+# and sends requests in a loop until the duration is over.
+
+
+def _client(host, port, paths, deadline, use_etag, complete_every, latencies, errors):
+    con = http.client.HTTPConnection(host, port, timeout=10)
+    etags = {}
+    i = 0
+
+    while time.perf_counter() < deadline:
+        i += 1
+        headers = {}
+
+        if complete_every and i % complete_every == 0:
+            method, path, body = "POST", paths["complete"], b"{}"
+            headers["Content-Type"] = "application/json"
+        else:
+            method, path, body = "GET", paths["reads"][i % len(paths["reads"])], None
+            if use_etag and path in etags:
+                headers["If-None-Match"] = etags[path]
+
+        start = time.perf_counter()
+        try:
+            con.request(method, path, body=body, headers=headers)
+            response = con.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            errors.append(path)
+            con.close()
+            con = http.client.HTTPConnection(host, port, timeout=10)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+        if response.status >= 500:
+            errors.append(path)
+        if response.getheader("ETag"):
+            etags[path] = response.getheader("ETag")
+
+    con.close()
+
+
+def run_load_test(
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    concurrency: int = 8,
+    duration: float = 10.0,
+    use_etag: bool = True,
+    complete_every: int = 0
+) -> dict:
+
+    """ Sends requests to a running API server and measures the latencies.
+
+    Parameter:
+    ----------
+        host (str, optional):
+            Address of the server. Defaults to '127.0.0.1'.
+
+        port (int, optional):
+            Port of the server. Defaults to 8000.
+
+        concurrency (int, optional):
+            Number of clients sending requests at the same time. Defaults to 8.
+
+        duration (float, optional):
+            Seconds to run the test. Defaults to 10.0.
+
+        use_etag (bool, optional):
+            Send If-None-Match with the last ETag of a path. Defaults to True.
+
+        complete_every (int, optional):
+            Every n-th request of a client marks a habit complete, 0 for
+            reads only. Defaults to 0.
+
+    Returns:
+    --------
+        dict:
+            Number of requests and errors, requests per second and latency
+            percentiles in milliseconds.
+
+    """
+
+    con = http.client.HTTPConnection(host, port, timeout=10)
+    con.request("GET", "/habits?active=true")
+    habits = json.loads(con.getresponse().read())
+    con.close()
+
+    if not habits:
+        raise ValueError("The database has no active habits to test with")
+
+    names = [quote(habit["name"]) for habit in habits]
+    paths = {
+        "reads": ["/habits", "/series"] + [f"/habits/{name}/streak" for name in names],
+        "complete": f"/habits/{names[0]}/complete",
+    }
+
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(
+            target=_client,
+            args=(host, port, paths, deadline, use_etag, complete_every, latencies, errors)
+        )
+        for _ in range(concurrency)
+    ]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    def percentile(p):
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000
+
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": percentile(50),
+        "p99_ms": percentile(99),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test for the habit tracker API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="concurrent clients, each keeps its connection alive")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--no-etag", action="store_true",
+                        help="do not send If-None-Match headers")
+    parser.add_argument("--complete-every", type=int, default=0,
+                        help="every n-th request marks a habit complete")
+    args = parser.parse_args()
+
+    result = run_load_test(
+        host = args.host,
+        port = args.port,
+        concurrency = args.concurrency,
+        duration = args.duration,
+        use_etag = not args.no_etag,
+        complete_every = args.complete_every
+    )
+
+    print(f"requests:     {result['requests']}")
+    print(f"errors:       {result['errors']}")
+    print(f"requests/sec: {result['requests_per_second']:.1f}")
+    print(f"p50 latency:  {result['p50_ms']:.2f} ms")
+    print(f"p99 latency:  {result['p99_ms']:.2f} ms")
@@ -3,28 +3,66 @@ import streamlit as st
 from habit import Habit
 import db
 import analysis
+import precompute
+import querystats
+import profiler
+import metrics
 
+import os
 from datetime import datetime, timedelta
 
 st.set_page_config(layout="wide")
 
 # Create an instance of the database with tables 
-# if not already created
-db.create_tables()
+# if not already created, only checked once per process
+db.ensure_schema()
 
-st.title("Track your habits!")
 
-# some motivation for a completed habit ;) 
-if "show_balloons" in st.session_state and st.session_state["show_balloons"]:
-    st.balloons()
-    del st.session_state["show_balloons"] 
+# optional background worker keeping the analysis snapshots warm,
+# started once per process
+@st.cache_resource
+def start_snapshot_worker():
+    worker = precompute.SnapshotWorker()
+    worker.start()
+    return worker
+
+if os.environ.get("HABIT_TRACKER_PRECOMPUTE") == "1":
+    start_snapshot_worker()
+
+
+# Prometheus metrics on a local port or in a file, started once per process
+@st.cache_resource
+def start_metrics_export():
+    if os.environ.get("HABIT_TRACKER_METRICS_PORT"):
+        return metrics.serve(port=int(os.environ["HABIT_TRACKER_METRICS_PORT"]))
+    return metrics.write_file_every(os.environ["HABIT_TRACKER_METRICS_FILE"])
+
+if os.environ.get("HABIT_TRACKER_METRICS_PORT") or os.environ.get("HABIT_TRACKER_METRICS_FILE"):
+    start_metrics_export()
+
+# hidden debug panel with the statements of a render, opened with ?debug=1
+# or HABIT_TRACKER_QUERY_STATS=1, instrumented for this render only
+debug = st.query_params.get("debug") == "1" or os.environ.get("HABIT_TRACKER_QUERY_STATS") == "1"
+if debug:
+    querystats.enable(this_thread=True)
+    render_stats = querystats.begin()
+
+# render profile in the sidebar, opened with ?profile=1 or HABIT_TRACKER_PROFILE=1
+profiling = st.query_params.get("profile") == "1" or profiler.enabled
+if profiling:
+    render_profile = profiler.start()
+
+st.title("Track your habits!")
 
 # define tabs
+# tabs track their state, so hidden tabs can skip their work
 tab_active_habits, tab_analysis, tab_inactive = st.tabs(
     ["Your active Habits", 
      "Analyze your habits",
      "Inactive Habits"
-    ]
+    ],
+    key = "main_tabs",
+    on_change = "rerun"
 )
 
 # set dialog boxes for buttons
@@ -181,106 +219,251 @@ def add_test_data():
                 )
 
 
+def load_habit(row) -> Habit:
+
+    """ Creates a Habit object from a row of db.get_habits_page """
+
+    return Habit.from_db(
+        name = row["name"],
+        description = row["description"],
+        period = row["period"],
+        active = row["active"]
+    )
+
+
+def mark_completed(habit):
+
+    """ Callback of the "Mark completed" button. Runs before the card
+        is re-rendered, so the card shows up as completed right away.
+    """
+
+    habit.mark_as_complete()
+    st.session_state[f"show_balloons_{habit.name}"] = True
+
+
+# every habit card is a fragment, so a click only re-renders this card
+@st.fragment
+def active_habit_card(habit, current_streak=None):
+    # some motivation for a completed habit ;)
+    if st.session_state.pop(f"show_balloons_{habit.name}", False):
+        st.balloons()
+
+    if habit.streak_complete == False:
+        with st.container(border=True):
+            col_1, col_2 = st.columns(2)
+
+            # col_1 contains information about the habit
+            with col_1:
+                st.header(body = habit.name, divider='blue')
+                st.subheader(habit.description)
+                st.text(f"Period: {habit.period}")
+
+                # col_2 with current streak series and button
+                with col_2:
+                    st.button(
+                        "Mark completed",
+                        key=f"{habit.name}_complete",
+                        on_click=mark_completed,
+                        args=(habit, )
+                    )
+                    if st.button("Modify Habit", key=f"{habit.name}_modify"):
+                        modify_button(habit)
+                    if st.button("Delete Habit", key=f"{habit.name}_delete"):
+                        delete_button(habit)
+
+                    # uncomment, to activate cheating
+                    # if st.button(label="Add Fake Data", key=f"{habit.name}_fake_data"):
+                    #     add_fake_data_button(habit)
+
+    else:
+        # expander to save space, rest same as above
+        # current streak series insted of mark complete button
+        with st.expander(label=habit.name):
+            col_1, col_2 = st.columns(2)
+            with col_1:
+                st.header(body = habit.name, divider='blue')
+                st.subheader(habit.description)
+                st.text(f"Period: {habit.period}")
+
+            with col_2:
+                # read on its own, when the card was just marked completed
+                if current_streak is None:
+                    # None once the habit was deleted or renamed meanwhile
+                    snapshot = analysis.get_habit_snapshot(habit.name)
+                    current_streak = snapshot["current_streak"] if snapshot else 0
+                if current_streak > 0:
+                    st.markdown(f"Current Streak series: :green[{current_streak}]")
+                else:
+                    st.markdown(f"Current Streak series: :red[{current_streak}]")
+                if st.button("Modify Habit", key=f"{habit.name}_modify"):
+                    modify_button(habit)
+                if st.button("Delete Habit", key=f"{habit.name}_delete"):
+                    delete_button(habit)
+
+                # uncomment, to activate cheating
+                # if st.button(label="Add Fake Data", key=f"{habit.name}_fake_data"):
+                #     add_fake_data_button(habit)
+
+
+@st.fragment
+def inactive_habit_card(habit):
+    with st.container(border=True):
+        col_1, col_2= st.columns(2)
+
+        # information for the habit
+        with col_1:
+            st.header(body = habit.name, divider='blue')
+            st.subheader(habit.description)
+            st.text(f"Period: {habit.period}")
+
+        # buttons for the habit
+        with col_2:
+            if st.button("Modify Habit", key=f"{habit.name}_modify"):
+                modify_button(habit)
+            if st.button("Delete Habit", key=f"{habit.name}_delete"):
+                delete_button(habit)
+
+
+# paging of the habit lists, only the visible page is loaded
+page_sizes = (10, 25, 50, 100)
+sort_orders = ("name", "period", "last completed")
+
+
+def reset_paging(section):
+    st.session_state[f"{section}_page_keys"] = [None]
+
+
+def paged_habits(section, active):
+
+    """ Renders search, sort and paging controls for a habit list
+        and returns the habits of the visible page.
+    """
+
+    page_keys_name = f"{section}_page_keys"
+    if page_keys_name not in st.session_state:
+        reset_paging(section)
+
+    col_search, col_sort, col_order, col_size = st.columns(4)
+    with col_search:
+        search = st.text_input(
+            label = "Search",
+            key = f"{section}_search",
+            on_change = reset_paging,
+            args = (section, )
+        )
+    with col_sort:
+        sort_by = st.selectbox(
+            label = "Sort by",
+            options = sort_orders,
+            key = f"{section}_sort_by",
+            on_change = reset_paging,
+            args = (section, )
+        )
+    with col_order:
+        descending = st.toggle(
+            label = "Descending",
+            key = f"{section}_descending",
+            on_change = reset_paging,
+            args = (section, )
+        )
+    with col_size:
+        page_size = st.selectbox(
+            label = "Habits per page",
+            options = page_sizes,
+            key = f"{section}_page_size",
+            on_change = reset_paging,
+            args = (section, )
+        )
+
+    # every entry is the key of the last habit of the previous page
+    page_keys = st.session_state[page_keys_name]
+
+    # one habit more than needed, to know if there is a next page
+    page = db.get_habits_page(
+        active = active,
+        search = search,
+        sort_by = sort_by,
+        descending = descending,
+        after = page_keys[-1],
+        page_size = page_size + 1
+    )
+    has_next_page = len(page) > page_size
+    page = page.iloc[:page_size]
+    total = db.count_habits(active = active, search = search)
+
+    col_previous, col_info, col_next = st.columns(3)
+    with col_previous:
+        st.button(
+            "Previous page",
+            key = f"{section}_previous_page",
+            disabled = len(page_keys) == 1,
+            on_click = page_keys.pop
+        )
+    with col_info:
+        st.text(f"Page {len(page_keys)} of {max(1, -(-total // page_size))} ({total} habits)")
+    with col_next:
+        last_key = (page.iloc[-1]["sort_key"], page.iloc[-1]["name"]) if has_next_page else None
+        st.button(
+            "Next page",
+            key = f"{section}_next_page",
+            disabled = not has_next_page,
+            on_click = page_keys.append,
+            args = (last_key, )
+        )
+
+    return page
+
+
 # tab with all active habits
-with tab_active_habits:
-    active_habits = db.get_active()
-    inactive_habits = db.get_inactive()
+def active_habits_tab():
     st.subheader("Create your first habit")
     if st.button(label="Create Habit", key=4):
         Add_habit_button()
-    if active_habits == [] and inactive_habits == []:
+    if db.count_habits(active=True) == 0 and db.count_habits(active=False) == 0:
         if st.button("Add Test Data"):
             add_test_data()
             st.rerun()
+        return
 
-    else:
-        st.subheader("📌 Habits Not Completed This Period")
-
-        # create an object for every active habit
-        for habit_entry in active_habits:
-            habit_name = habit_entry
-            habit_data = db.get_habit_data(habit_name)
-            habit = Habit(
-                name = habit_data.iloc[0]["name"],
-                description = habit_data.iloc[0]["description"],
-                period = habit_data.iloc[0]["period"],
-                active = habit_data.iloc[0]["active"]
-            )
+    import pandas as pd
 
+    habit_page = paged_habits("active", active=True)
+
+    # check every habit of the page once and sort it into its section,
+    # the latest entry of every habit comes with the page
+    open_habits = []
+    completed_habits = []
+    for _, row in habit_page.iterrows():
+        habit = load_habit(row)
+        if pd.isna(row["last_status"]):
             habit.check_completion_status()
-            if habit.streak_complete == False:
-                with st.container(border=True):
-                    col_1, col_2 = st.columns(2)
-
-                    # col_1 contains information about the habit
-                    with col_1:
-                        st.header(body = habit.name, divider='blue')
-                        st.subheader(habit.description) 
-                        st.text(f"Period: {habit.period}")
-
-                        # col_2 with current streak series and button
-                        with col_2:
-                            if st.button("Mark completed", key=habit.name+"2"):
-                                habit.mark_as_complete()
-                                st.session_state["show_balloons"] = True
-                                st.rerun()
-                            if st.button("Modify Habit", key=habit.name):
-                                modify_button(habit)
-                            if st.button("Delete Habit", key=habit.name+"1"):
-                                delete_button(habit)
-                            
-                            # uncomment, to activate cheating
-                            # if st.button(label="Add Fake Data", key=habit.name+"3"):
-                            #     add_fake_data_button(habit)
-
-
-        st.subheader("✅ Habits Already Completed This Period")
-
-        # create an object for every active habit
-        for habit_entry in active_habits:
-            habit_name = habit_entry
-            habit_data = db.get_habit_data(habit_name)
-            habit = Habit(
-                name = habit_data.iloc[0]["name"],
-                description = habit_data.iloc[0]["description"],
-                period = habit_data.iloc[0]["period"],
-                active = habit_data.iloc[0]["active"]
-            )
-            habit.check_completion_status()
-            # show only the ones which are already completed
-            if habit.streak_complete == True:
-
-                # expander to save space, rest same as above 
-                # current streak series insted of mark complete button
-                with st.expander(label=habit.name):
-                    longest_streak = analysis.get_habits_series(
-                        name = habit, 
-                        all_series = False,
-                        period = habit.period
-                    )
-                    
-                    col_1, col_2 = st.columns(2)
-                    with col_1:
-                        st.header(body = habit.name, divider='blue')
-                        st.subheader(habit.description) 
-                        st.text(f"Period: {habit.period}")
-
-                    with col_2:
-                        if habit.get_current_streak() > 0:
-                            st.markdown(f"Current Streak series: :green[{habit.get_current_streak()}]")
-                        else:
-                            st.markdown(f"Current Streak series: :red[{habit.get_current_streak()}]")
-                        if st.button("Modify Habit", key=habit.name):
-                            modify_button(habit)
-                        if st.button("Delete Habit", key=habit.name+"1"):
-                            delete_button(habit)
-
-                        # uncomment, to activate cheating
-                        # if st.button(label="Add Fake Data", key=habit.name+"3"):
-                        #     add_fake_data_button(habit)                     
+        else:
+            habit.check_completion_status(last_entry=(row["last_status"], row["last_timestamp"]))
+        if habit.streak_complete:
+            completed_habits.append(habit)
+        else:
+            open_habits.append(habit)
+
+    st.subheader("📌 Habits Not Completed This Period")
+    for habit in open_habits:
+        with profiler.section(habit.name):
+            active_habit_card(habit)
+
+    # the streaks of all completed habits in one go
+    snapshots = analysis.get_habit_snapshots([habit.name for habit in completed_habits])
+
+    st.subheader("✅ Habits Already Completed This Period")
+    for habit in completed_habits:
+        with profiler.section(habit.name):
+            active_habit_card(habit, snapshots[habit.name]["current_streak"])
+
 
 # tab for analysing habits
-with tab_analysis:
+# runs as a fragment, so choosing a period only reruns the analysis
+@st.fragment
+def analysis_tab():
+    import pandas as pd
+
     st.header("Habits per period")
     col_6, col_7, col_8, col_9 = st.columns(4)
 
@@ -291,7 +474,7 @@ with tab_analysis:
             options = ("all", "day", "week", "month", "quarter", "year"),
             key = "sel_period_analysis"
             )
-        
+
     # add some headers
     with col_7:
         st.subheader("Habits")
@@ -306,35 +489,33 @@ with tab_analysis:
         st.divider()
 
     # only active habits
+    # results come from the precomputed snapshots, stale ones are computed live
     df_habits = analysis.get_active_habits_for_period(select_period)
+    series_rows = []
+
+    snapshots = analysis.get_habit_snapshots(df_habits["name"].tolist())
+    for habit, snapshot in snapshots.items():
+        series_rows.extend(
+            {"name": habit, "streak_series": streak, "break_series": breaks}
+            for streak, breaks in snapshot["series"]
+        )
 
-    for habit in df_habits["name"].tolist():
         with col_7:
             st.text(habit)
             st.divider()
 
         with col_8:
-            streaks = analysis.get_current_streak_series(habit)
-            if streaks == []:
-                st.text(0)
-                st.divider()
-            else:
-                st.text(streaks)
-                st.divider() 
+            st.text(snapshot["current_streak"])
+            st.divider()
 
         with col_9:
-            longest_streak = analysis.get_habits_series(
-                name = habit, 
-                all_series = False,
-                period = select_period
-            )
-            st.text(longest_streak.iloc[0]["streak_series"])
+            st.text(snapshot["longest_streak"])
             st.divider()
 
     # get data for habit series
-    df_all_data = analysis.get_habits_series(
-        all_series=True,
-        period=select_period
+    df_all_data = pd.DataFrame(
+        series_rows,
+        columns = ["name", "streak_series", "break_series"]
     )
     if df_all_data.empty:
         st.text("No Habits for this period")
@@ -346,37 +527,91 @@ with tab_analysis:
             stack = "normalize",
             color = ["#fd0000", "#05ae11"],
             horizontal = True
-    )  
+    )
+
 
 # tab for inactive habits
+def inactive_tab():
+    habit_page = paged_habits("inactive", active=False)
+    for _, row in habit_page.iterrows():
+        with profiler.section(row["name"]):
+            inactive_habit_card(load_habit(row))
+
+
+# only the selected tab is computed
+with tab_active_habits:
+    if tab_active_habits.open:
+        with profiler.section("Your active Habits"):
+            active_habits_tab()
+
+with tab_analysis:
+    if tab_analysis.open:
+        with profiler.section("Analyze your habits"):
+            analysis_tab()
+
 with tab_inactive:
-    inactive_habits = db.get_inactive()
-    for habit_entry in inactive_habits:
-            with st.container(border=True):
-                col_1, col_2= st.columns(2)
-
-                # information for the habit
-                with col_1:
-                    habit_name = habit_entry
-                    habit_data = db.get_habit_data(habit_name)
-                    habit = Habit(
-                        name = habit_data.iloc[0]["name"],
-                        description = habit_data.iloc[0]["description"],
-                        period = habit_data.iloc[0]["period"],
-                        active = habit_data.iloc[0]["active"]
-                    )
-                    longest_streak = analysis.get_habits_series(
-                        name = habit_name, 
-                        all_series = False,
-                        period = habit.period
-                    )
-                    st.header(body = habit.name, divider='blue')
-                    st.subheader(habit.description) 
-                    st.text(f"Period: {habit.period}")
+    if tab_inactive.open:
+        with profiler.section("Inactive Habits"):
+            inactive_tab()
+
+
+def query_stats_panel(stats):
+
+    """ Shows the statement count and the most expensive statements of the render. """
+
+    with st.sidebar.expander("Query stats", expanded=True):
+        st.text(f"{stats.query_count} statements, {stats.connections} connections, {stats.total_ms:.1f} ms")
+        st.dataframe(
+            [
+                {
+                    "statement": entry["fingerprint"],
+                    "calls": entry["calls"],
+                    "total ms": round(entry["total_ms"], 2),
+                    "max ms": round(entry["max_ms"], 2),
+                    "rows": entry["rows"],
+                    "called from": ", ".join(sorted(entry["call_sites"])),
+                }
+                for entry in stats.aggregate()[:10]
+            ],
+            hide_index = True
+        )
 
-                # buttons for the habit
-                with col_2:
-                    if st.button("Modify Habit", key=habit.name):
-                        modify_button(habit)
-                    if st.button("Delete Habit", key=habit.name+"1"):
-                        delete_button(habit)
\ No newline at end of file
+
+def profile_panel(profile):
+
+    """ Shows where the time of the render went, as indented tree of sections. """
+
+    rows = profile.rows(min_share=0.005)
+    with st.sidebar.expander("Render profile", expanded=True):
+        root = rows[0]
+        st.text(
+            f"{root['ms']:.0f} ms: db {root['db ms']:.0f} ms, "
+            f"analysis {root['analysis ms']:.0f} ms, widgets {root['widgets ms']:.0f} ms"
+        )
+        st.dataframe(
+            [
+                {
+                    "section": "· " * row["depth"] + row["section"],
+                    "share": row["share"],
+                    "ms": round(row["ms"], 1),
+                    "db ms": round(row["db ms"], 1),
+                    "analysis ms": round(row["analysis ms"], 1),
+                    "widgets ms": round(row["widgets ms"], 1),
+                }
+                for row in rows
+            ],
+            column_config = {
+                "share": st.column_config.ProgressColumn("share", min_value=0.0, max_value=1.0, format="percent")
+            },
+            hide_index = True
+        )
+        if profile.profile_file:
+            st.text(f"cProfile output: {profile.profile_file}")
+
+
+if debug:
+    query_stats_panel(querystats.end(render_stats))
+    querystats.enable(False, this_thread=True)
+
+if profiling:
+    profile_panel(profiler.stop(render_profile))
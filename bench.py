@@ -0,0 +1,293 @@
+import db
+import analysis
+import generate_data
+from habit import Habit
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date
+
+# Benchmarks of the db, habit and analysis hot paths and of a full app
+# render on synthetic databases of several sizes. Results are written as
+# JSON, --compare flags benchmarks slower than a stored baseline.
+
+# name: (habits, years of history)
+dataset_sizes = {
+    "small": (50, 1),
+    "medium": (200, 2),
+    "large": (1000, 2),
+}
+
+bench_dir = os.path.join(tempfile.gettempdir(), "habittracker-bench")
+app_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+
+def _timeit(func, repeat: int, budget: float) -> dict:
+
+    """ Runs func up to repeat times, stopping early once budget seconds are used. """
+
+    times = []
+    started = time.perf_counter()
+    while len(times) < repeat:
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+        if time.perf_counter() - started > budget:
+            break
+
+    times.sort()
+    return {
+        "median_ms": times[len(times) // 2] * 1000,
+        "min_ms": times[0] * 1000,
+        "runs": len(times),
+    }
+
+
+def prepare_database(size: str, seed: int = 0) -> str:
+
+    """ Returns a fresh copy of the synthetic database of a size.
+
+    The generated database is cached per size, seed and day, the benchmarks
+    run on a copy because some of them write.
+
+    """
+
+    habits, years = dataset_sizes[size]
+    os.makedirs(bench_dir, exist_ok=True)
+    template = os.path.join(bench_dir, f"{size}-{seed}-{date.today().isoformat()}.db")
+
+    if not os.path.exists(template):
+        generate_data.generate_database(
+            template,
+            overwrite = True,
+            habits = habits,
+            years = years,
+            seed = seed
+        )
+
+    copy_dir = os.path.join(bench_dir, f"run-{size}")
+    shutil.rmtree(copy_dir, ignore_errors=True)
+    os.makedirs(copy_dir)
+
+    # the app always opens main.db in its working directory
+    db_name = os.path.join(copy_dir, "main.db")
+    shutil.copyfile(template, db_name)
+    return db_name
+
+
+def _render_app(db_name: str, tab: str):
+    from streamlit.testing.v1 import AppTest
+
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(db_name))
+    try:
+        app = AppTest.from_file(app_file, default_timeout=600)
+        app.session_state["main_tabs"] = tab
+        app.run()
+        if app.exception:
+            raise RuntimeError(app.exception[0].message)
+    finally:
+        os.chdir(cwd)
+
+
+def run_size(
+    size: str,
+    repeat: int = 5,
+    budget: float = 10.0,
+    with_app: bool = True
+) -> dict:
+
+    """ Runs all benchmarks on the database of one size.
+
+    Parameter:
+    ----------
+        size (str):
+            One of the keys of dataset_sizes.
+
+        repeat (int, optional):
+            Maximum runs per benchmark. Defaults to 5.
+
+        budget (float, optional):
+            Seconds after which a benchmark stops repeating. Defaults to 10.0.
+
+        with_app (bool, optional):
+            Also time a full render of app.py, needs streamlit. Defaults to True.
+
+    Returns:
+    --------
+        dict:
+            The timings per benchmark.
+
+    """
+
+    db_name = prepare_database(size)
+    db.ensure_schema(db_name)
+
+    # the daily habit with the longest history is the worst case per habit
+    with db.connect_db(db_name) as con:
+        name = con.execute(
+            """SELECT h.name
+            FROM habits h JOIN tracking t ON t.name = h.name
+            WHERE h.active = 1 AND h.period = 'day'
+            GROUP BY h.name
+            ORDER BY COUNT(*) DESC
+            LIMIT 1 ;
+            """
+        ).fetchone()[0]
+
+    habit = Habit(name=name, period="day", db_name=db_name)
+
+    benchmarks = {
+        "db.streak_complete": lambda: db.streak_complete(name, "day", db_name=db_name),
+        "db.get_tracking_data": lambda: db.get_tracking_data(name, db_name=db_name),
+        "db.get_tracking_data(all)": lambda: db.get_tracking_data(db_name=db_name),
+        "Habit.check_completion_status": habit.check_completion_status,
+        "analysis.get_current_streak_series": lambda: analysis.get_current_streak_series(name, db_name=db_name),
+        "analysis.get_habits_series(all_series=True)": lambda: analysis.get_habits_series(all_series=True, db_name=db_name),
+        "analysis.get_habits_series_from_cache": lambda: analysis.get_habits_series_from_cache(db_name=db_name),
+    }
+
+    if with_app:
+        benchmarks["app render (active habits)"] = lambda: _render_app(db_name, "Your active Habits")
+        benchmarks["app render (analysis)"] = lambda: _render_app(db_name, "Analyze your habits")
+
+    results = {}
+    for bench_name, func in benchmarks.items():
+        results[bench_name] = _timeit(func, repeat, budget)
+        print(f"  {bench_name:<45}{results[bench_name]['median_ms']:>12.2f} ms", flush=True)
+
+    return results
+
+
+def memory_usage(db_name: str) -> dict:
+
+    """ Measures the memory of the DataFrames returned by the db readers.
+
+    The same rows are also loaded as a DataFrame with the dtypes pandas
+    infers, the way the readers returned them before their columns were
+    typed.
+
+    Returns:
+    --------
+        dict:
+            Per reader the rows and memory_usage(deep=True) in bytes, typed and plain.
+
+    """
+
+    import pandas as pd
+
+    report = {}
+    for reader, table, read in (
+        ("db.get_tracking_data(all)", "tracking", lambda: db.get_tracking_data(db_name=db_name)),
+        ("db.get_habit_data(all)", "habits", lambda: db.get_habit_data(db_name=db_name)),
+    ):
+        with db.connect_db(db_name) as con:
+            cur = con.execute(f"SELECT * FROM {table} ;")
+            plain = pd.DataFrame(cur.fetchall(), columns=[column[0] for column in cur.description])
+
+        typed = read()
+        report[reader] = {
+            "rows": len(typed),
+            "bytes": int(typed.memory_usage(deep=True).sum()),
+            "plain_bytes": int(plain.memory_usage(deep=True).sum()),
+        }
+
+    return report
+
+
+def compare(
+    results: dict,
+    baseline: dict,
+    threshold: float
+) -> list:
+
+    """ Returns the benchmarks whose median is more than threshold percent above the baseline.
+
+    Parameter:
+    ----------
+        results (dict):
+            Results of run_size per size.
+
+        baseline (dict):
+            Results of an earlier run in the same format.
+
+        threshold (float):
+            Allowed slowdown in percent.
+
+    Returns:
+    --------
+        list:
+            (size, benchmark, baseline ms, current ms, change in percent)
+            for every regression.
+
+    """
+
+    regressions = []
+    for size, benchmarks in results.items():
+        for bench_name, result in benchmarks.items():
+            before = baseline.get(size, {}).get(bench_name)
+            if not before:
+                continue
+
+            change = (result["median_ms"] - before["median_ms"]) / before["median_ms"] * 100
+            if change > threshold:
+                regressions.append((size, bench_name, before["median_ms"], result["median_ms"], change))
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the habit tracker hot paths")
+    parser.add_argument("--sizes", nargs="+", choices=list(dataset_sizes), default=["small", "medium"])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=10.0,
+                        help="seconds after which a benchmark stops repeating")
+    parser.add_argument("--no-app", action="store_true", help="skip the app render benchmarks")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON file written by --output to compare with")
+    parser.add_argument("--threshold", type=float, default=20.0,
+                        help="allowed slowdown against the baseline in percent")
+    args = parser.parse_args()
+
+    results = {}
+    memory = {}
+    for size in args.sizes:
+        habits, years = dataset_sizes[size]
+        print(f"{size}: {habits} habits, {years} years")
+        results[size] = run_size(size, args.repeat, args.budget, not args.no_app)
+
+        memory[size] = memory_usage(prepare_database(size))
+        for reader, entry in memory[size].items():
+            rows = max(entry["rows"], 1)
+            print(f"  {reader + ' memory':<45}{entry['bytes'] / rows:>12.1f} B/row"
+                  f" (untyped {entry['plain_bytes'] / rows:.1f} B/row)")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "meta": {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "date": date.today().isoformat(),
+                },
+                "results": results,
+                "memory": memory
+            }, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+        regressions = compare(results, baseline, args.threshold)
+        for size, bench_name, before, after, change in regressions:
+            print(f"REGRESSION {size} {bench_name}: {before:.2f} ms -> {after:.2f} ms ({change:+.1f}%)")
+
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions above {args.threshold}%")
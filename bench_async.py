@@ -0,0 +1,131 @@
+import aio
+import analysis
+import bench
+import db
+
+import argparse
+import asyncio
+import random
+import time
+
+# Benchmark of the asyncio API against the sync API on a mixed workload.
+# The same list of operations on the synthetic database of bench.py is run
+# one after the other with the sync functions and at once with
+# asyncio.gather over the aio functions.
+
+default_mix = {
+    "get_current_streak_series": 0.4,
+    "get_tracking_data": 0.3,
+    "get_last_entry": 0.2,
+    "streak_complete": 0.1,
+}
+
+
+def workload(db_name: str, operations: int = 400, mix: dict = None, seed: int = 0) -> list:
+
+    """ Picks the operations of a run, (operation, habit name, period) tuples. """
+
+    rng = random.Random(seed)
+    mix = mix or default_mix
+    with db.connect_db(db_name) as con:
+        habits = con.execute("SELECT name, period FROM habits WHERE active = 1 ;").fetchall()
+
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    return [(rng.choices(names, weights)[0], *rng.choice(habits)) for _ in range(operations)]
+
+
+def _sync_call(operation: str, name: str, period: str, db_name: str):
+    if operation == "streak_complete":
+        return db.streak_complete(name, period, db_name=db_name)
+    if operation == "get_current_streak_series":
+        return analysis.get_current_streak_series(name, db_name)
+    return getattr(db, operation)(name, db_name=db_name)
+
+
+async def _async_call(operation: str, name: str, period: str, db_name: str):
+    if operation == "streak_complete":
+        return await aio.streak_complete(name, period, db_name=db_name)
+    if operation == "get_current_streak_series":
+        return await aio.get_current_streak_series(name, db_name)
+    return await getattr(aio, operation)(name, db_name=db_name)
+
+
+def run(size: str = "medium", operations: int = 400, seed: int = 0) -> dict:
+
+    """ Runs the same operations with the sync and the async API.
+
+    Both APIs start from a fresh copy of the database, so they write the
+    same completions.
+
+    Parameter:
+    ----------
+        size (str, optional):
+            One of the keys of bench.dataset_sizes. Defaults to "medium".
+
+        operations (int, optional):
+            Number of operations. Defaults to 400.
+
+        seed (int, optional):
+            Seed of the workload. Defaults to 0.
+
+    Returns:
+    --------
+        dict:
+            Seconds and operations per second of both APIs and the speedup.
+
+    """
+
+    db_name = bench.prepare_database(size)
+    db.ensure_schema(db_name)
+    todo = workload(db_name, operations, seed=seed)
+
+    # the lazy imports of the analysis would otherwise be part of the first run
+    analysis.get_current_streak_series(todo[0][1], db_name)
+
+    start = time.perf_counter()
+    for operation in todo:
+        _sync_call(*operation, db_name)
+    sync_seconds = time.perf_counter() - start
+
+    async def gather():
+        # starts the pools and their connections
+        await aio.get_write_version(db_name)
+        start = time.perf_counter()
+        await asyncio.gather(*(_async_call(*operation, db_name) for operation in todo))
+        return time.perf_counter() - start
+
+    db_name = bench.prepare_database(size)
+    db.ensure_schema(db_name)
+    try:
+        async_seconds = asyncio.run(gather())
+    finally:
+        aio.shutdown()
+
+    return {
+        "operations": len(todo),
+        "sync_seconds": sync_seconds,
+        "async_seconds": async_seconds,
+        "sync_per_second": len(todo) / sync_seconds,
+        "async_per_second": len(todo) / async_seconds,
+        "speedup": sync_seconds / async_seconds,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the asyncio API against the sync API")
+    parser.add_argument("--size", choices=list(bench.dataset_sizes), default="medium")
+    parser.add_argument("--operations", type=int, default=400)
+    parser.add_argument("--readers", type=int, help="reader threads, default aio.readers")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.readers:
+        aio.readers = args.readers
+
+    result = run(args.size, args.operations, args.seed)
+
+    print(f"{args.size}, {result['operations']} operations, {aio.readers} reader threads")
+    print(f"  sync   {result['sync_seconds']:>8.2f} s {result['sync_per_second']:>10.1f} ops/s")
+    print(f"  async  {result['async_seconds']:>8.2f} s {result['async_per_second']:>10.1f} ops/s")
+    print(f"  speedup {result['speedup']:.2f}x")
@@ -0,0 +1,119 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Import time benchmark based on python -X importtime.
+# Every module is imported in a fresh interpreter, the cumulative import
+# time of the module is taken as the median of several runs.
+
+modules = ("db", "habit", "analysis", "cli", "precompute", "api", "aio")
+
+# heavy modules which must not be loaded by importing these modules
+forbidden = {
+    "db": ("pandas", "dateutil"),
+    "habit": ("pandas", "dateutil"),
+    "analysis": ("pandas", "dateutil"),
+    "cli": ("pandas", "dateutil", "streamlit"),
+    "aio": ("pandas", "dateutil"),
+}
+
+
+def measure(module: str) -> tuple:
+
+    """ Imports a module in a new interpreter and parses the -X importtime output.
+
+    Parameter:
+    ----------
+        module (str):
+            Name of the module to import.
+
+    Returns:
+    --------
+        tuple:
+            Cumulative import time of the module in milliseconds and the
+            set of all imported top level packages.
+
+    """
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        check=True
+    )
+
+    cumulative = 0
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        imported.add(name.split(".")[0])
+        if name == module:
+            cumulative = int(cumulative_us)
+
+    return cumulative / 1000, imported
+
+
+def run(repeat: int = 5) -> dict:
+
+    """ Measures all modules and returns their median import time in milliseconds. """
+
+    results = {}
+    for module in modules:
+        times = []
+        for _ in range(repeat):
+            milliseconds, imported = measure(module)
+            times.append(milliseconds)
+
+        times.sort()
+        results[module] = {
+            "import_ms": times[len(times) // 2],
+            "heavy_imports": sorted(set(forbidden.get(module, ())) & imported),
+        }
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import time benchmark")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON file written by --output to compare with")
+    parser.add_argument("--threshold", type=float, default=25.0,
+                        help="allowed slowdown against the baseline in percent")
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    failed = False
+    for module, result in results.items():
+        line = f"{module:<12}{result['import_ms']:>9.1f} ms"
+
+        if result["heavy_imports"]:
+            line += f"  loads {', '.join(result['heavy_imports'])}"
+            failed = True
+
+        if module in baseline:
+            before = baseline[module]["import_ms"]
+            change = (result["import_ms"] - before) / before * 100 if before else 0.0
+            line += f"  {change:+.1f}% against baseline"
+            if change > args.threshold:
+                line += "  REGRESSION"
+                failed = True
+
+        print(line)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,218 @@
+""" Command line interface of the habit tracker.
+
+Usage: python cli.py [--db FILE] COMMAND ...
+
+    add NAME [--period PERIOD] [--description TEXT]
+    complete NAME [NAME ...] [--date DATE]      use "-" to read names from stdin
+    list [--inactive | --all]
+    streak NAME [NAME ...]
+    export [FILE]                               JSON, stdout by default, columnar
+                                                for .npz and .parquet files
+    import FILE                                 file written by export, "-" for stdin
+    archive [--days DAYS]                       move old tracking data to the archive
+    rollups [--check]                           rebuild the completions per period,
+                                                --check only reports differences
+
+Modules are imported inside the commands, so commands which do not
+analyse anything start without loading pandas or streamlit.
+"""
+
+import argparse
+import sys
+
+valid_periods = ("day", "week", "month", "quarter", "year")
+
+
+def _date(value: str):
+
+    """ Type of --date, a completion date as accepted by db.parse_date. """
+
+    import db
+
+    date = db.parse_date(value)
+    if date is None:
+        raise argparse.ArgumentTypeError(f'invalid date {value!r}, use "YYYY-MM-DD" or "YYYY-MM-DD HH:MM:SS"')
+    return date
+
+
+def cmd_add(args) -> int:
+    import db
+
+    result = db.add_habit(
+        name = args.name,
+        period = args.period,
+        description = args.description,
+        db_name = args.db
+    )
+    print(result)
+    return 1 if result.endswith("already in database") else 0
+
+
+def cmd_complete(args) -> int:
+    import db
+
+    names = []
+    for name in args.names:
+        if name == "-":
+            names.extend(line.strip() for line in sys.stdin if line.strip())
+        else:
+            names.append(name)
+
+    if not names:
+        return 0
+
+    results = db.streak_complete_batch(
+        names = names,
+        date = args.date,
+        db_name = args.db
+    )
+    for result in results:
+        print(result)
+    return 1 if any(result.endswith("not in database") for result in results) else 0
+
+
+def cmd_list(args) -> int:
+    import db
+
+    if args.all:
+        names = db.get_active(args.db) + db.get_inactive(args.db)
+    elif args.inactive:
+        names = db.get_inactive(args.db)
+    else:
+        names = db.get_active(args.db)
+
+    for name in names:
+        print(name)
+    return 0
+
+
+def cmd_streak(args) -> int:
+    import analysis
+
+    exit_code = 0
+    for name in args.names:
+        snapshot = analysis.get_habit_snapshot(name=name, db_name=args.db)
+        if snapshot is None:
+            print(f"{name} not in database")
+            exit_code = 1
+        else:
+            print(f"{name}\tcurrent: {snapshot['current_streak']}\tlongest: {snapshot['longest_streak']}")
+    return exit_code
+
+
+def cmd_export(args) -> int:
+    import db
+    import json
+
+    if args.file and args.file.endswith((".npz", ".parquet")):
+        result = db.export_columnar(path=args.file, db_name=args.db)
+        print(f"{result['habits']} habits and {result['tracking']} tracking entries exported")
+        return 0
+
+    data = db.export_data(db_name=args.db)
+    if args.file in (None, "-"):
+        json.dump(data, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.file, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+    return 0
+
+
+def cmd_import(args) -> int:
+    import db
+    import json
+
+    if args.file.endswith((".npz", ".parquet")):
+        print(db.import_columnar(path=args.file, db_name=args.db))
+        return 0
+
+    if args.file == "-":
+        data = json.load(sys.stdin)
+    else:
+        with open(args.file, encoding="utf-8") as f:
+            data = json.load(f)
+
+    print(db.import_data(
+        habits = data.get("habits", []),
+        tracking = data.get("tracking", []),
+        db_name = args.db
+    ))
+    return 0
+
+
+def cmd_archive(args) -> int:
+    import db
+
+    result = db.archive_tracking(older_than_days=args.days, db_name=args.db)
+    print(f"{result['archived']} tracking entries archived to {db.archive_name(args.db)}")
+    return 0
+
+
+def cmd_rollups(args) -> int:
+    import db
+
+    result = db.rebuild_rollups(db_name=args.db, check=args.check)
+    if args.check:
+        print(f"{result['differences']} of {result['rollups']} rollups differ from the tracking data")
+        return 1 if result["differences"] else 0
+    print(f"{result['rollups']} rollups rebuilt, {result['differences']} differed")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="habit", description="Track your habits from the command line")
+    parser.add_argument("--db", default="main.db", help="database file, default main.db")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="create a habit")
+    add.add_argument("name")
+    add.add_argument("--period", choices=valid_periods, default="day")
+    add.add_argument("--description")
+    add.set_defaults(func=cmd_add)
+
+    complete = commands.add_parser("complete", help="mark habits completed")
+    complete.add_argument("names", nargs="+", metavar="NAME", help='"-" reads one name per line from stdin')
+    complete.add_argument("--date", type=_date, help='"YYYY-MM-DD" or "YYYY-MM-DD HH:MM:SS", default now')
+    complete.set_defaults(func=cmd_complete)
+
+    list_ = commands.add_parser("list", help="list habit names")
+    status = list_.add_mutually_exclusive_group()
+    status.add_argument("--inactive", action="store_true")
+    status.add_argument("--all", action="store_true")
+    list_.set_defaults(func=cmd_list)
+
+    streak = commands.add_parser("streak", help="show current and longest streak")
+    streak.add_argument("names", nargs="+", metavar="NAME")
+    streak.set_defaults(func=cmd_streak)
+
+    export = commands.add_parser("export", help="export habits and tracking data as JSON, .npz or .parquet")
+    export.add_argument("file", nargs="?")
+    export.set_defaults(func=cmd_export)
+
+    import_ = commands.add_parser("import", help="import habits and tracking data from JSON, .npz or .parquet")
+    import_.add_argument("file")
+    import_.set_defaults(func=cmd_import)
+
+    archive = commands.add_parser("archive", help="move old tracking data to the archive database")
+    archive.add_argument("--days", type=int, help="archive entries older than this, default 730")
+    archive.set_defaults(func=cmd_archive)
+
+    rollups = commands.add_parser("rollups", help="rebuild the completions per habit and period")
+    rollups.add_argument("--check", action="store_true", help="only compare, exit 1 on differences")
+    rollups.set_defaults(func=cmd_rollups)
+
+    return parser
+
+
+def main(argv: list = None) -> int:
+    args = build_parser().parse_args(argv)
+
+    import db
+    db.ensure_schema(args.db)
+
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,55 @@
+from __future__ import annotations
+
+import os
 import sqlite3
+import json
+import threading
 from datetime import datetime 
-import pandas as pd
+from typing import TYPE_CHECKING
+
+import metrics
+import querystats
+import writebehind
+
+# pandas is imported by the functions returning DataFrames, so the
+# write and lookup paths work without loading it
+if TYPE_CHECKING:
+    import pandas as pd
+
+# version of the schema created by create_tables, stored as PRAGMA user_version
+SCHEMA_VERSION = 7
+
+# database files with a schema at SCHEMA_VERSION, see ensure_schema
+_schema_ready = set()
+
+# connections reused per thread, see enable_connection_pool
+_pool = threading.local()
+_pool_enabled = False
+
+
+def enable_connection_pool(enabled: bool = True, this_thread: bool = False) -> None:
+    """Function switching the connection pool on or off
+
+    While the pool is on, connect_db keeps one open connection per thread
+    and database file and hands it out again instead of opening a new one.
+    Meant for long running processes with a fixed set of worker threads.
+
+    Parameters
+    ----------
+    enabled : bool, optional
+        Whether connections should be pooled. Default is True
+
+    this_thread : bool, optional
+        Only pool the connections of the calling thread, e.g. the workers 
+        of a thread pool. Default is False, all threads
+    """
+
+    global _pool_enabled
+    if this_thread:
+        _pool.enabled = enabled
+    else:
+        _pool_enabled = enabled
+
 
 def connect_db(name: str = "main.db") -> sqlite3.Connection:
     """Function connecting to a database
@@ -21,9 +70,25 @@ def connect_db(name: str = "main.db") -> sqlite3.Connection:
         If an error occurs while connecting to the database
     """
 
+    pooled = _pool_enabled or _pool.__dict__.get("enabled", False)
+    if pooled:
+        connections = _pool.__dict__.setdefault("connections", {})
+        if name in connections:
+            return connections[name]
+
     try:
-        con = sqlite3.connect(name)
+        # statements are only timed while query stats or metrics are on
+        if querystats.is_enabled() or metrics.enabled:
+            con = sqlite3.connect(name, factory=querystats.InstrumentedConnection)
+            querystats.record_connection()
+            if metrics.enabled and name != ":memory:":
+                metrics.watch_database(name)
+        else:
+            con = sqlite3.connect(name)
         con.execute("PRAGMA foreign_keys = ON;")
+
+        if pooled:
+            connections[name] = con
         return con
     
     except sqlite3.Error as e:
@@ -41,15 +106,32 @@ def close_db(con: sqlite3.Connection) -> None:
     if con is None:
         raise ValueError("Database connection is None, cannot close.")
 
+    # a closed connection must not be handed out by the pool again
+    connections = _pool.__dict__.get("connections", {})
+    for name, pooled in list(connections.items()):
+        if pooled is con:
+            del connections[name]
+
     con.close()
 
 
 def create_tables(db_name: str = "main.db") -> None:
     """Function creating tables in a database
     
-    Creates 2 tables in the database:
+    Creates 7 tables in the database:
     - habits: stores information about habits
     - tracking: stores tracking data for habits
+    - tracking_rollups: completions per habit and period, kept up to date by triggers
+    - snapshots: stores precomputed analysis results per habit
+    - write_version: counts the changes of habits and tracking
+    - tracking_rewrites: counts the updates and deletes of tracking rows
+    - archive_state: tells the rollup triggers when archive_tracking moves rows
+
+    and the indexes used by the paged habit lists. A unique index allows one
+    completion per habit and period. The rollups of a database with an older
+    schema are rebuilt and its duplicate completions removed, see 
+    deduplicate_completions. Afterwards the schema version is stored as 
+    PRAGMA user_version.
 
     Parameters
     ----------
@@ -58,6 +140,7 @@ def create_tables(db_name: str = "main.db") -> None:
 
     """
     with connect_db(db_name) as con:
+        previous_version = con.execute("PRAGMA user_version;").fetchone()[0]
         cur = con.cursor()
         cur.execute(
             """ CREATE TABLE IF NOT EXISTS habits (
@@ -83,9 +166,194 @@ def create_tables(db_name: str = "main.db") -> None:
                 )
             """
         )
+
+        # indexes for the paged habit lists
+        cur.execute(
+            """CREATE INDEX IF NOT EXISTS idx_habits_active 
+                ON habits (active, name)
+            """
+        )
+        cur.execute(
+            """CREATE INDEX IF NOT EXISTS idx_tracking_name_timestamp 
+                ON tracking (name, timestamp)
+            """
+        )
+        # last_completed of a habit in one lookup
+        cur.execute(
+            """CREATE INDEX IF NOT EXISTS idx_tracking_last_completed 
+                ON tracking (name, timestamp)
+                WHERE status = 'streak complete'
+            """
+        )
+
+        # completions per period, bucket is the first day of the period
+        cur.execute(
+            """CREATE TABLE IF NOT EXISTS tracking_rollups (
+                name TEXT,
+                period TEXT,
+                bucket DATE,
+                completions INTEGER,
+                first_timestamp DATETIME,
+                last_timestamp DATETIME,
+                PRIMARY KEY (name, period, bucket),
+                FOREIGN KEY (name) 
+                REFERENCES habits(name) ON DELETE CASCADE ON UPDATE CASCADE
+                )
+            """
+        )
+
+        cur.execute(
+            """CREATE TABLE IF NOT EXISTS archive_state (
+                archiving INTEGER
+                )
+            """
+        )
+        cur.execute(
+            """INSERT INTO archive_state (archiving) 
+                SELECT 0 
+                WHERE NOT EXISTS (SELECT 1 FROM archive_state)
+            """
+        )
+        for trigger, sql in _rollup_triggers().items():
+            cur.execute(f"CREATE TRIGGER IF NOT EXISTS {trigger} {sql}")
+
+        cur.execute(
+            """CREATE TABLE IF NOT EXISTS snapshots (
+                name TEXT PRIMARY KEY,
+                period TEXT,
+                period_start DATETIME,
+                last_tracking_id INTEGER,
+                rewrites INTEGER,
+                current_streak INTEGER,
+                longest_streak INTEGER,
+                series TEXT,
+                computed_at DATETIME,
+                FOREIGN KEY (name) 
+                REFERENCES habits(name) ON DELETE CASCADE ON UPDATE CASCADE
+                )
+            """
+        )
         
+        # write version, increased by every change of habits or tracking
+        cur.execute(
+            """CREATE TABLE IF NOT EXISTS write_version (
+                version INTEGER
+                )
+            """
+        )
+        cur.execute(
+            """INSERT INTO write_version (version) 
+                SELECT 0 
+                WHERE NOT EXISTS (SELECT 1 FROM write_version)
+            """
+        )
+        for table in ("habits", "tracking"):
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                cur.execute(
+                    f"""CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_version 
+                        AFTER {event} ON {table}
+                        BEGIN
+                            UPDATE write_version SET version = version + 1;
+                        END
+                    """
+                )
+
+        # snapshots of older schemas, which knew only the last tracking_id
+        columns = [row[1] for row in cur.execute("PRAGMA table_info(snapshots);").fetchall()]
+        if "rewrites" not in columns:
+            cur.execute("ALTER TABLE snapshots ADD COLUMN rewrites INTEGER ;")
+
+        # updated or deleted tracking rows, inserts leave it unchanged, see periodcache
+        cur.execute(
+            """CREATE TABLE IF NOT EXISTS tracking_rewrites (
+                rewrites INTEGER
+                )
+            """
+        )
+        cur.execute(
+            """INSERT INTO tracking_rewrites (rewrites) 
+                SELECT 0 
+                WHERE NOT EXISTS (SELECT 1 FROM tracking_rewrites)
+            """
+        )
+        cur.execute(
+            """CREATE TRIGGER IF NOT EXISTS tracking_update_rewrites 
+                AFTER UPDATE ON tracking
+                BEGIN
+                    UPDATE tracking_rewrites SET rewrites = rewrites + 1;
+                END
+            """
+        )
+        # rows moved by archive_tracking are still read with the full history
+        cur.execute(
+            """CREATE TRIGGER IF NOT EXISTS tracking_delete_rewrites 
+                AFTER DELETE ON tracking
+                WHEN (SELECT archiving FROM archive_state) = 0
+                BEGIN
+                    UPDATE tracking_rewrites SET rewrites = rewrites + 1;
+                END
+            """
+        )
+
+        con.commit()
+
+    # the rollups of older schemas only counted archived rows
+    if 0 < previous_version < 3:
+        rebuild_rollups(db_name)
+
+    # older schemas allowed several completions per period
+    if 0 < previous_version < 4:
+        deduplicate_completions(db_name)
+
+    with connect_db(db_name) as con:
+        cur = con.cursor()
+        cur.execute(
+            f"""CREATE UNIQUE INDEX IF NOT EXISTS idx_tracking_completion 
+                ON tracking (name, current_period, ({_bucket_sql()}))
+                WHERE status = 'streak complete'
+            """
+        )
+        cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION};")
         con.commit()
 
+    _schema_ready.add(_schema_key(db_name))
+
+
+def _schema_key(db_name: str) -> str:
+
+    """Helper function returning the key of a database file in _schema_ready"""
+
+    return db_name if db_name == ":memory:" else os.path.abspath(db_name)
+
+
+def ensure_schema(db_name: str = "main.db") -> None:
+    """Function making sure the schema of a database is up to date
+
+    Runs create_tables only once per process and database file. The first
+    call reads ``PRAGMA user_version``, which create_tables sets to
+    SCHEMA_VERSION, and skips the schema setup if it is already current.
+    Later calls return right away without opening a connection.
+
+    Parameters
+    ----------
+    db_name : str, optional
+        Name of the database file. Default is "main.db"
+    """
+
+    key = _schema_key(db_name)
+
+    # every connection to :memory: is a new database
+    if key in _schema_ready and key != ":memory:" and os.path.exists(key):
+        return
+
+    with connect_db(db_name) as con:
+        version = con.execute("PRAGMA user_version;").fetchone()[0]
+
+    if version < SCHEMA_VERSION or key == ":memory:":
+        create_tables(db_name)
+    else:
+        _schema_ready.add(key)
+
 
 def _is_in_db(
     name: str, 
@@ -243,6 +511,7 @@ def modify_habit(
     with connect_db(db_name) as con:
         try:
             cur = con.cursor()
+            archived = new_name is not None and _attach_archive(con, db_name)
 
             # build query
             if _is_in_db(name, db_name):
@@ -272,6 +541,12 @@ def modify_habit(
                                 WHERE name = ? ;
                                 """,
                                 (new_name, name) )
+                    if archived:
+                        cur.execute("""UPDATE archive.tracking 
+                                    SET name = ? 
+                                    WHERE name = ? ;
+                                    """,
+                                    (new_name, name) )
                 con.commit()
                
                 return f"{name} updated"
@@ -318,19 +593,74 @@ def delete_habit(
         if not _is_in_db(name, db_name):
             return f"{name} not in database"
         
+        archived = _attach_archive(con, db_name)
         cur = con.cursor()
         cur.execute("""DELETE FROM habits 
                     WHERE name = ? ;
                     """,
                     (name, ))
+        # the foreign key does not reach into the archive
+        if archived:
+            cur.execute("""DELETE FROM archive.tracking 
+                        WHERE name = ? ;
+                        """,
+                        (name, ))
 
         con.commit()
         return f"{name} deleted"
 
    
+# dtypes of the columns of the DataFrames returned by the readers, the
+# strings repeated in every row are dictionary encoded
+_column_dtypes = {
+    "name": "category",
+    "status": "category",
+    "current_period": "category",
+    "period": "category",
+    "timestamp": "datetime64[s]",
+    "bucket": "datetime64[s]",
+    "first_timestamp": "datetime64[s]",
+    "last_timestamp": "datetime64[s]",
+    "active": "bool",
+}
+
+
+def _typed_frame(rows: list, columns: list) -> pd.DataFrame:
+
+    """ Builds a DataFrame from fetched rows with the dtypes of _column_dtypes.
+
+    Timestamps are parsed once here, missing ones become NaT.
+    """
+
+    import numpy as np
+    import pandas as pd
+
+    values = np.array(rows, dtype=object) if rows else np.empty((0, len(columns)), dtype=object)
+    data = {}
+    for i, column in enumerate(columns):
+        dtype = _column_dtypes.get(column)
+        column_values = values[:, i]
+
+        if dtype == "datetime64[s]":
+            try:
+                data[column] = column_values.astype(dtype)
+            except ValueError:
+                # not in the format written by the app
+                data[column] = pd.to_datetime(column_values, format="ISO8601").astype(dtype)
+        elif dtype == "category":
+            data[column] = pd.Categorical(column_values)
+        elif dtype == "bool":
+            data[column] = column_values.astype(bool)
+        else:
+            data[column] = pd.Series(column_values).infer_objects()
+
+    return pd.DataFrame(data, columns=columns)
+
+
 def get_tracking_data(
     name: str = None,
-    db_name: str = "main.db"
+    db_name: str = "main.db",
+    full_history: bool = False
 ) -> pd.DataFrame:
     
     """Function getting tracking data for a habit
@@ -347,21 +677,26 @@ def get_tracking_data(
     db_name : str, optional
         Name of the database file. Default is "main.db"
 
+    full_history : bool, optional
+        Also read the rows moved to the archive by archive_tracking. 
+        Default is False, only the rows in the tracking table
+
     Returns
     -------
     pd.DataFrame
-        A DataFrame containing the tracking data.
+        A DataFrame containing the tracking data, name, status and current_period 
+        categorical and timestamp datetime64[s].
 
     Raises
     ------
     sqlite3.Error
         If an error occurs while getting the tracking data for the habit
     """
-    
+
     with connect_db(db_name) as con:
         if name is not None: 
             if not _is_in_db(name, db_name):
-                return pd.DataFrame(columns=[
+                return _typed_frame([], [
                     "tracking_id", 
                     "name", 
                     "status", 
@@ -372,7 +707,7 @@ def get_tracking_data(
     
         try:
             cur = con.cursor()
-            query = "SELECT * FROM tracking"
+            query = f"SELECT * FROM {_tracking_table(con, db_name, full_history)}"
             value = []
 
             if name:
@@ -382,7 +717,7 @@ def get_tracking_data(
 
             data = cur.execute(query, value)
             col_names = [description[0] for description in cur.description]
-            tracking_df = pd.DataFrame(data.fetchall(), columns=col_names)
+            tracking_df = _typed_frame(data.fetchall(), col_names)
 
             return tracking_df
         
@@ -390,6 +725,69 @@ def get_tracking_data(
             raise
 
 
+def get_last_entry(
+    name: str,
+    db_name: str = "main.db"
+) -> tuple:
+
+    """Function getting the latest tracking entry of a habit
+
+    Parameters
+    ----------
+    name : str
+        The name of the habit
+
+    db_name : str, optional
+        Name of the database file. Default is "main.db"
+
+    Returns
+    -------
+    tuple
+        The status and timestamp of the entry with the latest timestamp,
+        or None if the habit has no tracking data
+    """
+
+    with connect_db(db_name) as con:
+        result = con.execute(
+            """SELECT status, timestamp 
+            FROM tracking 
+            WHERE name = ? 
+            ORDER BY timestamp DESC, tracking_id ASC 
+            LIMIT 1 ;
+            """,
+            (name, ))
+        return result.fetchone()
+
+
+# accepted formats of the date of a completion given as text
+date_formats = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d")
+
+
+def parse_date(value) -> datetime:
+
+    """Function parsing the date of a completion given as text
+
+    Parameters
+    ----------
+    value : str
+        A date "YYYY-MM-DD HH:MM:SS" or "YYYY-MM-DD"
+
+    Returns
+    -------
+    datetime
+        The parsed date, or None if value is not a date in one of date_formats
+    """
+
+    if not isinstance(value, str):
+        return None
+    for format in date_formats:
+        try:
+            return datetime.strptime(value, format)
+        except ValueError:
+            continue
+    return None
+
+
 def streak_complete(
     name: str,
     period: str,
@@ -401,7 +799,10 @@ def streak_complete(
 
     This function checks if a connection to a database is given
     and creates one if not. It then checks if the habit is in the
-    database and marks the streak as complete.
+    database and marks the streak as complete. A period is completed
+    once, marking it again keeps the first completion. With the
+    write-behind queue enabled the completion is committed in a batch
+    with others, see writebehind.
 
     Parameters
     ----------
@@ -425,28 +826,41 @@ def streak_complete(
     Raises
     ------
     sqlite3.Error
-        If an error occurs while marking the streak as complete
+        If an error occurs while marking the streak as complete, or the 
+        write-behind queue does not commit it in time
     """
 
+    timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if date:
+        timestamp = date if isinstance(date, str) else date.strftime("%Y-%m-%d %H:%M:%S")
+
+    # waits for the batch of the write-behind queue, which commits many at once
+    if writebehind.enabled and db_name != ":memory:":
+        future = writebehind.submit(name, period, timestamp, db_name)
+        try:
+            return future.result(timeout=writebehind.timeout)
+        except TimeoutError:
+            raise sqlite3.OperationalError(
+                f"The completion of {name} was not committed within {writebehind.timeout} s"
+            ) from None
+
     with connect_db(db_name) as con:
 
         if not _is_in_db(name, db_name):
             return f"{name} not in database"
         
         try:
-            timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-            if date:
-                timestamp = date if isinstance(date, str) else date.strftime("%Y-%m-%d %H:%M:%S")
-
             cur = con.cursor()
             cur.execute(
                 """ INSERT INTO tracking (name, status, current_period, timestamp) 
                 VALUES (?, ?, ?, ?)
+                ON CONFLICT DO NOTHING
                 """, 
                 (name, "streak complete", period, timestamp)
             )
             con.commit()
+            if metrics.enabled:
+                metrics.completions_written.inc(cur.rowcount)
             return f"{name} streak completed"
 
         except sqlite3.Error as e:
@@ -547,7 +961,8 @@ def get_habit_data(
     Returns
     -------
     pd.DataFrame
-        A DataFrame containing habit data. If a specific habit is requested and not found, returns an empty DataFrame.
+        A DataFrame containing habit data, name and period categorical and active 
+        boolean. If a specific habit is requested and not found, returns an empty DataFrame.
 
     Raises
     ------
@@ -569,7 +984,7 @@ def get_habit_data(
                 fetched_result = result.fetchone()
 
                 if fetched_result is None:
-                    return pd.DataFrame(columns=[
+                    return _typed_frame([], [
                         "name", 
                         "description", 
                         "period", 
@@ -577,20 +992,1433 @@ def get_habit_data(
                         ]
                     )
                 col_names = [description[0] for description in cur.description]
-                return pd.DataFrame([fetched_result], columns=col_names)
+                return _typed_frame([fetched_result], col_names)
             
             result = cur.execute(
                 """SELECT * 
                 FROM habits ;
                 """)
             col_names = [description[0] for description in cur.description]
-            return pd.DataFrame(result.fetchall(), columns=col_names)
+            return _typed_frame(result.fetchall(), col_names)
 
         except sqlite3.Error as e:
-            return pd.DataFrame(columns=[
+            return _typed_frame([], [
                 "name", 
                 "description", 
                 "period", 
                 "active"
                 ]
-            )
\ No newline at end of file
+            )
+
+# sort expressions for get_habits_page, period sorted by its length. Only
+# the name is read in order from idx_habits_active, the other keys are
+# computed for every matching habit and sorted, last_completed with one
+# lookup in idx_tracking_last_completed per habit.
+_page_sort_keys = {
+    "name": "name",
+    "period": """CASE period 
+                    WHEN 'day' THEN 1 
+                    WHEN 'week' THEN 2 
+                    WHEN 'month' THEN 3 
+                    WHEN 'quarter' THEN 4 
+                    WHEN 'year' THEN 5 
+                    ELSE 6 
+                END""",
+    "last completed": "COALESCE(last_completed, '')",
+}
+
+
+def _like_pattern(search: str) -> str:
+
+    """Helper function returning a LIKE pattern matching names containing search
+
+    Escapes the wildcards % and _ and the escape character \\, for
+    ``LIKE ? ESCAPE '\\'``.
+    """
+
+    escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def get_habits_page(
+    active: bool = True,
+    search: str = None,
+    sort_by: str = "name",
+    descending: bool = False,
+    after: tuple = None,
+    page_size: int = 20,
+    db_name: str = "main.db"
+) -> pd.DataFrame:
+
+    """Function getting one page of habits from the database
+
+    Uses keyset pagination: instead of an OFFSET the query continues
+    after the sort key of the last habit of the previous page, so every
+    page costs the same no matter how deep the user pages.
+
+    Parameters
+    ----------
+    active : bool, optional
+        Whether to page through active or inactive habits. Default is True
+
+    search : str, optional
+        Only habits whose name contains this text. Default is None
+
+    sort_by : str, optional
+        One of "name", "period" or "last completed". Default is "name"
+
+    descending : bool, optional
+        Sort in descending order. Default is False
+
+    after : tuple, optional
+        The ``(sort_key, name)`` of the last habit of the previous page.
+        Default is None, meaning the first page
+
+    page_size : int, optional
+        The maximum number of habits on the page. Default is 20
+
+    db_name : str, optional
+        Name of the database file. Default is "main.db"
+
+    Returns
+    -------
+    pd.DataFrame
+        A DataFrame with the columns name, description, period, active,
+        last_completed, sort_key and the status and timestamp of the latest 
+        tracking entry as last_status and last_timestamp, see get_last_entry.
+
+    Raises
+    ------
+    ValueError
+        If sort_by is not a valid sort order
+    sqlite3.Error
+        If an error occurs while getting the habits from the database
+    """
+
+    import pandas as pd
+
+    if sort_by not in _page_sort_keys:
+        raise ValueError(f"Invalid sort order '{sort_by}'. Valid options are: {tuple(_page_sort_keys)}")
+
+    query = f"""SELECT * FROM (
+                    SELECT *, {_page_sort_keys[sort_by]} AS sort_key 
+                    FROM (
+                        SELECT h.name, h.description, h.period, h.active,
+                            (SELECT MAX(t.timestamp) 
+                            FROM tracking t 
+                            WHERE t.name = h.name 
+                            AND t.status = 'streak complete') AS last_completed
+                        FROM habits h 
+                        WHERE h.active = ?
+                    )
+                ) 
+                WHERE 1 = 1"""
+    params = [1 if active else 0]
+
+    if search:
+        query += r" AND name LIKE ? ESCAPE '\'"
+        params.append(_like_pattern(search))
+
+    direction = "DESC" if descending else "ASC"
+    if after is not None:
+        query += f" AND (sort_key, name) {'<' if descending else '>'} (?, ?)"
+        # keys taken from a DataFrame are numpy scalars, sqlite only binds python types
+        params.extend(value.item() if hasattr(value, "item") else value for value in after)
+
+    query += f" ORDER BY sort_key {direction}, name {direction} LIMIT ?"
+    params.append(page_size)
+
+    # the latest entry is only looked up for the habits of the page
+    query = f"""SELECT page.*,
+                    (SELECT t.status 
+                    FROM tracking t 
+                    WHERE t.name = page.name 
+                    ORDER BY t.timestamp DESC, t.tracking_id ASC 
+                    LIMIT 1) AS last_status,
+                    (SELECT MAX(t.timestamp) 
+                    FROM tracking t 
+                    WHERE t.name = page.name) AS last_timestamp
+                FROM ({query}) page
+                ORDER BY sort_key {direction}, name {direction} ;"""
+
+    with connect_db(db_name) as con:
+        try:
+            cur = con.cursor()
+            result = cur.execute(query, params)
+            col_names = [description[0] for description in cur.description]
+            return pd.DataFrame(result.fetchall(), columns=col_names)
+
+        except sqlite3.Error as e:
+            raise
+
+
+def count_habits(
+    active: bool = True,
+    search: str = None,
+    db_name: str = "main.db"
+) -> int:
+
+    """Function counting the habits matching a page query
+
+    Parameters
+    ----------
+    active : bool, optional
+        Whether to count active or inactive habits. Default is True
+
+    search : str, optional
+        Only habits whose name contains this text. Default is None
+
+    db_name : str, optional
+        Name of the database file. Default is "main.db"
+
+    Returns
+    -------
+    int
+        The number of matching habits
+    """
+
+    query = "SELECT COUNT(*) FROM habits WHERE active = ?"
+    params = [1 if active else 0]
+
+    if search:
+        query += r" AND name LIKE ? ESCAPE '\'"
+        params.append(_like_pattern(search))
+
+    with connect_db(db_name) as con:
+        return con.execute(query, params).fetchone()[0]
+
+
+def save_snapshot(
+    name: str,
+    period: str,
+    period_start: datetime,
+    last_tracking_id: int,
+    rewrites: int,
+    current_streak: int,
+    longest_streak: int,
+    series: list,
+    db_name: str = "main.db"
+) -> None:
+
+    """Function storing precomputed analysis results of a habit
+
+    Parameters
+    ----------
+    name : str
+        The name of the habit
+
+    period : str
+        The period of the habit the results were computed for
+
+    period_start : datetime
+        Start of the period the results were computed in
+
+    last_tracking_id : int
+        The highest tracking_id of the habit read for the results
+
+    rewrites : int
+        The counter of updated or deleted tracking rows read for the 
+        results, see get_tracking_rewrites
+
+    current_streak : int
+        The current streak count
+
+    longest_streak : int
+        The longest streak count
+
+    series : list
+        The streak and break series as (streak_series, break_series) pairs
+
+    db_name : str, optional
+        Name of the database file. Default is "main.db"
+
+    Raises
+    ------
+    sqlite3.Error
+        If an error occurs while storing the snapshot
+    """
+
+    with connect_db(db_name) as con:
+        try:
+            con.execute(
+                """INSERT OR REPLACE INTO snapshots (
+                    name, period, period_start, last_tracking_id, rewrites, 
+                    current_streak, longest_streak, series, computed_at) 
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (name, 
+                 period, 
+                 period_start.strftime("%Y-%m-%d %H:%M:%S"), 
+                 last_tracking_id, 
+                 rewrites, 
+                 current_streak, 
+                 longest_streak, 
+                 json.dumps(series), 
+                 datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            )
+            con.commit()
+
+        except sqlite3.Error as e:
+            con.rollback()
+            raise
+
+
+def get_snapshot(
+    name: str,
+    db_name: str = "main.db"
+) -> dict:
+
+    """Function getting the precomputed analysis results of a habit
+
+    Next to the stored results the current period and the current highest
+    tracking_id of the habit and the current counter of rewritten tracking 
+    rows are returned, so the caller can decide if the snapshot is still 
+    up to date.
+
+    Parameters
+    ----------
+    name : str
+        The name of the habit
+
+    db_name : str, optional
+        Name of the database file. Default is "main.db"
+
+    Returns
+    -------
+    dict
+        The snapshot with the additional keys habit_period, 
+        current_tracking_id and current_rewrites, or None if there is no 
+        snapshot.
+    """
+
+    with connect_db(db_name) as con:
+        cur = con.cursor()
+        result = cur.execute(
+            """SELECT s.*, 
+                h.period AS habit_period,
+                (SELECT MAX(t.tracking_id) 
+                FROM tracking t 
+                WHERE t.name = s.name) AS current_tracking_id,
+                (SELECT rewrites FROM tracking_rewrites) AS current_rewrites
+            FROM snapshots s 
+            JOIN habits h ON h.name = s.name
+            WHERE s.name = ? ;
+            """,
+            (name, ))
+        fetched_result = result.fetchone()
+
+        if fetched_result is None:
+            return None
+
+        col_names = [description[0] for description in cur.description]
+        snapshot = dict(zip(col_names, fetched_result))
+        snapshot["series"] = json.loads(snapshot["series"])
+        return snapshot
+
+
+def get_snapshots(
+    names: list,
+    db_name: str = "main.db"
+) -> dict:
+
+    """Function getting the precomputed analysis results of several habits
+
+    Same as get_snapshot, with one query per 500 habits.
+
+    Parameters
+    ----------
+    names : list
+        The names of the habits
+
+    db_name : str, optional
+        Name of the database file. Default is "main.db"
+
+    Returns
+    -------
+    dict
+        The snapshot of every habit that has one, by name.
+    """
+
+    snapshots = {}
+    unique_names = list(dict.fromkeys(names))
+    if not unique_names:
+        return snapshots
+
+    with connect_db(db_name) as con:
+        cur = con.cursor()
+
+        # sqlite allows a limited number of parameters per statement
+        for i in range(0, len(unique_names), 500):
+            chunk = unique_names[i:i + 500]
+            result = cur.execute(
+                f"""SELECT s.*, 
+                    h.period AS habit_period,
+                    (SELECT MAX(t.tracking_id) 
+                    FROM tracking t 
+                    WHERE t.name = s.name) AS current_tracking_id,
+                    (SELECT rewrites FROM tracking_rewrites) AS current_rewrites
+                FROM snapshots s 
+                JOIN habits h ON h.name = s.name
+                WHERE s.name IN ({", ".join("?" * len(chunk))}) ;
+                """,
+                chunk)
+            col_names = [description[0] for description in cur.description]
+
+            for row in result.fetchall():
+                snapshot = dict(zip(col_names, row))
+                snapshot["series"] = json.loads(snapshot["series"])
+                snapshots[snapshot["name"]] = snapshot
+
+    return snapshots
+
+
+def get_last_tracking_id(
+    name: str,
+    db_name: str = "main.db"
+) -> int:
+
+    """Function getting the highest tracking_id of a habit
+
+    Parameters
+    ----------
+    name : str
+        The name of the habit
+
+    db_name : str, optional
+        Name of the database file. Default is "main.db"
+
+    Returns
+    -------
+    int
+        The highest tracking_id, 0 if the habit has no tracking data
+    """
+
+    with connect_db(db_name) as con:
+        result = con.execute(
+            """SELECT MAX(tracking_id) 
+            FROM tracking 
+            WHERE name = ? ;
+            """,
+            (name, )).fetchone()
+        return result[0] or 0
+
+
+def get_tracking_rewrites(db_name: str = "main.db") -> int:
+
+    """Function getting the counter of updated or deleted tracking rows
+
+    Unlike the highest tracking_id, the counter also changes when older 
+    tracking rows are corrected or removed. Moving rows to the archive 
+    leaves it unchanged.
+
+    Parameters
+    ----------
+    db_name : str, optional
+        Name of the database file. Default is "main.db"
+
+    Returns
+    -------
+    int
+        The current counter
+    """
+
+    with connect_db(db_name) as con:
+        result = con.execute("SELECT rewrites FROM tracking_rewrites ;").fetchone()
+        return result[0] if result else 0
+
+
+def get_write_version(db_name: str = "main.db") -> int:
+
+    """Function getting the write version of the database
+
+    The version increases with every insert, update or delete on the
+    habits and tracking tables, so it changes whenever data read from
+    these tables could have changed.
+
+    Parameters
+    ----------
+    db_name : str, optional
+        Name of the database file. Default is "main.db"
+
+    Returns
+    -------
+    int
+        The current write version
+    """
+
+    with connect_db(db_name) as con:
+        result = con.execute("SELECT version FROM write_version ;").fetchone()
+        return result[0] if result else 0
+
+
+def streak_complete_batch(
+    names: list,
+    date: datetime = None,
+    db_name: str = "main.db"
+) -> list:
+
+    """Function marking the streaks of several habits as complete
+
+    All completions are written in one transaction. The period of every
+    habit is taken from the habits table. Periods already completed are 
+    left as they are, like in streak_complete.
+
+    Parameters
+    ----------
+    names : list
+        The names of the habits to mark the streak as complete
+
+    date : datetime or str, optional
+        The timestamp when the streaks were completed (default: current timestamp).
+
+    db_name : str, optional
+        Name of the database file. Default is "main.db"
+
+    Returns
+    -------
+    list
+        A message per habit indicating the result of marking the streak as complete
+
+    Raises
+    ------
+    sqlite3.Error
+        If an error occurs while marking the streaks as complete
+    """
+
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if date:
+        timestamp = date if isinstance(date, str) else date.strftime("%Y-%m-%d %H:%M:%S")
+
+    with connect_db(db_name) as con:
+        try:
+            results = _write_completions(con, [(name, None, timestamp) for name in names])
+            con.commit()
+            return results
+
+        except sqlite3.Error as e:
+            con.rollback()
+            raise
+
+
+def _write_completions(
+    con: sqlite3.Connection,
+    completions: list
+) -> list:
+
+    """Helper function inserting completions without committing them
+
+    completions holds (name, period, timestamp) tuples, a period of None is 
+    taken from the habits table. Used by streak_complete_batch and the 
+    write-behind queue, see writebehind.
+    """
+
+    cur = con.cursor()
+    periods = {}
+    unique_names = list(dict.fromkeys(name for name, _, _ in completions))
+
+    # sqlite allows a limited number of parameters per statement
+    for i in range(0, len(unique_names), 500):
+        chunk = unique_names[i:i + 500]
+        result = cur.execute(
+            f"""SELECT name, period 
+            FROM habits 
+            WHERE name IN ({", ".join("?" * len(chunk))}) ;
+            """,
+            chunk)
+        periods.update(result.fetchall())
+
+    rows = [
+        (name, "streak complete", period or periods[name], timestamp) 
+        for name, period, timestamp in completions if name in periods
+    ]
+    cur.executemany(
+        """ INSERT INTO tracking (name, status, current_period, timestamp) 
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT DO NOTHING
+        """,
+        rows
+    )
+    if metrics.enabled:
+        metrics.completions_written.inc(cur.rowcount)
+
+    return [
+        f"{name} streak completed" if name in periods else f"{name} not in database"
+        for name, _, _ in completions
+    ]
+
+
+def export_data(db_name: str = "main.db") -> dict:
+
+    """Function exporting all habits and tracking data
+
+    Parameters
+    ----------
+    db_name : str, optional
+        Name of the database file. Default is "main.db"
+
+    Returns
+    -------
+    dict
+        The keys habits and tracking with one dict per row, archived 
+        tracking rows included
+    """
+
+    with connect_db(db_name) as con:
+        data = {}
+        tracking = _tracking_table(con, db_name, full_history=True)
+        for key, table, order in (("habits", "habits", "name"), ("tracking", tracking, "tracking_id")):
+            cur = con.cursor()
+            result = cur.execute(f"SELECT * FROM {table} ORDER BY {order} ;")
+            col_names = [description[0] for description in cur.description]
+            data[key] = [dict(zip(col_names, row)) for row in result.fetchall()]
+
+        return data
+
+
+def import_data(
+    habits: list,
+    tracking: list,
+    db_name: str = "main.db"
+) -> str:
+
+    """Function importing habits and tracking data
+
+    Imports rows in the format written by export_data in one transaction.
+    Habits already in the database are kept unchanged, tracking rows are 
+    appended with a new tracking_id, except completions of periods which 
+    are already completed.
+
+    Parameters
+    ----------
+    habits : list
+        One dict per habit with the keys name, description, period and active
+
+    tracking : list
+        One dict per tracking entry with the keys name, status, 
+        current_period and timestamp
+
+    db_name : str, optional
+        Name of the database file. Default is "main.db"
+
+    Returns
+    -------
+    str
+        A message with the number of imported habits and tracking entries
+
+    Raises
+    ------
+    sqlite3.Error
+        If an error occurs while importing the data
+    """
+
+    with connect_db(db_name) as con:
+        try:
+            cur = con.cursor()
+            before = cur.execute("SELECT COUNT(*) FROM habits ;").fetchone()[0]
+
+            cur.executemany(
+                """INSERT OR IGNORE INTO habits (name, description, period, active) 
+                VALUES (?, ?, ?, ?)
+                """,
+                [(habit["name"], 
+                  habit.get("description") or "", 
+                  habit["period"], 
+                  1 if habit.get("active", True) else 0) 
+                 for habit in habits]
+            )
+            added_habits = cur.execute("SELECT COUNT(*) FROM habits ;").fetchone()[0] - before
+
+            cur.executemany(
+                """INSERT INTO tracking (name, status, current_period, timestamp) 
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT DO NOTHING
+                """,
+                [(row["name"], row["status"], row["current_period"], row["timestamp"]) 
+                 for row in tracking]
+            )
+            added_tracking = cur.rowcount
+            con.commit()
+            return f"{added_habits} habits and {added_tracking} tracking entries imported"
+
+        except sqlite3.Error as e:
+            con.rollback()
+            raise
+
+
+# rollups of the completions per habit and period, see create_tables
+
+def _bucket_sql(row: str = "") -> str:
+
+    """Helper function returning the SQL of the first day of the period of a tracking row
+
+    row is the prefix of the columns current_period and timestamp, e.g. NEW. 
+    in a trigger.
+    """
+
+    return f"""CASE {row}current_period
+            WHEN 'day' THEN date({row}timestamp)
+            WHEN 'week' THEN date({row}timestamp, 'weekday 0', '-6 days')
+            WHEN 'month' THEN date({row}timestamp, 'start of month')
+            WHEN 'quarter' THEN printf('%04d-%02d-01', 
+                CAST(strftime('%Y', {row}timestamp) AS INTEGER),
+                (CAST(strftime('%m', {row}timestamp) AS INTEGER) - 1) / 3 * 3 + 1)
+            ELSE date({row}timestamp, 'start of year')
+        END"""
+
+
+def _rollup_triggers() -> dict:
+
+    """Helper function returning the triggers keeping tracking_rollups up to date
+
+    A deleted completion lowers the count of its period and, if it was the 
+    first or last one, the first or last timestamp is looked up again with 
+    idx_tracking_name_timestamp. Triggers cannot read the archive, the last 
+    timestamp of a period with only archived completions left stays as it 
+    was until rebuild_rollups. Rows moved by archive_tracking are not 
+    counted as deleted.
+    """
+
+    def bound(function: str) -> str:
+        return f"""(SELECT {function}(timestamp) FROM tracking
+                        WHERE name = OLD.name 
+                            AND timestamp >= tracking_rollups.bucket
+                            AND timestamp < date(tracking_rollups.bucket, '+1 year')
+                            AND current_period = OLD.current_period
+                            AND status = 'streak complete'
+                            AND {_bucket_sql()} = tracking_rollups.bucket)"""
+
+    add = f"""INSERT INTO tracking_rollups 
+                    (name, period, bucket, completions, first_timestamp, last_timestamp)
+                SELECT NEW.name, NEW.current_period, {_bucket_sql("NEW.")}, 1, NEW.timestamp, NEW.timestamp
+                WHERE NEW.status = 'streak complete' AND NEW.timestamp IS NOT NULL
+                ON CONFLICT (name, period, bucket) DO UPDATE SET
+                    completions = completions + 1,
+                    first_timestamp = MIN(first_timestamp, excluded.first_timestamp),
+                    last_timestamp = MAX(last_timestamp, excluded.last_timestamp) ;"""
+
+    remove = f"""UPDATE tracking_rollups 
+                SET completions = completions - 1
+                WHERE OLD.status = 'streak complete' 
+                    AND name = OLD.name 
+                    AND period = OLD.current_period 
+                    AND bucket = {_bucket_sql("OLD.")} ;
+                DELETE FROM tracking_rollups 
+                WHERE completions <= 0 
+                    AND name = OLD.name 
+                    AND period = OLD.current_period ;
+                UPDATE tracking_rollups SET
+                    first_timestamp = COALESCE({bound("MIN")}, first_timestamp),
+                    last_timestamp = COALESCE({bound("MAX")}, last_timestamp)
+                WHERE OLD.status = 'streak complete' 
+                    AND name = OLD.name 
+                    AND period = OLD.current_period 
+                    AND bucket = {_bucket_sql("OLD.")}
+                    AND OLD.timestamp IN (first_timestamp, last_timestamp) ;"""
+
+    return {
+        "tracking_insert_rollup": f"AFTER INSERT ON tracking BEGIN {add} END",
+        "tracking_update_rollup": 
+            f"AFTER UPDATE OF status, current_period, timestamp ON tracking BEGIN {remove} {add} END",
+        "tracking_delete_rollup": 
+            f"""AFTER DELETE ON tracking 
+                WHEN (SELECT archiving FROM archive_state) = 0 
+                BEGIN {remove} END""",
+    }
+
+
+def rebuild_rollups(
+    db_name: str = "main.db",
+    check: bool = False
+) -> dict:
+
+    """Function recomputing tracking_rollups from the tracking data
+
+    The rollups are computed from the tracking table and the archive and 
+    compared with the stored ones, which are replaced unless check is set.
+
+    Parameters
+    ----------
+    db_name : str, optional
+        Name of the database file. Default is "main.db"
+
+    check : bool, optional
+        Only compare, keep the stored rollups. Default is False
+
+    Returns
+    -------
+    dict
+        The number of rollups and of the stored rollups that were missing, 
+        different or not backed by tracking data
+
+    Raises
+    ------
+    sqlite3.Error
+        If an error occurs while rebuilding the rollups
+    """
+
+    with connect_db(db_name) as con:
+        tracking = _tracking_table(con, db_name, full_history=True)
+        try:
+            cur = con.cursor()
+            cur.execute("DROP TABLE IF EXISTS temp.rollups_rebuilt ;")
+            cur.execute(
+                f"""CREATE TEMP TABLE rollups_rebuilt AS
+                SELECT name, current_period AS period, {_bucket_sql()} AS bucket, 
+                    COUNT(*) AS completions, 
+                    MIN(timestamp) AS first_timestamp, 
+                    MAX(timestamp) AS last_timestamp
+                FROM {tracking}
+                WHERE status = 'streak complete' 
+                    AND timestamp IS NOT NULL 
+                    AND name IN (SELECT name FROM habits)
+                GROUP BY 1, 2, 3 ;
+                """
+            )
+            rollups = cur.execute("SELECT COUNT(*) FROM rollups_rebuilt ;").fetchone()[0]
+            differences = cur.execute(
+                """SELECT 
+                    (SELECT COUNT(*) FROM (
+                        SELECT * FROM tracking_rollups EXCEPT SELECT * FROM rollups_rebuilt)) 
+                    + (SELECT COUNT(*) FROM (
+                        SELECT * FROM rollups_rebuilt EXCEPT SELECT * FROM tracking_rollups)) ;
+                """
+            ).fetchone()[0]
+
+            if not check and differences:
+                cur.execute("DELETE FROM tracking_rollups ;")
+                cur.execute("INSERT INTO tracking_rollups SELECT * FROM rollups_rebuilt ;")
+            cur.execute("DROP TABLE temp.rollups_rebuilt ;")
+            con.commit()
+
+            return {"rollups": rollups, "differences": differences}
+
+        except sqlite3.Error as e:
+            con.rollback()
+            raise
+
+
+def deduplicate_completions(db_name: str = "main.db") -> dict:
+
+    """Function removing the completions of periods which were completed before
+
+    Of several completions of a habit in the same period, in the tracking 
+    table and the archive, the one with the lowest tracking_id is kept. 
+    create_tables runs it once when it upgrades a database to the unique 
+    index on completions. The file is vacuumed if rows were removed.
+
+    Parameters
+    ----------
+    db_name : str, optional
+        Name of the database file. Default is "main.db"
+
+    Returns
+    -------
+    dict
+        The number of completions removed from the tracking table and 
+        from the archive
+
+    Raises
+    ------
+    sqlite3.Error
+        If an error occurs while removing the completions
+    """
+
+    with connect_db(db_name) as con:
+        tracking = _tracking_table(con, db_name, full_history=True)
+        tables = ["main.tracking"] + (["archive.tracking"] if tracking != "tracking" else [])
+        try:
+            cur = con.cursor()
+            cur.execute("DROP TABLE IF EXISTS temp.first_completions ;")
+            cur.execute(
+                f"""CREATE TEMP TABLE first_completions AS
+                SELECT MIN(tracking_id) AS tracking_id
+                FROM {tracking}
+                WHERE status = 'streak complete' AND timestamp IS NOT NULL
+                GROUP BY name, current_period, {_bucket_sql()} ;
+                """
+            )
+
+            removed = {}
+            for table in tables:
+                cur.execute(
+                    f"""DELETE FROM {table}
+                    WHERE status = 'streak complete' 
+                        AND timestamp IS NOT NULL
+                        AND tracking_id NOT IN (SELECT tracking_id FROM temp.first_completions) ;
+                    """
+                )
+                removed[table.split(".")[0]] = cur.rowcount
+            cur.execute("DROP TABLE temp.first_completions ;")
+            # the triggers only see the tracking table
+            if removed.get("archive"):
+                cur.execute("UPDATE tracking_rewrites SET rewrites = rewrites + 1 ;")
+            con.commit()
+
+        except sqlite3.Error as e:
+            con.rollback()
+            raise
+
+        if sum(removed.values()):
+            con.execute("VACUUM ;")
+
+    # the rollup triggers only see the tracking table
+    if removed.get("archive"):
+        rebuild_rollups(db_name)
+
+    return {"tracking": removed["main"], "archive": removed.get("archive", 0)}
+
+
+# first day of a coarser period of a bucket, see get_rollups
+_granularity_sql = {
+    "week": "date(bucket, 'weekday 0', '-6 days')",
+    "month": "date(bucket, 'start of month')",
+    "quarter": """printf('%04d-%02d-01', 
+        CAST(strftime('%Y', bucket) AS INTEGER),
+        (CAST(strftime('%m', bucket) AS INTEGER) - 1) / 3 * 3 + 1)""",
+    "year": "date(bucket, 'start of year')",
+}
+
+
+def get_rollups(
+    names: list = None,
+    granularity: str = None,
+    start: datetime = None,
+    end: datetime = None,
+    db_name: str = "main.db"
+) -> pd.DataFrame:
+
+    """Function getting the completions per habit and period from tracking_rollups
+
+    Reads the rollups instead of the tracking rows, so the whole history, 
+    including the archive, costs one row per habit and period.
+
+    Parameters
+    ----------
+    names : list, optional
+        The habits to read. Default is None, all habits
+
+    granularity : str, optional
+        Sum the buckets up to week, month, quarter or year. Buckets of 
+        a longer period than granularity are kept as they are. Default 
+        is None, the period of every habit
+
+    start : datetime, optional
+        Only buckets starting at or after start. Default is None
+
+    end : datetime, optional
+        Only buckets starting before end. Default is None
+
+    db_name : str, optional
+        Name of the database file. Default is "main.db"
+
+    Returns
+    -------
+    pd.DataFrame
+        A DataFrame with name, period, bucket, completions, first_timestamp 
+        and last_timestamp, sorted by name and bucket
+
+    Raises
+    ------
+    ValueError
+        If granularity is not one of week, month, quarter or year
+
+    sqlite3.Error
+        If an error occurs while getting the rollups
+    """
+
+    if granularity is not None and granularity not in _granularity_sql:
+        raise ValueError(f"Unknown granularity: {granularity}")
+
+    bucket = "bucket"
+    if granularity is not None:
+        # a week is not split between months, a longer period is not split at all
+        longer = ["week", "month", "quarter", "year"]
+        longer = longer[longer.index(granularity) + 1:]
+        bucket = f"""CASE WHEN period IN ({", ".join(f"'{period}'" for period in longer) or "''"}) 
+            THEN bucket ELSE {_granularity_sql[granularity]} END"""
+
+    conditions = []
+    values = []
+    if names is not None:
+        conditions.append(f"name IN ({', '.join('?' * len(names))})")
+        values.extend(names)
+    if start is not None:
+        conditions.append("bucket >= ?")
+        values.append(start.strftime("%Y-%m-%d"))
+    if end is not None:
+        conditions.append("bucket < ?")
+        values.append(end.strftime("%Y-%m-%d"))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with connect_db(db_name) as con:
+        try:
+            cur = con.cursor()
+            data = cur.execute(
+                f"""SELECT name, period, {bucket} AS bucket, 
+                    SUM(completions) AS completions,
+                    MIN(first_timestamp) AS first_timestamp, 
+                    MAX(last_timestamp) AS last_timestamp
+                FROM tracking_rollups
+                {where}
+                GROUP BY 1, 2, 3
+                ORDER BY 1, 3 ;
+                """,
+                values
+            )
+            col_names = [description[0] for description in cur.description]
+            return _typed_frame(data.fetchall(), col_names)
+
+        except sqlite3.Error as e:
+            raise
+
+
+# cold storage of old tracking rows, see archive_tracking
+
+# tracking rows older than this many days are moved to the archive
+archive_after_days = int(os.environ.get("HABIT_TRACKER_ARCHIVE_DAYS", "730"))
+
+_tracking_columns = "tracking_id, name, status, current_period, timestamp"
+
+def archive_name(db_name: str = "main.db") -> str:
+
+    """Function returning the file name of the archive of a database, e.g. main.archive.db"""
+
+    root, extension = os.path.splitext(db_name)
+    return f"{root}.archive{extension or '.db'}"
+
+
+def _attach_archive(
+    con: sqlite3.Connection,
+    db_name: str,
+    create: bool = False
+) -> bool:
+
+    """Helper function attaching the archive of a database as schema archive
+
+    Needs to run outside of a transaction. Returns whether the archive is 
+    attached, without create only an existing archive file is attached.
+    """
+
+    if any(row[1] == "archive" for row in con.execute("PRAGMA database_list;")):
+        return True
+
+    if db_name == ":memory:" or not (create or os.path.exists(archive_name(db_name))):
+        return False
+
+    con.execute("ATTACH DATABASE ? AS archive;", (archive_name(db_name), ))
+    if create:
+        con.execute(
+            """CREATE TABLE IF NOT EXISTS archive.tracking (
+                tracking_id INTEGER PRIMARY KEY,
+                name TEXT,
+                status TEXT,
+                current_period TEXT,
+                timestamp DATETIME
+                )
+            """
+        )
+        con.execute(
+            """CREATE INDEX IF NOT EXISTS archive.idx_tracking_name_timestamp 
+                ON tracking (name, timestamp)
+            """
+        )
+    return True
+
+
+def _tracking_table(
+    con: sqlite3.Connection,
+    db_name: str,
+    full_history: bool = False
+) -> str:
+
+    """Helper function returning the table to read tracking rows from
+
+    With full_history and an archive, the union of the tracking table and
+    the archive, else the tracking table.
+    """
+
+    if full_history and _attach_archive(con, db_name):
+        return f"""(SELECT {_tracking_columns} FROM main.tracking 
+                UNION ALL 
+                SELECT {_tracking_columns} FROM archive.tracking)"""
+    return "tracking"
+
+
+def archive_tracking(
+    older_than_days: int = None,
+    db_name: str = "main.db"
+) -> dict:
+
+    """Function moving old tracking rows to the archive database
+
+    Rows with a timestamp older than older_than_days are moved to the 
+    tracking table of the archive file next to the database, see 
+    archive_name, in one transaction. Their completions stay counted in 
+    tracking_rollups. The readers only include the archive when asked 
+    for the full history.
+
+    Parameters
+    ----------
+    older_than_days : int, optional
+        Age in days from which rows are archived. Default is None, meaning 
+        archive_after_days, set by HABIT_TRACKER_ARCHIVE_DAYS or 730
+
+    db_name : str, optional
+        Name of the database file. Default is "main.db"
+
+    Returns
+    -------
+    dict
+        The number of archived rows
+
+    Raises
+    ------
+    ValueError
+        If the database is in memory
+
+    sqlite3.Error
+        If an error occurs while archiving
+    """
+
+    from datetime import timedelta
+
+    if db_name == ":memory:":
+        raise ValueError("An in-memory database has no archive")
+
+    days = archive_after_days if older_than_days is None else older_than_days
+    cutoff = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+
+    with connect_db(db_name) as con:
+        _attach_archive(con, db_name, create=True)
+        try:
+            cur = con.cursor()
+            cur.execute(
+                f"""INSERT INTO archive.tracking ({_tracking_columns})
+                SELECT {_tracking_columns} 
+                FROM main.tracking 
+                WHERE timestamp < ? ;
+                """,
+                (cutoff, )
+            )
+
+            # moved rows stay in tracking_rollups, see create_tables
+            cur.execute("UPDATE archive_state SET archiving = 1 ;")
+            cur.execute("DELETE FROM main.tracking WHERE timestamp < ? ;", (cutoff, ))
+            archived = cur.rowcount
+            cur.execute("UPDATE archive_state SET archiving = 0 ;")
+            con.commit()
+
+            return {"archived": archived}
+
+        except sqlite3.Error as e:
+            con.rollback()
+            raise
+
+
+# columnar export, see export_columnar
+
+# version of the layout written by export_columnar
+COLUMNAR_VERSION = 1
+
+
+def _encode(values, dictionary: dict) -> list:
+
+    """ Dictionary encodes values, None becomes -1 and new values are added to dictionary. """
+
+    return [-1 if value is None else dictionary.setdefault(value, len(dictionary)) for value in values]
+
+
+def _read_columns(db_name: str) -> dict:
+
+    """ Reads habits and tracking, archive included, as NumPy arrays in the layout of export_columnar. """
+
+    import numpy as np
+
+    with connect_db(db_name) as con:
+        habits = con.execute(
+            "SELECT name, description, period, active FROM habits ORDER BY name ;"
+        ).fetchall()
+        tracking = con.execute(
+            f"""SELECT tracking_id, name, status, current_period, timestamp 
+            FROM {_tracking_table(con, db_name, full_history=True)} 
+            ORDER BY tracking_id ;
+            """
+        ).fetchall()
+
+    names, descriptions, periods, statuses = {}, {}, {}, {}
+    habit_columns = list(zip(*habits)) or [(), (), (), ()]
+    tracking_columns = list(zip(*tracking)) or [(), (), (), (), ()]
+
+    columns = {
+        "habit_name": _encode(habit_columns[0], names),
+        "habit_description": _encode(habit_columns[1], descriptions),
+        "habit_period": _encode(habit_columns[2], periods),
+        "habit_active": np.array([bool(active) for active in habit_columns[3]], dtype=bool),
+        "tracking_id": np.array(tracking_columns[0], dtype=np.int64),
+        "tracking_name": _encode(tracking_columns[1], names),
+        "tracking_status": _encode(tracking_columns[2], statuses),
+        "tracking_period": _encode(tracking_columns[3], periods),
+        # seconds since 1970-01-01 of the stored local time, NaT for NULL
+        "tracking_timestamp": np.array(tracking_columns[4], dtype="datetime64[s]").view(np.int64),
+    }
+    for column in ("habit_name", "habit_description", "habit_period", 
+                   "tracking_name", "tracking_status", "tracking_period"):
+        columns[column] = np.array(columns[column], dtype=np.int32)
+
+    for key, dictionary in (("names", names), ("descriptions", descriptions), 
+                            ("periods", periods), ("statuses", statuses)):
+        columns[key] = np.array(list(dictionary), dtype=str)
+
+    return columns
+
+
+def export_columnar(
+    path: str,
+    db_name: str = "main.db"
+) -> dict:
+
+    """Function exporting all habits and tracking data to a columnar file
+
+    Files ending in .parquet are written with pyarrow, all others as a
+    compressed NumPy .npz file. In both the names, descriptions, periods and
+    statuses are dictionary encoded and the timestamps are stored as integer
+    seconds since 1970-01-01.
+
+    The .npz file holds the dictionaries names, descriptions, periods and 
+    statuses, the int32 codes habit_name, habit_description, habit_period,
+    tracking_name, tracking_status and tracking_period (-1 for NULL), 
+    habit_active, tracking_id and tracking_timestamp. The Parquet file holds 
+    the tracking table with dictionary columns, the habits are stored as JSON 
+    in its metadata under the key habits.
+
+    Parameters
+    ----------
+    path : str
+        Name of the file to write
+
+    db_name : str, optional
+        Name of the database file. Default is "main.db"
+
+    Returns
+    -------
+    dict
+        The number of exported habits and tracking entries
+
+    Raises
+    ------
+    ImportError
+        If a Parquet file is requested and pyarrow is not installed
+    """
+
+    import numpy as np
+
+    if path.endswith(".parquet"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+    columns = _read_columns(db_name)
+
+    if path.endswith(".parquet"):
+        def dictionary_array(codes, dictionary):
+            return pa.DictionaryArray.from_arrays(
+                pa.array(codes, mask=codes < 0), 
+                pa.array(dictionary, type=pa.string())
+            )
+
+        habits = [
+            {
+                "name": str(columns["names"][name]),
+                "description": str(columns["descriptions"][description]) if description >= 0 else None,
+                "period": str(columns["periods"][period]),
+                "active": bool(active),
+            }
+            for name, description, period, active in zip(
+                columns["habit_name"], columns["habit_description"], 
+                columns["habit_period"], columns["habit_active"]
+            )
+        ]
+        timestamps = columns["tracking_timestamp"]
+        table = pa.table({
+            "tracking_id": columns["tracking_id"],
+            "name": dictionary_array(columns["tracking_name"], columns["names"]),
+            "status": dictionary_array(columns["tracking_status"], columns["statuses"]),
+            "current_period": dictionary_array(columns["tracking_period"], columns["periods"]),
+            "timestamp": pa.array(
+                timestamps.view("datetime64[s]"), 
+                type = pa.timestamp("s"), 
+                mask = timestamps == np.iinfo(np.int64).min
+            ),
+        })
+        table = table.replace_schema_metadata({
+            "habits": json.dumps(habits),
+            "columnar_version": str(COLUMNAR_VERSION),
+        })
+        pq.write_table(table, path, compression="zstd")
+
+    else:
+        with open(path, "wb") as f:
+            np.savez_compressed(f, version=np.int64(COLUMNAR_VERSION), **columns)
+
+    return {"habits": len(columns["habit_name"]), "tracking": len(columns["tracking_id"])}
+
+
+def load_columnar(path: str) -> dict:
+
+    """Function loading a file written by export_columnar as DataFrames
+
+    Parameters
+    ----------
+    path : str
+        Name of the .npz or .parquet file
+
+    Returns
+    -------
+    dict
+        The keys habits and tracking with a DataFrame each. Names, statuses 
+        and periods are categorical, timestamps datetime64[s].
+
+    Raises
+    ------
+    ValueError
+        If the file was written by a newer version of export_columnar
+    """
+
+    import numpy as np
+    import pandas as pd
+
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path)
+        metadata = table.schema.metadata or {}
+        if int(metadata.get(b"columnar_version", 1)) > COLUMNAR_VERSION:
+            raise ValueError(f"{path} was written by a newer version of export_columnar")
+
+        habits = pd.DataFrame(
+            json.loads(metadata.get(b"habits", b"[]")), 
+            columns = ["name", "description", "period", "active"]
+        )
+        for column in ("name", "period"):
+            habits[column] = habits[column].astype("category")
+        habits["active"] = habits["active"].astype(bool)
+        tracking = table.to_pandas()
+        # Parquet has no unit of seconds, they come back as milliseconds
+        tracking["timestamp"] = tracking["timestamp"].astype("datetime64[s]")
+        return {"habits": habits, "tracking": tracking}
+
+    with np.load(path, allow_pickle=False) as data:
+        if int(data["version"]) > COLUMNAR_VERSION:
+            raise ValueError(f"{path} was written by a newer version of export_columnar")
+
+        def categorical(codes, dictionary):
+            return pd.Categorical.from_codes(codes, categories=data[dictionary].astype(object))
+
+        habits = pd.DataFrame({
+            "name": categorical(data["habit_name"], "names"),
+            "description": categorical(data["habit_description"], "descriptions").astype(object),
+            "period": categorical(data["habit_period"], "periods"),
+            "active": data["habit_active"],
+        })
+        habits["description"] = habits["description"].where(habits["description"].notna(), None)
+
+        tracking = pd.DataFrame({
+            "tracking_id": data["tracking_id"],
+            "name": categorical(data["tracking_name"], "names"),
+            "status": categorical(data["tracking_status"], "statuses"),
+            "current_period": categorical(data["tracking_period"], "periods"),
+            "timestamp": data["tracking_timestamp"].view("datetime64[s]"),
+        })
+
+    return {"habits": habits, "tracking": tracking}
+
+
+def _column_values(series) -> list:
+
+    """ Values of a categorical column as Python objects, None for missing ones. """
+
+    categories = series.cat.categories.tolist()
+    return [categories[code] if code >= 0 else None for code in series.cat.codes.tolist()]
+
+
+def import_columnar(
+    path: str,
+    db_name: str = "main.db"
+) -> str:
+
+    """Function importing a file written by export_columnar
+
+    Works like import_data: habits already in the database are kept 
+    unchanged, tracking rows are appended with a new tracking_id in the 
+    order of their old one, except completions of periods which are 
+    already completed. All rows are written in one transaction.
+
+    Parameters
+    ----------
+    path : str
+        Name of the .npz or .parquet file
+
+    db_name : str, optional
+        Name of the database file. Default is "main.db"
+
+    Returns
+    -------
+    str
+        A message with the number of imported habits and tracking entries
+
+    Raises
+    ------
+    sqlite3.Error
+        If an error occurs while importing the data
+    """
+
+    import numpy as np
+
+    data = load_columnar(path)
+    habits, tracking = data["habits"], data["tracking"]
+
+    timestamps = tracking["timestamp"].to_numpy().astype("datetime64[s]")
+    missing = np.isnat(timestamps)
+    timestamps = np.char.replace(np.datetime_as_string(timestamps, unit="s"), "T", " ").tolist()
+    for i in np.flatnonzero(missing).tolist():
+        timestamps[i] = None
+
+    habit_rows = zip(
+        habits["name"].astype(object).tolist(),
+        [description or "" for description in habits["description"].tolist()],
+        habits["period"].astype(object).tolist(),
+        [1 if active else 0 for active in habits["active"].tolist()]
+    )
+    tracking_rows = zip(
+        _column_values(tracking["name"]),
+        _column_values(tracking["status"]),
+        _column_values(tracking["current_period"]),
+        timestamps
+    )
+
+    with connect_db(db_name) as con:
+        try:
+            cur = con.cursor()
+            before = cur.execute("SELECT COUNT(*) FROM habits ;").fetchone()[0]
+
+            cur.executemany(
+                """INSERT OR IGNORE INTO habits (name, description, period, active) 
+                VALUES (?, ?, ?, ?)
+                """,
+                habit_rows
+            )
+            added_habits = cur.execute("SELECT COUNT(*) FROM habits ;").fetchone()[0] - before
+
+            cur.executemany(
+                """INSERT INTO tracking (name, status, current_period, timestamp) 
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT DO NOTHING
+                """,
+                tracking_rows
+            )
+            added_tracking = cur.rowcount
+            con.commit()
+            return f"{added_habits} habits and {added_tracking} tracking entries imported"
+
+        except sqlite3.Error as e:
+            con.rollback()
+            raise
@@ -0,0 +1,428 @@
+import analysis
+import db
+
+import argparse
+import functools
+import itertools
+import random
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+# Randomized differential test of the period and streak logic. Random
+# histories are checked against a brute force reference, which finds the
+# periods by walking the calendar day by day instead of computing them.
+# A failing history is shrunk to a minimal one before it is reported.
+
+periods = ("day", "week", "month", "quarter", "year")
+
+# periods a history spans at most, per period of the habit
+_spans = {"day": 60, "week": 30, "month": 24, "quarter": 16, "year": 8}
+
+
+class Case:
+
+    """ A history of completions of one habit, checked at today.
+
+    Attributes:
+    -----------
+        period (str):
+            The period of the habit.
+
+        today (datetime):
+            The reference timestamp of the streak functions.
+
+        history (list):
+            Timestamps of the completions in insert order, not sorted.
+
+    """
+
+    __slots__ = ("period", "today", "history")
+
+    def __init__(self, period: str, today: datetime, history: list):
+        self.period = period
+        self.today = today
+        self.history = history
+
+
+    def __repr__(self):
+        history = ", ".join(repr(str(timestamp)) for timestamp in self.history)
+        return f"Case(period={self.period!r}, today={str(self.today)!r}, history=[{history}])"
+
+
+# reference
+
+@functools.lru_cache(maxsize=None)
+def _key(period: str, day: date) -> tuple:
+    if period == "day":
+        return (day, )
+    if period == "week":
+        return day.isocalendar()[:2]
+    if period == "month":
+        return (day.year, day.month)
+    if period == "quarter":
+        return (day.year, (day.month - 1) // 3)
+    return (day.year, )
+
+
+_reference_cache = {}
+
+
+def _reference_days(period: str, day: date) -> tuple:
+
+    """ First and last day of the period of day, found by walking the calendar. """
+
+    key = (period, _key(period, day))
+    if key not in _reference_cache:
+        first = last = day
+        while _key(period, first - timedelta(days=1)) == key[1]:
+            first -= timedelta(days=1)
+        while _key(period, last + timedelta(days=1)) == key[1]:
+            last += timedelta(days=1)
+        _reference_cache[key] = (first, last)
+    return _reference_cache[key]
+
+
+def reference_period(
+    period: str,
+    timestamp: datetime,
+    previous_period: bool = True
+) -> tuple:
+
+    """ Brute force version of analysis._dynamic_periods. """
+
+    first, last = _reference_days(period, timestamp.date())
+    if previous_period:
+        first, last = _reference_days(period, first - timedelta(days=1))
+
+    return (
+        datetime(first.year, first.month, first.day),
+        datetime(last.year, last.month, last.day, 23, 59, 59)
+    )
+
+
+def _reference_periods(case: Case) -> list:
+
+    """ (key, completed) of every period from the first completion to today, the latest first. """
+
+    today = case.today.date()
+    completed = {
+        _key(case.period, timestamp.date())
+        for timestamp in case.history
+        if timestamp <= case.today
+    }
+    if not completed:
+        return []
+
+    first = min(timestamp.date() for timestamp in case.history)
+    keys = []
+    day = today
+    while day >= first:
+        key = _key(case.period, day)
+        if not keys or keys[-1] != key:
+            keys.append(key)
+        day = _reference_days(case.period, day)[0] - timedelta(days=1)
+
+    return [(key, key in completed) for key in keys]
+
+
+def reference_current_streak(case: Case) -> int:
+    return sum(1 for _ in itertools.takewhile(lambda entry: entry[1], _reference_periods(case)))
+
+
+def reference_streak_series(case: Case) -> list:
+    entries = _reference_periods(case)
+    # the current period is not missed before it has ended
+    if entries and not entries[0][1]:
+        entries = entries[1:]
+
+    series = []
+    for completed, group in itertools.groupby(entries, key=lambda entry: entry[1]):
+        length = len(list(group))
+        series.append((length, 0) if completed else (0, length))
+    return series
+
+
+# random histories
+
+@functools.lru_cache(maxsize=None)
+def _edge_dates(period: str, start: date, end: date) -> tuple:
+
+    """ Days where periods begin or end and leap days between start and end. """
+
+    days = []
+    for year in range(start.year, end.year + 1):
+        for month in range(1, 13):
+            first = date(year, month, 1)
+            days.extend((first, first - timedelta(days=1)))
+        if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+            days.append(date(year, 2, 29))
+    if period in ("day", "week"):
+        day = start
+        while day <= end:
+            if day.weekday() in (0, 6):
+                days.append(day)
+            day += timedelta(days=1)
+    return tuple(day for day in days if start <= day <= end)
+
+
+def _random_time(rng: random.Random, day: date) -> datetime:
+    choice = rng.random()
+    if choice < 0.25:
+        return datetime(day.year, day.month, day.day)
+    if choice < 0.5:
+        return datetime(day.year, day.month, day.day, 23, 59, 59)
+    return datetime(day.year, day.month, day.day, rng.randrange(24), rng.randrange(60), rng.randrange(60))
+
+
+def random_case(rng: random.Random) -> Case:
+
+    """ Generates a random history, biased to the edges of the periods.
+
+    Today is a random day of the years 1999 to 2030, often an edge day
+    itself. The history has runs of completed periods with gaps between
+    them, duplicate completions in a period and its timestamps shuffled.
+
+    """
+
+    period = rng.choice(periods)
+    year = rng.randrange(1999, 2031)
+    if rng.random() < 0.3:
+        today = _random_time(rng, rng.choice(_edge_dates(period, date(year, 1, 1), date(year, 12, 31))))
+    else:
+        today = _random_time(rng, date(year, 1, 1) + timedelta(days=rng.randrange(365)))
+    span = rng.randrange(1, _spans[period] + 1)
+
+    # walk back period by period, completing most of them in runs
+    history = []
+    first, last = _reference_days(period, today.date())
+    completing = rng.random() < 0.7
+    for _ in range(span):
+        if rng.random() < 0.25:
+            completing = not completing
+        if completing:
+            for _ in range(1 + (rng.random() < 0.15)):
+                last_day = min(last, today.date())
+                edges = _edge_dates(period, first, last_day) if rng.random() < 0.5 else ()
+                day = rng.choice(edges) if edges else first + timedelta(days=rng.randrange((last_day - first).days + 1))
+                timestamp = _random_time(rng, day)
+                history.append(min(timestamp, today))
+        first, last = _reference_days(period, first - timedelta(days=1))
+
+    if rng.random() < 0.7:
+        rng.shuffle(history)
+    else:
+        history.sort()
+    return Case(period, today, history)
+
+
+# checks
+
+def _completions(case: Case) -> list:
+    return sorted(
+        ((timestamp, case.period) for timestamp in case.history),
+        key = lambda completion: completion[0],
+        reverse = True
+    )
+
+
+def check(case: Case) -> str:
+
+    """ Compares the analysis functions with the reference on one case.
+
+    Returns:
+    --------
+        str:
+            The first difference, None if there is none.
+
+    """
+
+    for timestamp in [case.today] + case.history:
+        for previous_period in (False, True):
+            result = analysis._dynamic_periods(case.period, timestamp, previous_period)
+            expected = reference_period(case.period, timestamp, previous_period)
+            if result != expected:
+                return (
+                    f"_dynamic_periods({case.period!r}, {str(timestamp)!r}, {previous_period}) "
+                    f"= {result}, expected {expected}"
+                )
+
+    completions = _completions(case)
+
+    result = analysis._current_streak(completions, case.period, case.today)
+    expected = reference_current_streak(case)
+    if result != expected:
+        return f"current streak {result}, expected {expected}"
+
+    result = analysis._streak_series(completions, case.period, case.today)
+    expected = reference_streak_series(case)
+    if result != expected:
+        return f"streak series {result}, expected {expected}"
+
+    # the vectorized versions of the period cache
+    timestamps = np.array(case.history, dtype="datetime64[s]")
+    indices = np.unique(analysis._period_indices(case.period, timestamps))
+    if indices.tolist() != sorted({analysis._period_index(case.period, timestamp) for timestamp in case.history}):
+        return f"_period_indices {indices.tolist()}"
+
+    today_index = analysis._period_index(case.period, case.today)
+    result = analysis._current_streak_indices(indices, today_index)
+    if result != reference_current_streak(case):
+        return f"current streak on indices {result}, expected {reference_current_streak(case)}"
+
+    result = analysis._streak_series_indices(indices, today_index)
+    if result != expected:
+        return f"streak series on indices {result}, expected {expected}"
+
+    return None
+
+
+def check_database(case: Case, db_name: str) -> str:
+
+    """ Like check, but the history is written to a database and read back.
+
+    The completions are inserted in the order of the history, so the
+    sorting of the tracking data is checked as well, and only the first
+    one of every period is kept. db_name needs the habits and tracking
+    tables and no habit called 'difftest'.
+
+    """
+
+    db.add_habit(name="difftest", period=case.period, db_name=db_name)
+    try:
+        for timestamp in case.history:
+            db.streak_complete(name="difftest", period=case.period, date=timestamp, db_name=db_name)
+
+        tracking_df = db.get_tracking_data(name="difftest", db_name=db_name)
+        completions = analysis._completions(tracking_df) if not tracking_df.empty else []
+    finally:
+        db.delete_habit(name="difftest", db_name=db_name)
+
+    first = {}
+    for timestamp in case.history:
+        first.setdefault(_key(case.period, timestamp.date()), timestamp)
+    expected = _completions(Case(case.period, case.today, list(first.values())))
+    if completions != expected:
+        return f"tracking data {completions}, expected {expected}"
+
+    result = analysis._current_streak(completions, case.period, case.today)
+    expected = reference_current_streak(case)
+    if result != expected:
+        return f"current streak {result}, expected {expected}"
+
+    result = analysis._streak_series(completions, case.period, case.today)
+    expected = reference_streak_series(case)
+    if result != expected:
+        return f"streak series {result}, expected {expected}"
+
+    return None
+
+
+def shrink(case: Case, failing=None) -> Case:
+
+    """ Shrinks a failing case to a minimal history that still fails.
+
+    Removes completions by delta debugging, first in large chunks, then one
+    by one, and moves the remaining timestamps to midnight where possible.
+
+    Parameter:
+    ----------
+        case (Case):
+            A case check fails on.
+
+        failing (callable, optional):
+            Returns whether a case fails. Defaults to check returning a difference.
+
+    Returns:
+    --------
+        Case:
+            The smallest failing case found.
+
+    """
+
+    failing = failing or (lambda candidate: check(candidate) is not None)
+    history = list(case.history)
+
+    chunks = 2
+    while len(history) >= 2:
+        size = -(-len(history) // chunks)
+        for i in range(0, len(history), size):
+            candidate = history[:i] + history[i + size:]
+            if failing(Case(case.period, case.today, candidate)):
+                history = candidate
+                chunks = max(chunks - 1, 2)
+                break
+        else:
+            if size == 1:
+                break
+            chunks = min(chunks * 2, len(history))
+
+    if len(history) == 1 and failing(Case(case.period, case.today, [])):
+        history = []
+
+    for i, timestamp in enumerate(history):
+        midnight = timestamp.replace(hour=0, minute=0, second=0)
+        candidate = history[:i] + [midnight] + history[i + 1:]
+        if midnight != timestamp and failing(Case(case.period, case.today, candidate)):
+            history = candidate
+
+    return Case(case.period, case.today, history)
+
+
+def run(cases: int = 10000, seed: int = 0, duration: float = None) -> dict:
+
+    """ Checks random cases until cases ran or duration passed.
+
+    Parameter:
+    ----------
+        cases (int, optional):
+            Number of cases. Defaults to 10000.
+
+        seed (int, optional):
+            Seed of the generator, the same seed gives the same cases. Defaults to 0.
+
+        duration (float, optional):
+            Stop after this many seconds instead. Defaults to None.
+
+    Returns:
+    --------
+        dict:
+            Cases run, cases per second and the shrunk failures with their difference.
+
+    """
+
+    rng = random.Random(seed)
+    failures = []
+    started = time.perf_counter()
+    count = 0
+
+    while (time.perf_counter() - started < duration) if duration else count < cases:
+        case = random_case(rng)
+        count += 1
+        if check(case) is not None:
+            case = shrink(case)
+            failures.append((case, check(case)))
+
+    elapsed = time.perf_counter() - started
+    return {
+        "cases": count,
+        "cases_per_second": count / elapsed if elapsed else 0.0,
+        "failures": failures,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Randomized differential test of the period and streak logic")
+    parser.add_argument("--cases", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--duration", type=float, help="run for this many seconds instead of --cases")
+    parser.add_argument("--max-failures", type=int, default=5, help="failures to print")
+    args = parser.parse_args()
+
+    result = run(cases=args.cases, seed=args.seed, duration=args.duration)
+
+    print(f"{result['cases']} cases, {result['cases_per_second']:.0f} cases/sec, "
+          f"{len(result['failures'])} failures")
+    for case, difference in result["failures"][:args.max_failures]:
+        print(f"{case}\n    {difference}")
@@ -0,0 +1,337 @@
+import db
+
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+# Synthetic habit databases for benchmarks. The same seed and end date
+# always produce the same database.
+
+default_period_mix = {
+    "day": 0.6,
+    "week": 0.25,
+    "month": 0.1,
+    "quarter": 0.03,
+    "year": 0.02,
+}
+
+
+def _insert_slowing_objects(con) -> list:
+
+    """ Returns the (type, name) of the triggers and indexes on habits and tracking.
+
+    They are dropped while the rows are inserted and brought back by
+    db.create_tables. Indexes of UNIQUE constraints are part of the table.
+
+    """
+
+    return con.execute(
+        """SELECT type, name FROM sqlite_master
+        WHERE type IN ('trigger', 'index')
+        AND tbl_name IN ('habits', 'tracking')
+        AND name NOT LIKE 'sqlite_autoindex%' ;
+        """
+    ).fetchall()
+
+
+def _period_starts(
+        period: str,
+        start: datetime,
+        end: datetime
+) -> list:
+
+    """ Returns the start of every period between start and end, plus the first start after end. """
+
+    if period == "day":
+        current = start.replace(hour=0, minute=0, second=0)
+    elif period == "week":
+        current = start.replace(hour=0, minute=0, second=0) - timedelta(days=start.weekday())
+    else:
+        month = start.month
+        if period == "quarter":
+            month = ((month - 1) // 3) * 3 + 1
+        elif period == "year":
+            month = 1
+        current = start.replace(month=month, day=1, hour=0, minute=0, second=0)
+
+    starts = [current]
+    while current <= end:
+        if period == "day":
+            current = current + timedelta(days=1)
+        elif period == "week":
+            current = current + timedelta(days=7)
+        else:
+            step = {"month": 1, "quarter": 3, "year": 12}[period]
+            month_index = current.year * 12 + current.month - 1 + step
+            current = current.replace(year=month_index // 12, month=month_index % 12 + 1)
+        starts.append(current)
+
+    return starts
+
+
+def generate_rows(
+        habits: int = 100,
+        years: float = 1.0,
+        period_mix: dict = None,
+        completion_probability: float = 0.8,
+        break_probability: float = 0.02,
+        max_break_length: int = 10,
+        backfill_fraction: float = 0.05,
+        inactive_fraction: float = 0.1,
+        seed: int = 0,
+        end: datetime = None
+) -> tuple[list, list]:
+
+    """ Generates the rows of the habits and tracking tables.
+
+    Parameter:
+    ----------
+        habits (int, optional):
+            Number of habits. Defaults to 100.
+
+        years (float, optional):
+            Years of history before the end date. Defaults to 1.0.
+
+        period_mix (dict, optional):
+            Share of every period among the habits. Defaults to default_period_mix.
+
+        completion_probability (float, optional):
+            Chance that a habit is completed in a period outside of a break.
+            Defaults to 0.8.
+
+        break_probability (float, optional):
+            Chance that a break starts in a period. Defaults to 0.02.
+
+        max_break_length (int, optional):
+            Longest break in periods, break lengths are uniform from 1 on.
+            Defaults to 10.
+
+        backfill_fraction (float, optional):
+            Share of completions inserted after all other rows, so their
+            tracking_id is out of order with their timestamp. Defaults to 0.05.
+
+        inactive_fraction (float, optional):
+            Share of inactive habits. Defaults to 0.1.
+
+        seed (int, optional):
+            Seed of the random generator. Defaults to 0.
+
+        end (datetime, optional):
+            Last day of the history. Defaults to today, so the data
+            only changes once a day.
+
+    Returns:
+    --------
+        tuple[list, list]:
+            Rows for the habits table (name, description, period, active)
+            and for the tracking table (name, status, current_period, timestamp).
+
+    """
+
+    rng = random.Random(seed)
+    period_mix = period_mix or default_period_mix
+    end = end or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    end = end.replace(hour=0, minute=0, second=0, microsecond=0)
+    start = end - timedelta(days=int(years * 365))
+
+    periods = list(period_mix)
+    weights = [period_mix[period] for period in periods]
+
+    # timestamps are put together from precomputed strings, formatting a
+    # datetime for every row would dominate the run time
+    first_day = _period_starts("year", start, start)[0]
+    day_strings = [
+        (first_day + timedelta(days=day)).strftime("%Y-%m-%d ")
+        for day in range((end - first_day).days + 1)
+    ]
+    time_strings = [
+        f"{second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}"
+        for second in range(86400)
+    ]
+
+    # per period the first day and the number of days of every period,
+    # the last one ends with the end date
+    days_per_period = {}
+    for period in periods:
+        period_starts = _period_starts(period, start, end)
+        days_per_period[period] = [
+            ((period_start - first_day).days, (min(next_start, end + timedelta(days=1)) - period_start).days)
+            for period_start, next_start in zip(period_starts, period_starts[1:])
+            if start <= period_start <= end
+        ]
+
+    start_string = start.strftime("%Y-%m-%d %H:%M:%S")
+    habit_rows = []
+    tracking_rows = []
+    backfill_rows = []
+    random_ = rng.random
+    randrange = rng.randrange
+
+    for i in range(habits):
+        name = f"habit {i:06d}"
+        period = rng.choices(periods, weights)[0]
+        active = random_() >= inactive_fraction
+        habit_rows.append((name, f"synthetic {period} habit", period, 1 if active else 0))
+
+        # every habit starts with the status entry written by db.add_habit
+        tracking_rows.append((name, "active" if active else "inactive", period, start_string))
+
+        break_left = 0
+        for first, days in days_per_period[period]:
+            if break_left > 0:
+                break_left -= 1
+                continue
+
+            if random_() < break_probability:
+                break_left = randrange(max_break_length)
+                continue
+
+            if random_() >= completion_probability:
+                continue
+
+            row = (
+                name,
+                "streak complete",
+                period,
+                day_strings[first + randrange(days)] + time_strings[randrange(86400)]
+            )
+
+            if random_() < backfill_fraction:
+                backfill_rows.append(row)
+            else:
+                tracking_rows.append(row)
+
+    rng.shuffle(backfill_rows)
+    return habit_rows, tracking_rows + backfill_rows
+
+
+def generate_database(
+        db_name: str,
+        overwrite: bool = False,
+        **options
+) -> dict:
+
+    """ Creates a database filled with synthetic habits and tracking data.
+
+    The rows are written with bulk inserts in one transaction. Journal and
+    sync are switched off while writing, the write version and rollup triggers
+    and the indexes are recreated afterwards and the rollups computed in one
+    query, so millions of rows are written in seconds.
+
+    Parameter:
+    ----------
+        db_name (str):
+            Name of the database file to create.
+
+        overwrite (bool, optional):
+            Replace an existing file. Defaults to False.
+
+        **options:
+            Passed on to generate_rows.
+
+    Returns:
+    --------
+        dict:
+            Number of habits and tracking rows and the seconds needed.
+
+    Raises:
+    -------
+        FileExistsError:
+            If the database file exists and overwrite is False.
+
+    """
+
+    if os.path.exists(db_name):
+        if not overwrite:
+            raise FileExistsError(f"{db_name} already exists")
+        os.remove(db_name)
+
+    started = time.perf_counter()
+    habit_rows, tracking_rows = generate_rows(**options)
+    generated = time.perf_counter()
+
+    db.create_tables(db_name)
+
+    con = db.connect_db(db_name)
+    try:
+        con.execute("PRAGMA journal_mode = OFF;")
+        con.execute("PRAGMA synchronous = OFF;")
+        # the generated rows reference only generated habits
+        con.execute("PRAGMA foreign_keys = OFF;")
+        for type, name in _insert_slowing_objects(con):
+            con.execute(f"DROP {type.upper()} IF EXISTS {name};")
+
+        con.executemany(
+            """INSERT INTO habits (name, description, period, active)
+            VALUES (?, ?, ?, ?)
+            """,
+            habit_rows
+        )
+        con.executemany(
+            """INSERT INTO tracking (name, status, current_period, timestamp)
+            VALUES (?, ?, ?, ?)
+            """,
+            tracking_rows
+        )
+        con.execute("UPDATE write_version SET version = version + 1;")
+        con.commit()
+    finally:
+        db.close_db(con)
+
+    # brings back the triggers and builds the indexes in one go
+    db.create_tables(db_name)
+    db.rebuild_rollups(db_name)
+
+    return {
+        "habits": len(habit_rows),
+        "tracking_rows": len(tracking_rows),
+        "generate_seconds": generated - started,
+        "insert_seconds": time.perf_counter() - generated,
+    }
+
+
+def _parse_period_mix(text: str) -> dict:
+    period_mix = {}
+    for part in text.split(","):
+        period, share = part.split("=")
+        period_mix[period.strip()] = float(share)
+    return period_mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic habit database")
+    parser.add_argument("db_name")
+    parser.add_argument("--habits", type=int, default=100)
+    parser.add_argument("--years", type=float, default=1.0)
+    parser.add_argument("--period-mix", type=_parse_period_mix,
+                        help="e.g. day=0.6,week=0.3,month=0.1")
+    parser.add_argument("--completion-probability", type=float, default=0.8)
+    parser.add_argument("--break-probability", type=float, default=0.02)
+    parser.add_argument("--max-break-length", type=int, default=10)
+    parser.add_argument("--backfill-fraction", type=float, default=0.05)
+    parser.add_argument("--inactive-fraction", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--end", type=datetime.fromisoformat,
+                        help="last day of the history, default today")
+    parser.add_argument("--overwrite", action="store_true")
+    args = parser.parse_args()
+
+    result = generate_database(
+        args.db_name,
+        overwrite = args.overwrite,
+        habits = args.habits,
+        years = args.years,
+        period_mix = args.period_mix,
+        completion_probability = args.completion_probability,
+        break_probability = args.break_probability,
+        max_break_length = args.max_break_length,
+        backfill_fraction = args.backfill_fraction,
+        inactive_fraction = args.inactive_fraction,
+        seed = args.seed,
+        end = args.end
+    )
+
+    print(f"{result['habits']} habits and {result['tracking_rows']} tracking rows written to {args.db_name}")
+    print(f"generated in {result['generate_seconds']:.2f} s, inserted in {result['insert_seconds']:.2f} s")
@@ -1,6 +1,5 @@
 import db
 from datetime import datetime
-import pandas as pd
 import analysis as a
 
 class Habit:
@@ -73,6 +72,37 @@ class Habit:
             self.add()
     
 
+    @classmethod
+    def from_db(
+        cls,
+        name: str,
+        period: str,
+        description: str = None,
+        active: bool = True,
+        db_name: str = "main.db"
+    ):
+
+        """ Creates a Habit instance for a habit read from the database.
+
+        Unlike the constructor it does not check the database for the habit,
+        so loading a list of habits costs no query per habit.
+
+        Returns:
+        --------
+            Habit: The habit instance.
+
+        """
+
+        habit = cls.__new__(cls)
+        habit._set_period(period)
+        habit.name = name
+        habit.description = description
+        habit.active = active
+        habit.db_name = db_name
+        habit.streak_complete = False
+        return habit
+
+
     def _set_period(self, period: str):
 
         """ Checks if the period selected is valid
@@ -187,7 +217,11 @@ class Habit:
 
     def mark_as_complete(self):
 
-        """ Marks the habit as completed for the current period and updates the database. """
+        """ Marks the habit as completed for the current period and updates the database.
+
+        Calling it again in the same period writes nothing, see db.streak_complete.
+
+        """
 
         today = datetime.now().replace(microsecond=0)
 
@@ -197,12 +231,19 @@ class Habit:
             date = today,
             db_name = self.db_name,
         )
+        self.streak_complete = True
 
 
-    def check_completion_status(self):
+    def check_completion_status(self, last_entry: tuple = None):
 
         """ Checks if the habit has been completed within the current tracking period.
 
+        Parameter:
+        -----
+            last_entry (tuple, optional): 
+                Status and timestamp of the latest entry, as returned by 
+                db.get_last_entry. Read from the database if not given.
+
         Updates:
         --------
             self.streak_complete (bool): 
@@ -212,18 +253,17 @@ class Habit:
 
         today = datetime.now().replace(microsecond=0)
 
-        tracking_df = db.get_tracking_data(
-            name = self.name,
-            db_name= self.db_name
-        )
+        if last_entry is None:
+            last_entry = db.get_last_entry(
+                name = self.name,
+                db_name= self.db_name
+            )
 
-        if tracking_df.empty:
+        if last_entry is None:
             self.streak_complete = False
             return
-        
-        tracking_df["timestamp"] = pd.to_datetime(tracking_df["timestamp"])
 
-        last_entry = tracking_df.nlargest(1, "timestamp").iloc[0]
+        status, timestamp = last_entry
 
         start, end = a._dynamic_periods(
             period = self.period,
@@ -232,7 +272,7 @@ class Habit:
         )
 
         self.streak_complete = (
-            start <= last_entry["timestamp"] <= end and last_entry["status"] == "streak complete"
+            start <= datetime.fromisoformat(timestamp) <= end and status == "streak complete"
         )
 
 
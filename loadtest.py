@@ -0,0 +1,308 @@
+import db
+import analysis
+import writebehind
+from habit import Habit
+
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import threading
+import time
+
+# Load test of the habit tracker with several users on one database file.
+# Every user runs a random mix of the app's operations in a loop, either as
+# a thread of this process or as a process of its own. The test writes
+# completions, run it on a copy of a database.
+
+default_mix = {
+    "mark_as_complete": 0.1,
+    "check_completion_status": 0.4,
+    "get_current_streak": 0.3,
+    "get_habits_series": 0.2,
+}
+
+
+def _is_lock_error(error: sqlite3.Error) -> bool:
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+def _user(
+    db_name: str,
+    habits: list,
+    mix: dict,
+    duration: float,
+    seed: int,
+    pool: bool,
+    write_behind: bool,
+    barrier
+) -> dict:
+
+    """ Runs the operations of one user for duration seconds, once all users wait at barrier.
+
+    Returns the latencies in seconds per operation, the number of lock
+    errors and the other errors by message.
+
+    """
+
+    # the lazy imports of the analysis would otherwise be part of the first latencies
+    import pandas
+    from dateutil.relativedelta import relativedelta
+
+    barrier.wait()
+    deadline = time.perf_counter() + duration
+
+    if pool:
+        db.enable_connection_pool()
+    if write_behind:
+        writebehind.enabled = True
+
+    rng = random.Random(seed)
+    operations = list(mix)
+    weights = [mix[operation] for operation in operations]
+    latencies = {operation: [] for operation in operations}
+    lock_errors = 0
+    errors = {}
+
+    while time.perf_counter() < deadline:
+        operation = rng.choices(operations, weights)[0]
+        name, period = rng.choice(habits)
+        habit = Habit.from_db(name=name, period=period, db_name=db_name)
+
+        start = time.perf_counter()
+        try:
+            if operation == "mark_as_complete":
+                habit.mark_as_complete()
+            elif operation == "check_completion_status":
+                habit.check_completion_status()
+            elif operation == "get_current_streak":
+                habit.get_current_streak()
+            elif operation == "get_habits_series":
+                analysis.get_habits_series(name=name, db_name=db_name)
+            else:
+                raise ValueError(f"Invalid operation '{operation}'")
+        except sqlite3.Error as e:
+            if _is_lock_error(e):
+                lock_errors += 1
+            else:
+                errors[str(e)] = errors.get(str(e), 0) + 1
+            continue
+
+        latencies[operation].append(time.perf_counter() - start)
+
+    return {"latencies": latencies, "lock_errors": lock_errors, "errors": errors}
+
+
+def _run_user(*args) -> dict:
+
+    """ Runs _user, a user stopped by an error returns it as "failed" and breaks the barrier. """
+
+    try:
+        return _user(*args)
+    except Exception as e:
+        # the other users and run_load_test would wait at the barrier forever
+        args[-1].abort()
+        message = f"{type(e).__name__}: {e}"
+        return {"latencies": {}, "lock_errors": 0, "errors": {message: 1}, "failed": message}
+
+
+def _process_user(queue, *args):
+    result = _run_user(*args)
+    writebehind.close_all()
+    queue.put(result)
+
+
+def _percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000
+
+
+def run_load_test(
+    db_name: str,
+    users: int = 8,
+    duration: float = 10.0,
+    mode: str = "thread",
+    mix: dict = None,
+    seed: int = 0,
+    pool: bool = False,
+    write_behind: bool = False
+) -> dict:
+
+    """ Runs users concurrently against one database and measures their operations.
+
+    Parameter:
+    ----------
+        db_name (str):
+            Database file name, needs active habits.
+
+        users (int, optional):
+            Number of concurrent users. Defaults to 8.
+
+        duration (float, optional):
+            Seconds to run the test. Defaults to 10.0.
+
+        mode (str, optional):
+            "thread" runs every user in a thread, "process" in a process
+            of its own. Defaults to "thread".
+
+        mix (dict, optional):
+            Share of every operation. Defaults to default_mix.
+
+        seed (int, optional):
+            Seed of the random choices, user i uses seed + i. Defaults to 0.
+
+        pool (bool, optional):
+            Every user keeps one connection open, see db.enable_connection_pool.
+            Defaults to False.
+
+        write_behind (bool, optional):
+            Completions of the users of a process are committed in batches,
+            see writebehind. Defaults to False.
+
+    Returns:
+    --------
+        dict:
+            Operations, operations per second, lock errors, other errors by
+            message and per operation count and latency percentiles in ms.
+
+    Raises:
+    -------
+        ValueError:
+            If mode is invalid or the database has no active habits.
+
+        RuntimeError:
+            If a user stopped with an error other than a sqlite3.Error.
+
+    """
+
+    if mode not in ("thread", "process"):
+        raise ValueError(f"Invalid mode '{mode}'. Valid options are: ('thread', 'process')")
+
+    mix = mix or default_mix
+    db.ensure_schema(db_name)
+
+    with db.connect_db(db_name) as con:
+        habits = con.execute("SELECT name, period FROM habits WHERE active = 1 ;").fetchall()
+
+    if not habits:
+        raise ValueError("The database has no active habits to test with")
+
+    if mode == "thread":
+        barrier = threading.Barrier(users + 1)
+        results = [None] * users
+
+        def run(i):
+            results[i] = _run_user(db_name, habits, mix, duration, seed + i, pool, write_behind, barrier)
+
+        workers = [threading.Thread(target=run, args=(i, )) for i in range(users)]
+    else:
+        context = multiprocessing.get_context()
+        barrier = context.Barrier(users + 1)
+        queue = context.Queue()
+        workers = [
+            context.Process(
+                target=_process_user,
+                args=(queue, db_name, habits, mix, duration, seed + i, pool, write_behind, barrier)
+            )
+            for i in range(users)
+        ]
+
+    for worker in workers:
+        worker.start()
+    try:
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        # a user failed before the start, see _run_user
+        pass
+    started = time.perf_counter()
+
+    if mode == "process":
+        results = [queue.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    if mode == "thread" and pool:
+        db.enable_connection_pool(False)
+    if mode == "thread" and write_behind:
+        writebehind.close_all()
+        writebehind.enabled = False
+
+    failed = [f"user {i}: {result['failed']}" for i, result in enumerate(results) if "failed" in result]
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {users} users failed, " + "; ".join(failed))
+
+    per_operation = {}
+    errors = {}
+    for operation in mix:
+        latencies = sorted(value for result in results for value in result["latencies"][operation])
+        per_operation[operation] = {
+            "count": len(latencies),
+            "p50_ms": _percentile(latencies, 50),
+            "p95_ms": _percentile(latencies, 95),
+            "p99_ms": _percentile(latencies, 99),
+            "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+        }
+    for result in results:
+        for message, count in result["errors"].items():
+            errors[message] = errors.get(message, 0) + count
+
+    operations = sum(entry["count"] for entry in per_operation.values())
+    return {
+        "operations": operations,
+        "operations_per_second": operations / elapsed,
+        "lock_errors": sum(result["lock_errors"] for result in results),
+        "errors": errors,
+        "per_operation": per_operation,
+    }
+
+
+def _parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        operation, share = part.split("=")
+        mix[operation.strip()] = float(share)
+    return mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent load test of the habit tracker database")
+    parser.add_argument("db_name", help="database file, a synthetic one is generated if it does not exist")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--mode", choices=("thread", "process"), default="thread")
+    parser.add_argument("--mix", type=_parse_mix,
+                        help="e.g. mark_as_complete=0.1,check_completion_status=0.5,get_current_streak=0.4")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pool", action="store_true", help="keep one connection open per user")
+    parser.add_argument("--write-behind", action="store_true", help="commit the completions in batches")
+    parser.add_argument("--habits", type=int, default=200, help="habits of a generated database")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db_name):
+        import generate_data
+        generate_data.generate_database(args.db_name, habits=args.habits)
+
+    result = run_load_test(
+        db_name = args.db_name,
+        users = args.users,
+        duration = args.duration,
+        mode = args.mode,
+        mix = args.mix,
+        seed = args.seed,
+        pool = args.pool,
+        write_behind = args.write_behind
+    )
+
+    print(f"{args.users} users as {'threads' if args.mode == 'thread' else 'processes'}, {args.duration:g} s")
+    print(f"{'operation':<26}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for operation, entry in result["per_operation"].items():
+        print(f"{operation:<26}{entry['count']:>8}{entry['p50_ms']:>10.2f}{entry['p95_ms']:>10.2f}"
+              f"{entry['p99_ms']:>10.2f}{entry['max_ms']:>10.2f}")
+    print(f"operations/sec: {result['operations_per_second']:.1f}")
+    print(f"lock errors:    {result['lock_errors']}")
+    for message, count in result["errors"].items():
+        print(f"error:          {message} ({count}x)")
@@ -0,0 +1,333 @@
+import bisect
+import functools
+import os
+import threading
+import time
+
+# Counters, gauges and histograms in the Prometheus text format, without
+# the prometheus client library. db.py and analysis.py only feed them while
+# enabled, disabled they cost one attribute lookup per call. http.server is
+# only imported by serve, this module is loaded on the core paths.
+
+enabled = os.environ.get("HABIT_TRACKER_METRICS") == "1"
+
+_registry = []
+_databases = set()
+_registry_lock = threading.Lock()
+
+
+def enable(on: bool = True) -> None:
+
+    """ Switches collecting metrics on or off. """
+
+    global enabled
+    enabled = on
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+
+    """ Base of all metrics, a value per combination of label values.
+
+    Attributes:
+    -----------
+        name (str):
+            Metric name, e.g. habit_tracker_completions_written_total.
+
+        documentation (str):
+            Text of the HELP line.
+
+        label_names (tuple):
+            Names of the labels, every update passes a value for each.
+
+    """
+
+    type_name = None
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+        with _registry_lock:
+            _registry.append(self)
+
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+    def samples(self) -> list:
+
+        """ Returns (suffix, labels, value) for every sample of the metric. """
+
+        with self._lock:
+            return [
+                ("", _format_labels(self.label_names, labels), value)
+                for labels, value in sorted(self._values.items())
+            ]
+
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(
+            f"{self.name}{suffix}{labels} {_format_value(value)}"
+            for suffix, labels, value in self.samples()
+        )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+
+    """ Value that only goes up. """
+
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, *labels) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+
+class Gauge(Metric):
+
+    """ Value that is set to its current state. """
+
+    type_name = "gauge"
+
+    def set(self, value: float, *labels) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+
+class Histogram(Metric):
+
+    """ Distribution of observed values, e.g. durations in seconds. """
+
+    type_name = "histogram"
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: tuple = (),
+        buckets: tuple = default_buckets
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+
+    def observe(self, value: float, *labels) -> None:
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # counts per bucket, not cumulative, then sum and count
+                state = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+
+    def count(self, *labels) -> int:
+        state = self._values.get(labels)
+        return state[2] if state else 0
+
+
+    def samples(self) -> list:
+        samples = []
+        with self._lock:
+            for labels, (bucket_counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+                    samples.append((
+                        "_bucket",
+                        _format_labels(self.label_names, labels, f'le="{_format_value(float(bound))}"'),
+                        cumulative
+                    ))
+                samples.append(("_bucket", _format_labels(self.label_names, labels, 'le="+Inf"'), count))
+                samples.append(("_sum", _format_labels(self.label_names, labels), total))
+                samples.append(("_count", _format_labels(self.label_names, labels), count))
+        return samples
+
+
+def timed(histogram: Histogram, *labels):
+
+    """ Decorator observing the run time of a function in histogram, while enabled. """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *labels)
+        return wrapper
+    return decorator
+
+
+# metrics of the habit tracker
+
+completions_written = Counter(
+    "habit_tracker_completions_written_total",
+    "Completions written to the tracking table."
+)
+query_duration = Histogram(
+    "habit_tracker_query_duration_seconds",
+    "Time to execute an SQL statement, fetching the rows not included.",
+    ("statement", ),
+    buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+)
+analysis_duration = Histogram(
+    "habit_tracker_analysis_duration_seconds",
+    "Time spent computing analysis results.",
+    ("function", )
+)
+snapshot_requests = Counter(
+    "habit_tracker_snapshot_requests_total",
+    "Analysis snapshot reads, result hit if the stored snapshot was fresh.",
+    ("result", )
+)
+database_size = Gauge(
+    "habit_tracker_database_size_bytes",
+    "Size of the database file, with its journal.",
+    ("database", )
+)
+
+
+def watch_database(db_name: str) -> None:
+
+    """ Reports the size of a database file as database_size on every export. """
+
+    _databases.add(db_name)
+
+
+def render() -> str:
+
+    """ Returns all metrics in the Prometheus text format. """
+
+    for db_name in list(_databases):
+        size = 0
+        for path in (db_name, f"{db_name}-wal", f"{db_name}-journal"):
+            if os.path.exists(path):
+                size += os.path.getsize(path)
+        database_size.set(size, db_name)
+
+    with _registry_lock:
+        metrics = list(_registry)
+
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+def write_file(path: str) -> None:
+
+    """ Writes all metrics to a file, e.g. for the textfile collector of the node exporter.
+
+    The file is replaced in one step, so a reader never sees half of it.
+
+    """
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(tmp_path, path)
+
+
+def write_file_every(path: str, interval: float = 15.0) -> threading.Thread:
+
+    """ Enables the metrics and rewrites the file every interval seconds in a daemon thread. """
+
+    enable()
+
+    def run():
+        while True:
+            write_file(path)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, daemon=True, name="metrics-file-writer")
+    thread.start()
+    return thread
+
+
+def serve(host: str = "127.0.0.1", port: int = 9464):
+
+    """ Enables the metrics and serves them on http://host:port/metrics in a daemon thread.
+
+    Parameter:
+    ----------
+        host (str, optional):
+            Address to listen on. Defaults to '127.0.0.1'.
+
+        port (int, optional):
+            Port to listen on, 0 picks a free port. Defaults to 9464.
+
+    Returns:
+    --------
+        ThreadingHTTPServer:
+            The running server, stopped with shutdown.
+
+    """
+
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+        """ Serves the metrics on GET /metrics. """
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+
+            data = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+
+        def log_message(self, format, *args):
+            pass
+
+    enable()
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-server").start()
+    return server
@@ -0,0 +1,271 @@
+import db
+import analysis
+
+import json
+import os
+import threading
+import uuid
+
+# On-disk cache of the completions as period indices, see PeriodCache.
+# numpy is imported lazily like pandas, importing this module is cheap.
+
+# version of the layout, a cache of another version is rebuilt
+CACHE_VERSION = 2
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class PeriodCache:
+
+    """ Completions of every habit as sorted, unique period indices, memory-mapped.
+
+    All indices live in one contiguous int64 file, an offsets index in
+    index.json gives the slice of every habit. The indices are numbered by
+    analysis._period_index in the current period of the habit. update reads
+    only the tracking rows with a tracking_id above the last one it has seen
+    and rewrites the file, copying the slices of unchanged habits. The file
+    is replaced with a new one and never changed in place, so processes
+    mapping an older one keep valid data.
+
+    A habit renamed, deleted or given another period, or tracking rows
+    updated or deleted, are noticed by update and lead to a full rebuild.
+    Changed rows are noticed by the counter in db's tracking_rewrites,
+    so an update without them reads only the new rows.
+
+    Attributes:
+    -----------
+        db_name (str):
+            The name of the database file.
+
+        cache_dir (str):
+            Directory of the cache files.
+
+        last_tracking_id (int):
+            The highest tracking_id in the cache.
+
+    """
+
+    def __init__(self, db_name: str = "main.db", cache_dir: str = None):
+
+        """ Initializes a PeriodCache instance, nothing is read before load or update.
+
+        Parameter:
+        ----------
+            db_name (str, optional):
+                Database file name. Defaults to 'main.db'.
+
+            cache_dir (str, optional):
+                Directory of the cache files. Defaults to the database
+                file name plus '.periodcache'.
+
+        Raises:
+        -------
+            ValueError:
+                If the database is in memory.
+
+        """
+
+        if db_name == ":memory:":
+            raise ValueError("An in-memory database has no period cache")
+
+        self.db_name = db_name
+        self.cache_dir = cache_dir or f"{db_name}.periodcache"
+        self.last_tracking_id = 0
+        self._rewrites = None
+        self._habits = {}
+        self._data_file = None
+        self._data = None
+        self._index_mtime = None
+        self._lock = threading.Lock()
+
+
+    @property
+    def _index_file(self) -> str:
+        return os.path.join(self.cache_dir, "index.json")
+
+
+    def load(self) -> bool:
+
+        """ Reads the cache files, if another instance or process has updated them.
+
+        Returns:
+        --------
+            bool:
+                Whether a cache of the current version was found.
+
+        """
+
+        import numpy as np
+
+        for _ in range(3):
+            try:
+                stat = os.stat(self._index_file)
+            except FileNotFoundError:
+                return False
+            mtime = (stat.st_mtime_ns, stat.st_ino)
+            if mtime == self._index_mtime:
+                return True
+
+            with open(self._index_file, encoding="utf-8") as f:
+                index = json.load(f)
+            if index.get("version") != CACHE_VERSION:
+                return False
+
+            data_path = os.path.join(self.cache_dir, index["data"])
+            try:
+                if os.path.getsize(data_path) > 0:
+                    data = np.memmap(data_path, dtype=np.int64, mode="r")
+                else:
+                    # an empty file cannot be mapped
+                    data = np.empty(0, dtype=np.int64)
+                break
+            except FileNotFoundError:
+                # replaced by another process since the index was read
+                continue
+        else:
+            return False
+
+        self.last_tracking_id = index["last_tracking_id"]
+        self._rewrites = index["rewrites"]
+        self._habits = {name: tuple(entry) for name, entry in index["habits"].items()}
+        self._data_file = index["data"]
+        self._data = data
+        self._index_mtime = mtime
+        return True
+
+
+    def names(self) -> list:
+
+        """ Names of all habits in the cache. """
+
+        return list(self._habits)
+
+
+    def period(self, name: str) -> str:
+
+        """ The period the indices of a habit are numbered in, None if the habit is unknown. """
+
+        entry = self._habits.get(name)
+        return entry[0] if entry else None
+
+
+    def indices(self, name: str):
+
+        """ The period indices of a habit, a read-only view into the mapped file.
+
+        Returns:
+        --------
+            np.ndarray:
+                Sorted, unique int64 indices, empty for an unknown habit.
+
+        """
+
+        import numpy as np
+
+        entry = self._habits.get(name)
+        if entry is None:
+            return np.empty(0, dtype=np.int64)
+        _, offset, length = entry
+        return self._data[offset:offset + length]
+
+
+    def update(self) -> int:
+
+        """ Adds the completions written since the last update.
+
+        Returns:
+        --------
+            int:
+                The number of completions read from the database.
+
+        """
+
+        import numpy as np
+
+        with self._lock:
+            rebuild = not self.load()
+
+            with db.connect_db(self.db_name) as con:
+                # archived rows keep their tracking_id, they count as well
+                tracking = db._tracking_table(con, self.db_name, full_history=True)
+                # read first, a change while reading rebuilds on the next update
+                rewrites = con.execute("SELECT rewrites FROM tracking_rewrites ;").fetchone()[0]
+                habits = dict(con.execute("SELECT name, period FROM habits ;").fetchall())
+                last_tracking_id = con.execute(f"SELECT MAX(tracking_id) FROM {tracking} ;").fetchone()[0] or 0
+
+                if not rebuild:
+                    rebuild = (
+                        rewrites != self._rewrites
+                        or last_tracking_id < self.last_tracking_id
+                        or any(habits.get(name) != entry[0] for name, entry in self._habits.items())
+                    )
+
+                since = 0 if rebuild else self.last_tracking_id
+                rows = con.execute(
+                    f"""SELECT name, timestamp FROM {tracking}
+                    WHERE tracking_id > ? AND tracking_id <= ?
+                        AND status = 'streak complete' AND timestamp IS NOT NULL ;
+                    """,
+                    (since, last_tracking_id)
+                ).fetchall()
+
+            if not rebuild and not rows and habits.keys() == self._habits.keys():
+                # only rows other than completions were added
+                self.last_tracking_id = last_tracking_id
+                return 0
+
+            new_timestamps = {}
+            for name, timestamp in rows:
+                new_timestamps.setdefault(name, []).append(timestamp)
+
+            os.makedirs(self.cache_dir, exist_ok=True)
+            data_file = f"indices-{uuid.uuid4().hex}.bin"
+            entries = {}
+            offset = 0
+
+            with open(os.path.join(self.cache_dir, data_file), "wb") as f:
+                for name in sorted(habits):
+                    period = habits[name]
+                    indices = np.empty(0, dtype=np.int64) if rebuild else self.indices(name)
+
+                    if name in new_timestamps:
+                        timestamps = np.array(new_timestamps[name], dtype="datetime64[s]")
+                        indices = np.union1d(indices, analysis._period_indices(period, timestamps))
+
+                    f.write(np.ascontiguousarray(indices, dtype=np.int64).tobytes())
+                    entries[name] = [period, offset, len(indices)]
+                    offset += len(indices)
+
+            index = {
+                "version": CACHE_VERSION,
+                "last_tracking_id": last_tracking_id,
+                "rewrites": rewrites,
+                "data": data_file,
+                "habits": entries,
+            }
+            tmp_path = f"{self._index_file}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self._index_file)
+
+            old_data_file = self._data_file
+            self.load()
+            if old_data_file and old_data_file != data_file:
+                try:
+                    os.remove(os.path.join(self.cache_dir, old_data_file))
+                except OSError:
+                    # still mapped on systems which do not allow removing it
+                    pass
+
+            return len(rows)
+
+
+def open_cache(db_name: str = "main.db") -> PeriodCache:
+
+    """ Returns the PeriodCache of a database, one instance per database and process. """
+
+    with _caches_lock:
+        if db_name not in _caches:
+            _caches[db_name] = PeriodCache(db_name)
+        return _caches[db_name]
@@ -0,0 +1,90 @@
+import db
+import analysis
+
+import logging
+import sqlite3
+import threading
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotWorker(threading.Thread):
+
+    """ Background thread keeping the analysis snapshots up to date.
+
+    The worker watches the write version of the database, see
+    db.get_write_version, with its own connection. It is increased by
+    every change of habits and tracking, but not by the snapshots the
+    worker stores itself. After a write and after every change of the day
+    (which also covers the start of a new week, month, quarter and year)
+    all stale snapshots are recomputed.
+
+    Attributes:
+    -----------
+        db_name (str):
+            The name of the database file.
+
+        poll_interval (float):
+            Seconds between two checks for new writes.
+
+    """
+
+    def __init__(
+        self,
+        db_name: str = "main.db",
+        poll_interval: float = 1.0
+    ):
+
+        """ Initializes a SnapshotWorker instance.
+
+        Parameter:
+        ----------
+            db_name (str, optional):
+                Database file name. Defaults to 'main.db'.
+
+            poll_interval (float, optional):
+                Seconds between two checks for new writes. Defaults to 1.0.
+        """
+
+        super().__init__(name="snapshot-worker", daemon=True)
+        self.db_name = db_name
+        self.poll_interval = poll_interval
+        self._stop_event = threading.Event()
+
+
+    def run(self):
+
+        """ Recomputes stale snapshots after every write and day change until stopped. """
+
+        # the write_version table of older databases
+        db.ensure_schema(self.db_name)
+        con = db.connect_db(self.db_name)
+        last_version = None
+        last_day = None
+
+        try:
+            while not self._stop_event.is_set():
+                version = con.execute("SELECT version FROM write_version;").fetchone()[0]
+                today = date.today()
+
+                if version != last_version or today != last_day:
+                    try:
+                        analysis.refresh_snapshots(db_name=self.db_name)
+                    except sqlite3.Error:
+                        logger.exception("Refreshing the analysis snapshots failed")
+
+                    last_version = version
+                    last_day = today
+
+                self._stop_event.wait(self.poll_interval)
+        finally:
+            db.close_db(con)
+
+
+    def stop(self, timeout: float = None):
+
+        """ Stops the worker and waits for it to finish. """
+
+        self._stop_event.set()
+        self.join(timeout)
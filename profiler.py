@@ -0,0 +1,273 @@
+import cProfile
+import functools
+import inspect
+import os
+import threading
+import time
+from datetime import datetime
+
+# Optional profiling of the app renders. Sections like a tab or a habit
+# card are timed and their time is split into db, analysis and widgets,
+# by timing the functions of db.py and analysis.py while a render is
+# profiled. Nothing is wrapped before a profile is started.
+
+enabled = os.environ.get("HABIT_TRACKER_PROFILE") == "1"
+
+# a cProfile dump per rerun is written here, when set
+output_dir = os.environ.get("HABIT_TRACKER_PROFILE_DIR")
+
+categories = ("db", "analysis", "widgets")
+
+_local = threading.local()
+_instrumented = set()
+_instrument_lock = threading.Lock()
+
+
+class Section:
+
+    """ A timed block of a render, with its nested sections.
+
+    Attributes:
+    -----------
+        name (str):
+            Name of the block, e.g. the tab or the habit.
+
+        duration (float):
+            Seconds spent in the block, nested sections included.
+
+        times (dict):
+            Seconds spent per category in the block itself,
+            nested sections excluded.
+
+        children (list):
+            The nested sections in the order they ran.
+
+    """
+
+    __slots__ = ("name", "duration", "times", "children")
+
+    def __init__(self, name):
+        self.name = name
+        self.duration = 0.0
+        self.times = dict.fromkeys(categories, 0.0)
+        self.children = []
+
+
+    def total(self, category: str) -> float:
+
+        """ Seconds spent in a category, nested sections included. """
+
+        return self.times[category] + sum(child.total(category) for child in self.children)
+
+
+class RenderProfile:
+
+    """ Profile of one render of the app, see start and stop. """
+
+    def __init__(self, profile_to_disk: bool = False):
+        self.root = Section("render")
+        self._sections = [self.root]
+        self._categories = ["widgets"]
+        self._switched = time.perf_counter()
+        self._started = self._switched
+        self.profile_file = None
+        self._cprofile = cProfile.Profile() if profile_to_disk else None
+
+
+    def _charge(self):
+        # the time since the last switch belongs to the innermost section
+        # and the innermost category
+        now = time.perf_counter()
+        self._sections[-1].times[self._categories[-1]] += now - self._switched
+        self._switched = now
+
+
+    def enter_category(self, category: str):
+        self._charge()
+        self._categories.append(category)
+
+
+    def exit_category(self):
+        self._charge()
+        self._categories.pop()
+
+
+    def enter_section(self, name: str) -> Section:
+        self._charge()
+        section = Section(name)
+        self._sections[-1].children.append(section)
+        self._sections.append(section)
+        return section
+
+
+    def exit_section(self, section: Section, started: float):
+        self._charge()
+        section.duration += time.perf_counter() - started
+        self._sections.remove(section)
+
+
+    def rows(self, min_share: float = 0.0) -> list:
+
+        """ Flattens the sections to one dict per section, depth first.
+
+        Parameter:
+        ----------
+            min_share (float, optional):
+                Leave out sections below this share of the render. Defaults to 0.0.
+
+        Returns:
+        --------
+            list:
+                Dicts with section, depth, ms, share and the ms per category.
+
+        """
+
+        total = self.root.duration or 1e-9
+        rows = []
+
+        def visit(section, depth):
+            if depth and section.duration / total < min_share:
+                return
+            row = {
+                "section": section.name,
+                "depth": depth,
+                "ms": section.duration * 1000,
+                "share": section.duration / total,
+            }
+            for category in categories:
+                row[f"{category} ms"] = section.total(category) * 1000
+            rows.append(row)
+            for child in section.children:
+                visit(child, depth + 1)
+
+        visit(self.root, 0)
+        return rows
+
+
+def _current() -> RenderProfile:
+    return _local.__dict__.get("profile")
+
+
+def _timed(func, category):
+
+    """ Wraps a function, so its time is charged to category while a profile runs. """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = _current()
+        if profile is None:
+            return func(*args, **kwargs)
+
+        profile.enter_category(category)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.exit_category()
+
+    wrapper.__profiler_wrapped__ = True
+    return wrapper
+
+
+def instrument(module, category: str) -> None:
+
+    """ Replaces the public functions of a module with timed wrappers, once per module. """
+
+    with _instrument_lock:
+        if module.__name__ in _instrumented:
+            return
+
+        for name, func in inspect.getmembers(module, inspect.isfunction):
+            if name.startswith("_") or func.__module__ != module.__name__:
+                continue
+            if getattr(func, "__profiler_wrapped__", False):
+                continue
+            setattr(module, name, _timed(func, category))
+
+        _instrumented.add(module.__name__)
+
+
+def start(profile_to_disk: bool = None) -> RenderProfile:
+
+    """ Starts profiling the render running in the current thread.
+
+    Parameter:
+    ----------
+        profile_to_disk (bool, optional):
+            Also run cProfile and write its output to output_dir on stop.
+            Defaults to None, meaning whenever output_dir is set.
+
+    Returns:
+    --------
+        RenderProfile:
+            The profile, to be passed to stop.
+
+    """
+
+    import db
+    import analysis
+
+    instrument(db, "db")
+    instrument(analysis, "analysis")
+
+    if profile_to_disk is None:
+        profile_to_disk = bool(output_dir)
+
+    profile = RenderProfile(profile_to_disk)
+    _local.profile = profile
+    if profile._cprofile is not None:
+        profile._cprofile.enable()
+    return profile
+
+
+def stop(profile: RenderProfile) -> RenderProfile:
+
+    """ Stops the profile and writes the cProfile output, if it was captured. """
+
+    if profile._cprofile is not None:
+        profile._cprofile.disable()
+
+    profile._charge()
+    profile.root.duration = time.perf_counter() - profile._started
+    if _current() is profile:
+        del _local.profile
+
+    if profile._cprofile is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        profile.profile_file = os.path.join(
+            output_dir,
+            f"rerun-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.prof"
+        )
+        profile._cprofile.dump_stats(profile.profile_file)
+
+    return profile
+
+
+class section:
+
+    """ Context manager timing a block as section of the running profile.
+
+    Does nothing when no profile runs in the current thread, e.g.
+
+        with profiler.section("Inactive Habits"):
+            inactive_tab()
+
+    """
+
+    __slots__ = ("name", "_profile", "_section", "_started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+    def __enter__(self):
+        self._profile = _current()
+        if self._profile is not None:
+            self._started = time.perf_counter()
+            self._section = self._profile.enter_section(self.name)
+        return self
+
+
+    def __exit__(self, *exc_info):
+        if self._profile is not None:
+            self._profile.exit_section(self._section, self._started)
+        return False
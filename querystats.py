@@ -0,0 +1,357 @@
+import contextlib
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+import metrics
+
+# Optional instrumentation of the SQL statements issued through db.py.
+# While disabled, db.connect_db opens plain sqlite3 connections and
+# nothing in here runs.
+
+logger = logging.getLogger(__name__)
+
+enabled = os.environ.get("HABIT_TRACKER_QUERY_STATS") == "1"
+
+# statements slower than this are logged as warning
+slow_threshold_ms = float(os.environ.get("HABIT_TRACKER_SLOW_QUERY_MS", 100))
+
+_local = threading.local()
+_this_file = os.path.abspath(__file__)
+_db_file = os.path.join(os.path.dirname(_this_file), "db.py")
+# frames of these files are never reported as call site
+_skipped_files = {_this_file, os.path.join(os.path.dirname(_this_file), "profiler.py")}
+
+
+def enable(on: bool = True, this_thread: bool = False) -> None:
+
+    """ Switches the instrumentation on or off for connections opened afterwards.
+
+    With this_thread only for the calling thread, e.g. one app render,
+    the other threads keep the process-wide setting.
+
+    """
+
+    global enabled
+    if this_thread:
+        _local.enabled = on
+    else:
+        enabled = on
+
+
+def is_enabled() -> bool:
+
+    """ Whether the instrumentation is on for the calling thread. """
+
+    return enabled or getattr(_local, "enabled", False)
+
+
+def fingerprint(sql: str) -> str:
+
+    """ Normalizes a statement, so statements only differing in their values are counted together.
+
+    Literals become ``?``, lists of placeholders ``(?)`` and whitespace is collapsed.
+
+    """
+
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?)", sql)
+    return " ".join(sql.split())
+
+
+def _call_site() -> str:
+
+    """ Returns the db.py function and the first caller outside of db.py. """
+
+    frame = sys._getframe(1)
+    db_function = None
+
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename == _db_file:
+            db_function = db_function or frame.f_code.co_name
+        elif filename not in _skipped_files:
+            caller = f"{os.path.basename(filename)}:{frame.f_lineno} {frame.f_code.co_name}"
+            return f"{caller} -> db.{db_function}" if db_function else caller
+        frame = frame.f_back
+
+    return f"db.{db_function}" if db_function else "unknown"
+
+
+class QueryRecord:
+
+    """ One executed statement. Rows and duration grow while its rows are fetched. """
+
+    __slots__ = ("fingerprint", "rows", "duration", "call_site")
+
+    def __init__(self, fingerprint, rows, duration, call_site):
+        self.fingerprint = fingerprint
+        self.rows = rows
+        self.duration = duration
+        self.call_site = call_site
+
+
+class QueryStats:
+
+    """ Collects the statements and connections of a block, e.g. one page render.
+
+    Attributes:
+    -----------
+        queries (list):
+            A QueryRecord per executed statement.
+
+        connections (int):
+            Number of connections opened by db.connect_db.
+
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.connections = 0
+
+
+    @property
+    def query_count(self) -> int:
+        return len(self.queries)
+
+
+    @property
+    def statement_count(self) -> int:
+
+        """ Number of statements without the connection setup of db.connect_db. """
+
+        return sum(1 for query in self.queries if not query.call_site.endswith("db.connect_db"))
+
+
+    @property
+    def total_ms(self) -> float:
+        return sum(query.duration for query in self.queries) * 1000
+
+
+    def aggregate(self) -> list:
+
+        """ Returns one dict per fingerprint, the most expensive first.
+
+        Returns:
+        --------
+            list:
+                Dicts with fingerprint, calls, total_ms, max_ms, rows and call_sites.
+
+        """
+
+        by_fingerprint = {}
+        for query in self.queries:
+            entry = by_fingerprint.setdefault(query.fingerprint, {
+                "fingerprint": query.fingerprint,
+                "calls": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "rows": 0,
+                "call_sites": set(),
+            })
+            entry["calls"] += 1
+            entry["total_ms"] += query.duration * 1000
+            entry["max_ms"] = max(entry["max_ms"], query.duration * 1000)
+            entry["rows"] += max(query.rows, 0)
+            entry["call_sites"].add(query.call_site)
+
+        return sorted(by_fingerprint.values(), key=lambda entry: entry["total_ms"], reverse=True)
+
+
+# collectors of all threads, e.g. for a test rendering the app in a script thread
+_global_collectors = []
+
+
+def _collectors() -> list:
+    return _local.__dict__.setdefault("collectors", []) + _global_collectors
+
+
+def begin(all_threads: bool = False) -> QueryStats:
+
+    """ Starts collecting the statements of the current thread, or of all threads, see end. """
+
+    stats = QueryStats()
+    if all_threads:
+        _global_collectors.append(stats)
+    else:
+        _local.__dict__.setdefault("collectors", []).append(stats)
+    return stats
+
+
+def end(stats: QueryStats) -> QueryStats:
+
+    """ Stops collecting into stats. """
+
+    for collectors in (_local.__dict__.get("collectors", []), _global_collectors):
+        if stats in collectors:
+            collectors.remove(stats)
+    return stats
+
+
+class QueryBudgetExceeded(AssertionError):
+
+    """ Raised by query_budget when a block issued more statements or connections than allowed. """
+
+
+@contextlib.contextmanager
+def query_budget(
+    max_statements: int = None,
+    max_connections: int = None,
+    all_threads: bool = False
+):
+
+    """ Context manager failing when the block exceeds a budget of statements or connections.
+
+    Switches the instrumentation on for the block, only for the calling
+    thread unless all_threads is set. Connections already held by the
+    connection pool are not instrumented and not counted.
+
+    Parameter:
+    ----------
+        max_statements (int, optional):
+            Allowed statements, the connection setup of db.connect_db is not
+            counted. Defaults to None, no limit.
+
+        max_connections (int, optional):
+            Allowed connections opened by db.connect_db. Defaults to None, no limit.
+
+        all_threads (bool, optional):
+            Also instrument and count statements of other threads.
+            Defaults to False.
+
+    Returns:
+    --------
+        QueryStats:
+            The statements of the block, as target of the with statement.
+
+    Raises:
+    -------
+        QueryBudgetExceeded:
+            If the block exceeded a budget, listing its statements.
+
+    """
+
+    this_thread = not all_threads
+    was_enabled = getattr(_local, "enabled", False) if this_thread else enabled
+    enable(this_thread=this_thread)
+    stats = begin(all_threads)
+    try:
+        yield stats
+    finally:
+        end(stats)
+        enable(was_enabled, this_thread=this_thread)
+
+    exceeded = []
+    if max_statements is not None and stats.statement_count > max_statements:
+        exceeded.append(f"{stats.statement_count} statements (budget {max_statements})")
+    if max_connections is not None and stats.connections > max_connections:
+        exceeded.append(f"{stats.connections} connections (budget {max_connections})")
+
+    if exceeded:
+        details = "\n".join(
+            f"  {entry['calls']:>5}x {entry['fingerprint']}  [{', '.join(sorted(entry['call_sites']))}]"
+            for entry in stats.aggregate()
+        )
+        raise QueryBudgetExceeded(f"Query budget exceeded: {', '.join(exceeded)}\n{details}")
+
+
+def record_connection() -> None:
+    for stats in _collectors():
+        stats.connections += 1
+
+
+def _record(sql: str, rows: int, duration: float) -> QueryRecord:
+    if metrics.enabled:
+        metrics.query_duration.observe(duration, sql.lstrip().split(None, 1)[0].upper())
+
+    # connections are also instrumented for the metrics alone
+    if not is_enabled():
+        return None
+
+    record = QueryRecord(fingerprint(sql), rows, duration, _call_site())
+
+    for stats in _collectors():
+        stats.queries.append(record)
+
+    if duration * 1000 > slow_threshold_ms:
+        logger.warning("Slow query (%.1f ms) at %s: %s", duration * 1000, record.call_site, record.fingerprint)
+
+    return record
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+
+    """ Cursor timing its statements and counting the fetched rows. """
+
+    _last_record = None
+
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._last_record = _record(sql, self.rowcount, time.perf_counter() - start)
+
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._last_record = _record(sql, self.rowcount, time.perf_counter() - start)
+
+
+    def _fetched(self, rows, start):
+        record = self._last_record
+        if record is None:
+            return
+
+        was_slow = record.duration * 1000 > slow_threshold_ms
+        record.rows = max(record.rows, 0) + rows
+        record.duration += time.perf_counter() - start
+
+        if not was_slow and record.duration * 1000 > slow_threshold_ms:
+            logger.warning("Slow query (%.1f ms) at %s: %s", record.duration * 1000, record.call_site, record.fingerprint)
+
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(0 if row is None else 1, start)
+        return row
+
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(len(rows), start)
+        return rows
+
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(len(rows), start)
+        return rows
+
+
+class InstrumentedConnection(sqlite3.Connection):
+
+    """ Connection handing out InstrumentedCursor objects, also for its execute shortcuts. """
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -1,62 +1,133 @@
 import os
 import sys
+import time
+import hashlib
 import subprocess
 
+base_path = os.path.dirname(os.path.abspath(__file__))
+fingerprint_file = ".requirements-fingerprint"
+
+
 def ensure_virtualenv():
 
     """ Checks if a virtual environment already exists and creates one if not existent.
         Activates the environment.
+
+        Returns the path of the python interpreter of the environment.
     """
 
-    venv_path = os.path.join(os.getcwd(), 'venv')
+    # next to the app, wherever it is started from
+    venv_path = os.path.join(base_path, 'venv')
 
     if not os.path.exists(venv_path):
         print("Virtual environment not found. Creating one...")
-        subprocess.run([sys.executable, "-m", "venv", "venv"])
+        subprocess.run([sys.executable, "-m", "venv", venv_path], check=True)
         print("Virtual environment created.")
 
-    activate_venv(venv_path)
+    return activate_venv(venv_path)
 
 
 def activate_venv(venv_path):
 
-    """ Activates the virtual environment """
+    """ Activates the virtual environment
+
+        Sets the environment variables the activate script would set, so
+        every subprocess started afterwards runs inside the environment.
+        Returns the path of the python interpreter of the environment.
+    """
 
     if os.name == 'nt':
-        python_executable = os.path.join(venv_path, 'Scripts', 'python.exe')
+        bin_path = os.path.join(venv_path, 'Scripts')
+        python_executable = os.path.join(bin_path, 'python.exe')
     else:
-        python_executable = os.path.join(venv_path, 'bin', 'python')
+        bin_path = os.path.join(venv_path, 'bin')
+        python_executable = os.path.join(bin_path, 'python')
+
+    if not os.path.exists(python_executable):
+        print(f"Error: {python_executable} does not exist. Delete {venv_path} and start again.")
+        sys.exit(1)
+
+    os.environ["VIRTUAL_ENV"] = venv_path
+    os.environ["PATH"] = bin_path + os.pathsep + os.environ.get("PATH", "")
+    os.environ.pop("PYTHONHOME", None)
 
-    sys.executable = python_executable
     print(f"Virtual environment activated using {venv_path}")
+    return python_executable
 
 
-def install_requirements():
+def requirements_fingerprint(requirements_file, venv_path):
 
-    """ Installs all requirements from the requiremnts.tx file """
+    """ Hash of the requirements file and the python version of the environment """
 
-    requirements_file = "requirements.txt"
-    if os.path.exists(requirements_file):
-        print(f"Installing packages from {requirements_file}...")
-        subprocess.run([sys.executable, "-m", "pip", "install", "-r", requirements_file], check=True)
-        print("All requirements installed.")
-    else:
+    fingerprint = hashlib.sha256()
+    with open(requirements_file, "rb") as f:
+        fingerprint.update(f.read())
+
+    # pyvenv.cfg holds the python version the environment was created with
+    pyvenv_cfg = os.path.join(venv_path, "pyvenv.cfg")
+    if os.path.exists(pyvenv_cfg):
+        with open(pyvenv_cfg, "rb") as f:
+            fingerprint.update(f.read())
+
+    return fingerprint.hexdigest()
+
+
+def install_requirements(python_executable):
+
+    """ Installs all requirements from the requiremnts.tx file
+
+        Skips the installation, when the requirements and the python version
+        did not change since the last successful installation.
+    """
+
+    requirements_file = os.path.join(base_path, "requirements.txt")
+    if not os.path.exists(requirements_file):
         print(f"No {requirements_file} found. Skipping dependency installation.")
+        return
+
+    venv_path = os.environ["VIRTUAL_ENV"]
+    stored_fingerprint_file = os.path.join(venv_path, fingerprint_file)
+    fingerprint = requirements_fingerprint(requirements_file, venv_path)
+
+    if os.path.exists(stored_fingerprint_file):
+        with open(stored_fingerprint_file, encoding="utf-8") as f:
+            if f.read().strip() == fingerprint:
+                print("Requirements unchanged. Skipping dependency installation.")
+                return
+
+    print(f"Installing packages from {requirements_file}...")
+    subprocess.run([python_executable, "-m", "pip", "install", "-r", requirements_file], check=True)
 
+    with open(stored_fingerprint_file, "w", encoding="utf-8") as f:
+        f.write(fingerprint)
+    print("All requirements installed.")
+
+
+def run_streamlit_app(python_executable):
 
-def run_streamlit_app():
-    
     """ Executes the streamlit app in the virtual environment. """
 
-    app_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    app_file = os.path.join(base_path, "app.py")
     if not os.path.exists(app_file):
         print(f"Error: {app_file} does not exist.")
         sys.exit(1)
 
-    streamlit_command = [sys.executable, "-m", "streamlit", "run", app_file]
+    streamlit_command = [python_executable, "-m", "streamlit", "run", app_file]
     subprocess.run(streamlit_command)
 
 if __name__ == "__main__":
-    ensure_virtualenv()
-    install_requirements()
-    run_streamlit_app()
+    timings = []
+
+    start = time.perf_counter()
+    python_executable = ensure_virtualenv()
+    timings.append(("virtual environment", time.perf_counter() - start))
+
+    start = time.perf_counter()
+    install_requirements(python_executable)
+    timings.append(("requirements", time.perf_counter() - start))
+
+    print("Startup timing:")
+    for phase, seconds in timings:
+        print(f"  {phase:<20}{seconds:>8.2f} s")
+
+    run_streamlit_app(python_executable)
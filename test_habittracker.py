@@ -2,14 +2,35 @@ import pytest
 import db
 from habit import Habit
 import analysis as analysis
+import precompute
+import api
+import cli
+import generate_data
+import bench
+import loadtest
+import difftest
+import querystats
+import profiler
+import periodcache
+import metrics
+import writebehind
+import aio
+import bench_async
+import asyncio
 
 import sqlite3
 import os
 from datetime import datetime, timedelta 
 import time
-import gc
+import json
+import threading
+import http.client
+import io
+import subprocess
+import sys
+import shutil
+import tempfile
 
-database = "test.db"
 today = datetime.now()
 test_data = {
         "Eat healthy": {
@@ -45,16 +66,20 @@ test_data = {
 ##############################
 
 @pytest.fixture
-def db_instance():
+def database(tmp_path):
+    # every test gets a database file of its own, so tests can run in parallel
+    return str(tmp_path / "test.db")
+
+@pytest.fixture
+def db_instance(database):
     con = db.connect_db(database)
     yield con
     db.close_db(con)
 
 @pytest.fixture
-def habit():
+def habit(database):
 
-    clean_up_database()
-    db_table_only() 
+    db_table_only(database)
     
     habit = Habit(
         name = "Eat healthy",
@@ -65,15 +90,10 @@ def habit():
     )
     return habit
 
-@pytest.fixture(scope="session", autouse=True)
-def session_cleanup():
-
-    yield  # Runs all tests first
-
-    gc.collect()
-
-    if os.path.exists(database):
-        os.remove(database)
+@pytest.fixture
+def query_budget():
+    # with query_budget(max_statements=5): ...
+    return querystats.query_budget
 
 ##############################
 #          Functions         #
@@ -99,23 +119,41 @@ def create_tracking_data():
 
 tracking_data = create_tracking_data()
 
-def remove_db(db_name=database):
-    if os.path.exists(db_name):
-        os.remove(db_name)
+# template databases by builder, kept in memory for the whole session
+_templates = {}
 
 
-def clean_up_database(db_name=database):
-    with db.connect_db(db_name) as con:
-        con.execute("DROP TABLE IF EXISTS habits")
-        con.execute("DROP TABLE IF EXISTS tracking")
+def copy_template(builder, db_name):
 
+    """ Copies the database built by builder to db_name.
 
-def db_table_only(db_name=database):
+    Every builder runs once per process, later calls copy its result
+    with the backup API instead of running the inserts again.
 
-    with db.connect_db(db_name) as con:
-        con.execute("DROP TABLE IF EXISTS habits")
-        con.execute("DROP TABLE IF EXISTS tracking")
+    """
+
+    if builder not in _templates:
+        template_dir = tempfile.mkdtemp(prefix="habittracker-template-")
+        template_file = os.path.join(template_dir, "template.db")
+        builder(template_file)
+
+        template = sqlite3.connect(":memory:", check_same_thread=False)
+        with sqlite3.connect(template_file) as source:
+            source.backup(template)
+        source.close()
+        shutil.rmtree(template_dir, ignore_errors=True)
+        _templates[builder] = template
 
+    target = sqlite3.connect(db_name)
+    try:
+        _templates[builder].backup(target)
+    finally:
+        target.close()
+
+
+def _build_table_only(db_name):
+
+    with db.connect_db(db_name) as con:
         con.execute(
             """ CREATE TABLE IF NOT EXISTS habits (
                     name TEXT PRIMARY KEY,
@@ -140,6 +178,36 @@ def db_table_only(db_name=database):
         
         con.commit() 
 
+
+def _build_db_with_habit_data(db_name):
+    _build_table_only(db_name)
+    for habit, attribute in test_data.items():
+        db.add_habit(
+            name = habit,
+            description = attribute.get("description"),
+            period = attribute.get("period"),
+            active = attribute.get("active"),
+            db_name = db_name
+        )
+
+
+def _build_complete_db(db_name):
+    _build_db_with_habit_data(db_name)
+
+    for habit in tracking_data:
+        db.streak_complete(
+            name = habit["habit"], 
+            db_name = db_name,
+            period = habit["period"],
+            date = habit["timestamp"]
+        )
+
+
+def db_table_only(db_name):
+
+    copy_template(_build_table_only, db_name)
+
+    with db.connect_db(db_name) as con:
         habit_table = con.execute(
             """SELECT name 
             FROM sqlite_master 
@@ -159,28 +227,12 @@ def db_table_only(db_name=database):
         assert tracking_table is not None, "Failed to create 'tracking' table."
 
 
-def create_db_with_habit_data(test_data=test_data, db_name=database):
-    db_table_only()
-    for habit, attribute in test_data.items():
-        db.add_habit(
-            name = habit,
-            description = attribute.get("description"),
-            period = attribute.get("period"),
-            active = attribute.get("active"),
-            db_name = db_name
-        )
-
+def create_db_with_habit_data(db_name):
+    copy_template(_build_db_with_habit_data, db_name)
 
-def create_complete_db(tracking_data = tracking_data):
-    create_db_with_habit_data()
 
-    for habit in tracking_data:
-        db.streak_complete(
-            name = habit["habit"], 
-            db_name = database,
-            period = habit["period"],
-            date = habit["timestamp"]
-        )
+def create_complete_db(db_name):
+    copy_template(_build_complete_db, db_name)
 
 ##############################
 #       Database TESTS       #
@@ -198,7 +250,7 @@ def test_db_connection():
         con.execute("SELECT 1")
 
 
-def test_create_db_table():
+def test_create_db_table(database):
 
     db.create_tables(database)
 
@@ -212,10 +264,32 @@ def test_create_db_table():
         assert ("habits",) in tables
         assert ("tracking",) in tables
 
-        clean_up_database(database)
 
+def test_ensure_schema(tmp_path, monkeypatch, database):
+
+    db_name = str(tmp_path / "schema.db")
+
+    db.ensure_schema(db_name)
+    with db.connect_db(db_name) as con:
+        version = con.execute("PRAGMA user_version;").fetchone()[0]
+        tables = con.execute("SELECT name FROM sqlite_master WHERE type='table';").fetchall()
+
+    assert version == db.SCHEMA_VERSION
+    assert ("habits",) in tables and ("snapshots",) in tables
+
+    # later calls do not touch the database
+    calls = []
+    monkeypatch.setattr(db, "create_tables", lambda *args, **kwargs: calls.append(args))
+    db.ensure_schema(db_name)
+
+    # a new process only reads PRAGMA user_version
+    monkeypatch.setattr(db, "_schema_ready", set())
+    db.ensure_schema(db_name)
 
-def test_is_in_db_exists():
+    assert calls == []
+
+
+def test_is_in_db_exists(database):
 
     db.create_tables(database)
 
@@ -231,9 +305,9 @@ def test_is_in_db_exists():
     assert db._is_in_db("test_habit", database) == True
 
 
-def test_add_habit():
+def test_add_habit(database):
 
-    db_table_only()
+    db_table_only(database)
 
     with db.connect_db(database) as con:
 
@@ -261,8 +335,6 @@ def test_add_habit():
             )
             assert duplicate_result == f"{habit} already in database"
 
-        clean_up_database()
-
 
 @pytest.mark.parametrize(
         "name, new_name, description, period, active, expected_result",
@@ -296,10 +368,11 @@ def test_modify_habit(
     description, 
     period, 
     active, 
-    expected_result, 
+    expected_result,
+    database
 ):  
 
-    create_db_with_habit_data()
+    create_db_with_habit_data(database)
 
     with db.connect_db(database) as con:
         result = db.modify_habit(
@@ -332,9 +405,6 @@ def test_modify_habit(
                 assert result[2] == period, f"Unexpected period: {result[2]}"
 
 
-        clean_up_database()
-
-
 @pytest.mark.parametrize(
     "habit, expected_result",
     [
@@ -342,67 +412,62 @@ def test_modify_habit(
         ("Nonexistent", "Nonexistent not in database")
     ]
 )
-def test_delete_habit(habit, expected_result, db_name=database):
-    create_db_with_habit_data()
+def test_delete_habit(habit, expected_result, database):
+    create_db_with_habit_data(database)
 
     result = db.delete_habit(
         name=habit, 
-        db_name=db_name)
+        db_name=database)
     
     assert result == expected_result, f"{habit} was not deleted"
 
-    clean_up_database()
 
+def test_get_active_habits(database):
 
-def test_get_active_habits(db_name=database):
+    create_db_with_habit_data(database)
 
-    create_db_with_habit_data()
-
-    result = db.get_active(db_name)
+    result = db.get_active(database)
     assert len(result) == 3, f"Expected 5 active habits, got {len(result)}"
 
     db.modify_habit(
         name= "Eat healthy",
         active=False,
-        db_name=db_name
+        db_name=database
     )
 
-    result = db.get_active(db_name)
+    result = db.get_active(database)
     assert len(result) == 2, f"Unexpected result: {result}"
-    clean_up_database()
 
 
-def test_get_inactive_habits(db_name=database):
-    create_db_with_habit_data()
+def test_get_inactive_habits(database):
+    create_db_with_habit_data(database)
 
-    with db.connect_db(db_name) as con:
-        result = db.get_inactive(db_name)
+    with db.connect_db(database) as con:
+        result = db.get_inactive(database)
         assert len(result) == 2, f"Expected 5 active habits, got {len(result)}"
 
         db.modify_habit(
             name= "Eat healthy",
             active=False,
-            db_name=db_name
+            db_name=database
         )
-        result = db.get_inactive(db_name)
+        result = db.get_inactive(database)
         assert len(result) == 3, f"Unexpected result: {result}"
 
-        clean_up_database()
 
-
-def test_insert_tracking_data(db_name=database):
+def test_insert_tracking_data(database):
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S") 
 
-    create_db_with_habit_data() 
+    create_db_with_habit_data(database) 
 
     db.streak_complete(
         name="Eat healthy",
         period="day",
         date=now,
-        db_name=db_name
+        db_name=database
     )
 
-    with db.connect_db(db_name) as con: 
+    with db.connect_db(database) as con: 
         result = con.execute(
             """SELECT * 
             FROM tracking 
@@ -421,8 +486,6 @@ def test_insert_tracking_data(db_name=database):
     assert row[3] == "day"
     assert row[4] == now 
 
-    clean_up_database()
-
 
 @pytest.mark.parametrize(
     "name, expected_result",
@@ -433,31 +496,28 @@ def test_insert_tracking_data(db_name=database):
 )
 def test_get_tracking_data(
     name,
-    expected_result, 
+    expected_result,
+    database
 ):
 
-    create_complete_db()
-    try:
-        result = db.get_tracking_data(
-            name = name,
-            db_name = database
-        )
+    create_complete_db(database)
+    result = db.get_tracking_data(
+        name = name,
+        db_name = database
+    )
 
-        assert len(result) == expected_result, f"Expected {expected_result} rows, but got {len(result)}. Data: {result}"
-        assert set(result.columns) == {
-            "tracking_id", 
-            "name", 
-            "status", 
-            "current_period", 
-            "timestamp"
-            }, "Unexpected columns"
+    assert len(result) == expected_result, f"Expected {expected_result} rows, but got {len(result)}. Data: {result}"
+    assert set(result.columns) == {
+        "tracking_id", 
+        "name", 
+        "status", 
+        "current_period", 
+        "timestamp"
+        }, "Unexpected columns"
 
-    finally:
-        clean_up_database()
 
-
-def test_get_habit_data():
-    create_db_with_habit_data()
+def test_get_habit_data(database):
+    create_db_with_habit_data(database)
 
     for habit_name, expected_values in test_data.items():
 
@@ -472,14 +532,260 @@ def test_get_habit_data():
         assert result.iloc[0]["period"] ==  expected_values["period"]
         assert result.iloc[0]["active"] == expected_values["active"]
 
+
+def test_reader_dtypes(tmp_path):
+
+    db_name = str(tmp_path / "dtypes.db")
+    generate_data.generate_database(db_name, habits=20, years=1)
+
+    tracking = db.get_tracking_data(db_name=db_name)
+    for column in ("name", "status", "current_period"):
+        assert tracking[column].dtype == "category"
+    assert tracking["timestamp"].dtype == "datetime64[s]"
+
+    habits = db.get_habit_data(db_name=db_name)
+    assert habits["period"].dtype == "category"
+    assert habits["active"].dtype == bool
+
+    empty = db.get_tracking_data("Nonexistent", db_name=db_name)
+    assert empty.empty and empty["timestamp"].dtype == "datetime64[s]"
+
+    memory = bench.memory_usage(db_name)["db.get_tracking_data(all)"]
+    assert memory["rows"] == len(tracking)
+    assert memory["bytes"] * 3 < memory["plain_bytes"]
+
+
+@pytest.mark.parametrize(
+    "sort_by, descending, expected_pages",
+    [
+        ("name", False, [["Drink Enough", "Eat healthy"], ["Workout"]]),
+        ("name", True, [["Workout", "Eat healthy"], ["Drink Enough"]]),
+        ("period", False, [["Drink Enough", "Eat healthy"], ["Workout"]]),
+        ("last completed", True, [["Workout", "Eat healthy"], ["Drink Enough"]]),
+    ]
+)
+def test_get_habits_page(sort_by, descending, expected_pages, database):
+
+    create_complete_db(database)
+
+    pages = []
+    after = None
+    while True:
+        page = db.get_habits_page(
+            sort_by = sort_by,
+            descending = descending,
+            after = after,
+            page_size = 2,
+            db_name = database
+        )
+        if page.empty:
+            break
+        pages.append(page["name"].tolist())
+        after = (page.iloc[-1]["sort_key"], page.iloc[-1]["name"])
+
+    assert pages == expected_pages
+    assert db.count_habits(db_name=database) == 3
+
+    search = db.get_habits_page(search="eat", db_name=database)
+    assert search["name"].tolist() == ["Eat healthy"]
+
+    # wildcards in the search match themselves
+    db.add_habit(name="100%_done", period="day", db_name=database)
+    for text in ("%", "_", "0%_"):
+        assert db.get_habits_page(search=text, db_name=database)["name"].tolist() == ["100%_done"]
+        assert db.count_habits(search=text, db_name=database) == 1
+
+    with pytest.raises(ValueError):
+        db.get_habits_page(sort_by="color", db_name=database)
+
+
+def test_query_stats(monkeypatch, database):
+
+    create_complete_db(database)
+    monkeypatch.setattr(querystats, "enabled", True)
+
+    stats = querystats.begin()
+    try:
+        db.get_tracking_data("Eat healthy", db_name=database)
+        db.get_tracking_data("Workout", db_name=database)
+        db.streak_complete("Workout", "week", db_name=database)
+    finally:
+        querystats.end(stats)
+
+    # every call checks the name on a connection of its own
+    assert stats.connections == 6
+    assert stats.query_count == 12  # every connection sets PRAGMA foreign_keys
+
+    by_fingerprint = {entry["fingerprint"]: entry for entry in stats.aggregate()}
+    select = by_fingerprint["SELECT * FROM tracking WHERE name = ?"]
+    assert select["calls"] == 2
+    assert select["rows"] > 0
+    assert all(
+        site.startswith("test_habittracker.py:") and site.endswith("test_query_stats -> db.get_tracking_data")
+        for site in select["call_sites"]
+    )
+
+    assert querystats.fingerprint("SELECT * FROM t WHERE a = 'x' AND b IN (1, 2,3)") == "SELECT * FROM t WHERE a = ? AND b IN (?)"
+
+
+def test_query_budget(query_budget, database):
+
+    create_complete_db(database)
+
+    with query_budget(max_statements=1, max_connections=1) as stats:
+        db.get_habits_page(db_name=database)
+        # other threads are not instrumented
+        other = []
+        thread = threading.Thread(target=lambda: other.append(querystats.is_enabled()))
+        thread.start()
+        thread.join()
+        assert other == [False] and querystats.is_enabled()
+    assert stats.statement_count == 1
+    assert not querystats.is_enabled()
+
+    with pytest.raises(querystats.QueryBudgetExceeded, match="3 connections"):
+        with query_budget(max_connections=2):
+            for name in ("Eat healthy", "Drink Enough", "Workout"):
+                db.get_last_entry(name, db_name=database)
+
+    assert querystats.enabled == False
+
+
+def test_profiler(tmp_path, monkeypatch, database):
+
+    create_complete_db(database)
+    monkeypatch.setattr(profiler, "output_dir", str(tmp_path))
+
+    profile = profiler.start(profile_to_disk=True)
+    with profiler.section("tab"):
+        with profiler.section("Eat healthy"):
+            analysis.get_current_streak_series("Eat healthy", db_name=database)
+            time.sleep(0.01)
+        db.get_active(database)
+    profiler.stop(profile)
+
+    rows = profile.rows()
+    assert [(row["section"], row["depth"]) for row in rows] == [("render", 0), ("tab", 1), ("Eat healthy", 2)]
+
+    habit_section = profile.root.children[0].children[0]
+    assert habit_section.times["db"] > 0
+    assert habit_section.times["analysis"] > 0
+    assert habit_section.times["widgets"] >= 0.01
+    assert rows[1]["db ms"] > habit_section.times["db"] * 1000
+    assert abs(sum(rows[0][f"{category} ms"] for category in profiler.categories) - rows[0]["ms"]) < 1
+
+    assert os.path.dirname(profile.profile_file) == str(tmp_path)
+    assert os.path.getsize(profile.profile_file) > 0
+
+    # sections outside of a profile are no-ops
+    with profiler.section("unprofiled"):
+        pass
+
+
+def test_metrics(tmp_path, monkeypatch, database):
+
+    create_complete_db(database)
+    db.create_tables(database)
+    monkeypatch.setattr(metrics, "enabled", True)
+    for metric in metrics._registry:
+        metric.reset()
+
+    db.streak_complete("Drink Enough", "day", db_name=database)
+    db.streak_complete_batch(["Eat healthy", "Workout", "Read"], db_name=database)
+    analysis.get_habit_snapshot("Workout", db_name=database)
+    analysis.compute_snapshot("Workout", db_name=database)
+    analysis.get_habit_snapshot("Workout", db_name=database)
+
+    # Eat healthy and Workout are completed in the current period already
+    assert metrics.completions_written.value() == 1
+    assert metrics.snapshot_requests.value("miss") == 1
+    assert metrics.snapshot_requests.value("hit") == 1
+    assert metrics.analysis_duration.count("compute_snapshot") == 2
+    assert metrics.query_duration.count("INSERT") == 3  # with the snapshot
+
+    metrics_file = str(tmp_path / "habit_tracker.prom")
+    metrics.write_file(metrics_file)
+    with open(metrics_file, encoding="utf-8") as f:
+        text = f.read()
+
+    assert "# TYPE habit_tracker_completions_written_total counter" in text
+    assert "habit_tracker_completions_written_total 1" in text
+    assert 'habit_tracker_query_duration_seconds_bucket{statement="INSERT",le="+Inf"} 3' in text
+    assert 'habit_tracker_query_duration_seconds_count{statement="INSERT"} 3' in text
+    assert f'habit_tracker_database_size_bytes{{database="{database}"}} {os.path.getsize(database)}' in text
+
+    server = metrics.serve(port=0)
+    try:
+        connection = http.client.HTTPConnection("127.0.0.1", server.server_port, timeout=10)
+        connection.request("GET", "/metrics")
+        response = connection.getresponse()
+        assert response.status == 200
+        assert "habit_tracker_snapshot_requests_total" in response.read().decode()
+        connection.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize("tab, page_size, max_queries", [
+    ("Your active Habits", 100, 5),
+    ("Analyze your habits", None, 2),
+    ("Inactive Habits", 100, 2),
+])
+def test_app_query_budget(tab, page_size, max_queries, query_budget, tmp_path, monkeypatch):
+
+    from streamlit.testing.v1 import AppTest
+
+    # the app reads main.db in its working directory
+    generate_data.generate_database(str(tmp_path / "main.db"), habits=100, inactive_fraction=0.5)
+    monkeypatch.chdir(tmp_path)
+    # the job of precompute.SnapshotWorker
+    analysis.refresh_snapshots(str(tmp_path / "main.db"))
+
+    app = AppTest.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py"), default_timeout=60)
+    app.session_state["main_tabs"] = tab
+    if page_size:
+        app.session_state["active_page_size"] = page_size
+        app.session_state["inactive_page_size"] = page_size
+
+    app.run()
+
+    # the render costs the same number of queries, no matter how many habits are shown
+    with query_budget(max_statements=max_queries, max_connections=max_queries, all_threads=True):
+        app.run()
+    assert not app.exception
+
+def test_app_debug_panel(tmp_path, monkeypatch):
+
+    from streamlit.testing.v1 import AppTest
+
+    generate_data.generate_database(str(tmp_path / "main.db"), habits=10)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("HABIT_TRACKER_QUERY_STATS", raising=False)
+    app_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+    def panels(app):
+        return [expander.label for expander in app.sidebar.expander]
+
+    debug = AppTest.from_file(app_file, default_timeout=60)
+    debug.query_params["debug"] = "1"
+    debug.run()
+    assert not debug.exception and "Query stats" in panels(debug)
+
+    # the next visitor without ?debug=1 sees no panel
+    app = AppTest.from_file(app_file, default_timeout=60)
+    app.run()
+    assert not app.exception and "Query stats" not in panels(app)
+    assert not querystats.is_enabled()
+
+
 ##############################
 #     habit class TESTS      #
 ##############################
 
-def test_class_habit_init():
+def test_class_habit_init(database):
 
-    clean_up_database()
-    db_table_only() 
+    db_table_only(database)
 
     habit = Habit(
         name="test habit",
@@ -495,9 +801,9 @@ def test_class_habit_init():
     assert habit.active == True
 
 
-def test_add_habit(habit):
+def test_add_habit(habit, database):
 
-    db_table_only()
+    db_table_only(database)
 
     result = habit.add()
     assert result == f"{habit.name} added"
@@ -521,11 +827,10 @@ def test_class_modification(
     description,
     period,
     active,
-    db_name = database
+    database
 ):
 
-    clean_up_database()
-    db_table_only()
+    db_table_only(database)
 
     habit = Habit(
         name = "test habit",
@@ -540,7 +845,7 @@ def test_class_modification(
     old_period = habit.period
     old_active = habit.active
 
-    with db.connect_db(db_name) as con:
+    with db.connect_db(database) as con:
         result = con.execute(
                 """SELECT * 
                 FROM habits 
@@ -556,7 +861,7 @@ def test_class_modification(
 
     habit.modify(new_name, description, period, active)
 
-    with db.connect_db(db_name) as con:
+    with db.connect_db(database) as con:
         result = con.execute(
                 """SELECT * 
                 FROM habits 
@@ -589,12 +894,10 @@ def test_class_modification(
         assert active == habit.active
         assert old_db_status != new_db_status
 
-    clean_up_database()
 
+def test_delete_habit(habit, database):
 
-def test_delete_habit(habit):
-
-    db_table_only()
+    db_table_only(database)
 
     habit.add()
     name = habit.name
@@ -609,13 +912,10 @@ def test_delete_habit(habit):
 
     assert is_in_db == False
 
-    clean_up_database()
-
 
-def test_mark_as_complete(habit):
+def test_mark_as_complete(habit, database):
 
-    clean_up_database()
-    db_table_only()
+    db_table_only(database)
 
     habit.add()    
     habit.mark_as_complete()
@@ -633,13 +933,10 @@ def test_mark_as_complete(habit):
     assert result[0][2] == "active"
     assert result[1][2] == "streak complete"
 
-    clean_up_database()
 
+def test_check_completion_status(habit, database):
 
-def test_check_completion_status(habit):
-
-    clean_up_database()
-    db_table_only()
+    db_table_only(database)
 
     habit.add()
     habit.check_completion_status()
@@ -652,13 +949,10 @@ def test_check_completion_status(habit):
     habit.check_completion_status()
     assert habit.streak_complete is True
 
-    clean_up_database()
-
 
-def test_current_streak(habit):
+def test_current_streak(habit, database):
 
-    clean_up_database()
-    create_complete_db()
+    create_complete_db(database)
 
     result = habit.get_current_streak()
     assert result == 5
@@ -706,10 +1000,9 @@ def test_dynamic_periods(period, timestamp, previous_period, expected):
     ("Drink Enough", 0), 
     ("Workout", 2),       
 ])
-def test_current_streak_series(habit_name, expected_streak):
+def test_current_streak_series(habit_name, expected_streak, database):
 
-    clean_up_database()
-    create_complete_db()
+    create_complete_db(database)
     
     streak_count = analysis.get_current_streak_series(
         name = habit_name, 
@@ -718,8 +1011,6 @@ def test_current_streak_series(habit_name, expected_streak):
 
     assert streak_count == expected_streak
 
-    clean_up_database()
-
 
 @pytest.mark.parametrize("habit_name, period, expected_streak, expected_break", [
     ("Eat healthy", "day", 2, 0),
@@ -727,10 +1018,9 @@ def test_current_streak_series(habit_name, expected_streak):
     ("Drink Enough", "day", 0, 0),
     ("all", "all", 3, 0),
 ])
-def test_get_habits_series(habit_name, period, expected_streak, expected_break):
+def test_get_habits_series(habit_name, period, expected_streak, expected_break, database):
 
-    clean_up_database()
-    create_complete_db()
+    create_complete_db(database)
 
     result = analysis.get_habits_series(
         name=habit_name, 
@@ -749,7 +1039,6 @@ def test_get_habits_series(habit_name, period, expected_streak, expected_break):
 
         assert streak_count == expected_streak, f"For habit '{habit_name}', expected streak {expected_streak}, got {streak_count}"
         assert break_count == expected_break, f"For habit '{habit_name}', expected break {expected_break}, got {break_count}"
-    clean_up_database()
 
 
 @pytest.mark.parametrize("period, expected_habits", [
@@ -758,23 +1047,748 @@ def test_get_habits_series(habit_name, period, expected_streak, expected_break):
     ("month", [] ),
     (None, ["Eat healthy", "Drink Enough", "Workout"]),  
 ])
-def test_get_active_habits_for_period(period, expected_habits):
+def test_get_active_habits_for_period(period, expected_habits, database):
 
-    clean_up_database()
-    create_complete_db()
+    create_complete_db(database)
 
-    result_df = analysis.get_active_habits_for_period(period, db_name="test.db")
+    result_df = analysis.get_active_habits_for_period(period, db_name=database)
 
     result_habits = result_df["name"].tolist() if not result_df.empty else []
 
     assert result_habits == expected_habits, f"Expected {expected_habits}, got {result_habits}"
 
-    clean_up_database()
 
-@pytest.hookimpl(tryfirst=True)
-def pytest_sessionfinish(session, exitstatus):
+@pytest.mark.parametrize("period, timestamp, expected", [
+    ("quarter", datetime(2025, 2, 10), 
+     (datetime(2024, 10, 1), datetime(2024, 12, 31, 23, 59, 59))),
+    ("week", datetime(2025, 1, 1), 
+     (datetime(2024, 12, 23), datetime(2024, 12, 29, 23, 59, 59))),
+    ("month", datetime(2025, 3, 31, 23, 59, 59), 
+     (datetime(2025, 2, 1), datetime(2025, 2, 28, 23, 59, 59))),
+    ("year", datetime(2024, 2, 29), 
+     (datetime(2023, 1, 1), datetime(2023, 12, 31, 23, 59, 59))),
+])
+def test_dynamic_periods_year_boundary(period, timestamp, expected):
+
+    assert analysis._dynamic_periods(period, timestamp, True) == expected
+
+
+def test_streak_series():
+
+    today = datetime(2025, 3, 10, 12)
+    days = [10, 9, 9, 8, 5, 4, 3, 1]
+    completions = [(datetime(2025, 3, day, 8), "day") for day in days]
+
+    # the second completion on the 9th does not break the streak
+    assert analysis._current_streak(completions, "day", today) == 3
+    assert analysis._streak_series(completions, "day", today) == [(3, 0), (0, 2), (3, 0), (0, 1), (1, 0)]
+
+    # today is not missed before it has ended
+    assert analysis._current_streak(completions[1:], "day", today) == 0
+    assert analysis._streak_series(completions[2:], "day", today) == [(2, 0), (0, 2), (3, 0), (0, 1), (1, 0)]
+
+
+def test_difftest():
+
+    result = difftest.run(cases=3000, seed=42)
+
+    assert result["cases"] == 3000
+    assert result["failures"] == []
+
+
+def test_difftest_shrink(monkeypatch):
+
+    # a streak that breaks on a second completion in one period
+    def current_streak(completions, period, today):
+        count = 0
+        start, end = analysis._dynamic_periods(period, today, False)
+        for timestamp, completion_period in completions:
+            if not start <= timestamp <= end:
+                break
+            count += 1
+            start, end = analysis._dynamic_periods(completion_period, timestamp, True)
+        return count
+
+    monkeypatch.setattr(analysis, "_current_streak", current_streak)
+
+    result = difftest.run(cases=500, seed=7)
+    assert result["failures"]
+
+    for case, difference in result["failures"]:
+        assert difference.startswith("current streak")
+        # removing any completion makes the case pass
+        for i in range(len(case.history)):
+            smaller = difftest.Case(case.period, case.today, case.history[:i] + case.history[i + 1:])
+            assert difftest.check(smaller) is None
+        assert all(timestamp == timestamp.replace(hour=0, minute=0, second=0) for timestamp in case.history
+                   if timestamp != case.today)
+
+
+def test_difftest_database(database):
+
+    db.create_tables(database)
+    rng = difftest.random.Random(3)
+
+    for _ in range(20):
+        case = difftest.random_case(rng)
+        assert difftest.check_database(case, database) is None, case
+
+
+def test_habit_snapshot(database):
+
+    create_complete_db(database)
+    db.create_tables(database)
+
+    # reading computes stale snapshots live, without storing them
+    version = db.get_write_version(database)
+    snapshot = analysis.get_habit_snapshot("Eat healthy", database)
+    assert snapshot["current_streak"] == analysis.get_current_streak_series("Eat healthy", database)
+    assert db.get_snapshot("Eat healthy", database) is None
+
+    # storing snapshots leaves the write version unchanged
+    assert analysis.refresh_snapshots(database) == 3
+    assert db.get_write_version(database) == version
+    assert analysis._is_snapshot_fresh(db.get_snapshot("Eat healthy", database), datetime.now())
+
+    # completing the period again writes nothing, a new write makes the snapshot stale
+    db.streak_complete("Eat healthy", "day", db_name=database)
+    assert analysis._is_snapshot_fresh(db.get_snapshot("Eat healthy", database), datetime.now())
+    db.streak_complete("Eat healthy", "day", date=datetime.now() - timedelta(days=5), db_name=database)
+    assert not analysis._is_snapshot_fresh(db.get_snapshot("Eat healthy", database), datetime.now())
+
+    assert analysis.refresh_snapshots(database) == 1
+    assert analysis.refresh_snapshots(database) == 0
+
+    # correcting an older row leaves the highest tracking_id unchanged
+    with db.connect_db(database) as con:
+        con.execute(
+            """DELETE FROM tracking WHERE tracking_id = (
+                SELECT MIN(tracking_id) FROM tracking WHERE name = 'Workout') ;"""
+        )
+        con.commit()
+    assert not analysis._is_snapshot_fresh(db.get_snapshot("Workout", database), datetime.now())
+    assert analysis.refresh_snapshots(database) == 3
+
+    live = analysis.get_habits_series(all_series=True, db_name=database)
+    from_snapshots = analysis.get_habits_series_from_snapshots(db_name=database)
+    assert from_snapshots.equals(live)
+
+
+def test_snapshot_worker(database):
+
+    create_complete_db(database)
+    db.create_tables(database)
+
+    worker = precompute.SnapshotWorker(db_name=database, poll_interval=0.05)
+    worker.start()
+    try:
+        for _ in range(100):
+            if db.get_snapshot("Workout", database) is not None:
+                break
+            time.sleep(0.05)
+    finally:
+        worker.stop()
+
+    assert not worker.is_alive()
+    assert db.get_snapshot("Workout", database)["current_streak"] == 2
+
+
+def test_period_cache(tmp_path):
+
+    import numpy as np
+
+    db_name = str(tmp_path / "cache.db")
+    generate_data.generate_database(db_name, habits=20, years=1)
+    name = db.get_active(db_name)[0]
+    with db.connect_db(db_name) as con:
+        # leaves the current period open
+        con.execute(
+            """DELETE FROM tracking WHERE timestamp = (
+                SELECT MAX(timestamp) FROM tracking WHERE name = ? AND status = 'streak complete') 
+                AND name = ? ;""",
+            (name, name)
+        )
+        con.commit()
+
+    def live_results():
+        results = {}
+        for name in db.get_active(db_name):
+            df_series = analysis.get_habits_series(name, all_series=True, db_name=db_name)
+            results[name] = [
+                analysis.get_current_streak_series(name, db_name),
+                [[int(streak), int(breaks)] for streak, breaks in zip(df_series["streak_series"], df_series["break_series"])]
+            ]
+        return results
+
+    def cached_results():
+        streaks = analysis.get_streaks_from_cache(db.get_active(db_name), db_name)
+        return {name: [result["current_streak"], result["series"]] for name, result in streaks.items()}
+
+    assert cached_results() == live_results()
+
+    cache = periodcache.open_cache(db_name)
+    assert isinstance(cache.indices(name).base, np.memmap)
+
+    # only the new completion is read, a second instance sees it
+    db.streak_complete(name, cache.period(name), db_name=db_name)
+    db.streak_complete(name, cache.period(name), db_name=db_name)
+    assert cache.update() == 1
+    assert cache.update() == 0
+    other = periodcache.PeriodCache(db_name)
+    assert other.load() and other.last_tracking_id == cache.last_tracking_id
+    assert other.indices(name).tolist() == cache.indices(name).tolist()
+
+    # deleting a habit rebuilds the cache
+    deleted = db.get_active(db_name)[1]
+    db.delete_habit(deleted, db_name)
+    assert cache.update() > 2
+    assert cache.period(deleted) is None
+    assert len(os.listdir(cache.cache_dir)) == 2
+    assert cached_results() == live_results()
+
+
+def test_idempotent_completions(tmp_path):
+
+    db_name = str(tmp_path / "dedup.db")
+    db.create_tables(db_name)
+    db.add_habit(name="Read", period="week", db_name=db_name)
+    db.add_habit(name="Run", period="day", db_name=db_name)
+
+    def completions(name):
+        return db.get_tracking_data(name, db_name, full_history=True)["status"].eq("streak complete").sum()
+
+    # retries and double clicks write one completion per period
+    monday = datetime(2024, 3, 4, 8)
+    for _ in range(3):
+        db.streak_complete("Read", "week", date=monday, db_name=db_name)
+    db.streak_complete("Read", "week", date=monday + timedelta(days=6), db_name=db_name)
+    db.streak_complete_batch(["Run", "Run", "Read"], date=monday + timedelta(days=7), db_name=db_name)
+    assert completions("Read") == 2 and completions("Run") == 1
+    # an import adds the status entries again, not the completions
+    assert "2 tracking entries imported" in db.import_data([], db.export_data(db_name)["tracking"], db_name)
+    assert completions("Read") == 2
+
+    # a database of schema version 3 with duplicates, some of them archived
+    with db.connect_db(db_name) as con:
+        con.execute("DROP INDEX idx_tracking_completion ;")
+        con.executemany(
+            "INSERT INTO tracking (name, status, current_period, timestamp) VALUES (?, 'streak complete', ?, ?) ;",
+            [("Read", "week", "2024-03-05 10:00:00"), ("Run", "day", "2024-03-11 23:00:00")] * 2
+            + [("Run", "day", "2020-01-01 10:00:00")] * 3
+        )
+        con.execute("PRAGMA user_version = 3 ;")
+        con.commit()
+    db.archive_tracking(older_than_days=(datetime.now() - datetime(2021, 1, 1)).days, db_name=db_name)
+    assert completions("Read") == 4 and completions("Run") == 6
+
+    db._schema_ready.clear()
+    db.ensure_schema(db_name)
+    assert completions("Read") == 2 and completions("Run") == 2
+    assert db.rebuild_rollups(db_name, check=True)["differences"] == 0
+    assert db.deduplicate_completions(db_name) == {"tracking": 0, "archive": 0}
+    with db.connect_db(db_name) as con:
+        assert con.execute("PRAGMA user_version ;").fetchone()[0] == db.SCHEMA_VERSION
+        assert con.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE name = 'idx_tracking_completion' ;"
+        ).fetchone()[0] == 1
+
+
+def test_write_behind(tmp_path, monkeypatch):
+
+    db_name = str(tmp_path / "writebehind.db")
+    db.create_tables(db_name)
+    for i in range(20):
+        db.add_habit(name=f"habit {i}", period="day", db_name=db_name)
+
+    # many callers share one commit, every caller waits for its own
+    monkeypatch.setattr(writebehind, "enabled", True)
+    completion_queue = writebehind.get_queue(db_name)
+    results = [None] * 20
+    def complete(i):
+        results[i] = db.streak_complete(f"habit {i}", "day", db_name=db_name)
+    threads = [threading.Thread(target=complete, args=(i, )) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [f"habit {i} streak completed" for i in range(20)]
+    assert 1 <= completion_queue.batches < 20
+    assert db.streak_complete("unknown", "day", db_name=db_name) == "unknown not in database"
+    monkeypatch.setattr(writebehind, "enabled", False)
+
+    # queued completions are written when the queue is closed
+    monday = datetime(2024, 3, 4)
+    slow = writebehind.CompletionQueue(db_name, batch_size=1000, flush_ms=60000)
+    slow.start()
+    futures = [
+        slow.submit("habit 0", timestamp=(monday + timedelta(days=day)).strftime("%Y-%m-%d %H:%M:%S"))
+        for day in range(7)
+    ]
+    assert not any(future.done() for future in futures)
+    slow.close()
+    assert [future.result(timeout=0) for future in futures] == ["habit 0 streak completed"] * 7
+    assert slow.batches == 1
+    assert len(db.get_tracking_data("habit 0", db_name)) == 1 + 1 + 7
+    with pytest.raises(RuntimeError):
+        slow.submit("habit 0")
+
+    # a failed batch fails its futures
+    broken = writebehind.CompletionQueue(str(tmp_path / "empty.db"))
+    broken.start()
+    future = broken.submit("habit 0")
+    with pytest.raises(sqlite3.Error):
+        future.result(timeout=10)
+    broken.close()
+
+    # a writer which cannot open its database fails its callers and is replaced
+    monkeypatch.setattr(writebehind, "enabled", True)
+    missing = str(tmp_path / "missing" / "x.db")
+    started = time.perf_counter()
+    with pytest.raises(sqlite3.Error):
+        db.streak_complete("habit 0", "day", db_name=missing)
+    assert time.perf_counter() - started < 5
+    dead = writebehind._queues[missing]
+    dead.join(5)
+    assert writebehind.get_queue(missing) is not dead
+    # a caller still holding the dead queue gets its error
+    with pytest.raises(sqlite3.Error):
+        dead.submit("habit 0").result(timeout=0)
+
+    # callers wait for the commit only so long
+    completion_queue.close()
+    stuck = writebehind.CompletionQueue(db_name, flush_ms=60000)
+    stuck.start()
+    writebehind._queues[db_name] = stuck
+    monkeypatch.setattr(writebehind, "timeout", 0.2)
+    with pytest.raises(sqlite3.OperationalError):
+        db.streak_complete("habit 1", "day", date=monday, db_name=db_name)
+    monkeypatch.setattr(writebehind, "enabled", False)
+
+    writebehind.close_all()
+    assert not completion_queue.is_alive() and not stuck.is_alive()
+    # the timed out completion is still written when the queue is closed
+    assert (db.get_tracking_data("habit 1", db_name)["timestamp"] == monday).sum() == 1
+    with pytest.raises(ValueError):
+        writebehind.CompletionQueue(":memory:")
+
+
+def test_aio(tmp_path):
+
+    db_name = str(tmp_path / "aio.db")
+    generate_data.generate_database(db_name, habits=30, years=1, inactive_fraction=0)
+    names = db.get_active(db_name)
+
+    threads = {"read": set(), "write": set()}
+    record_read = aio.reader(lambda: threads["read"].add(threading.current_thread().name) or time.sleep(0.05))
+    record_write = aio.writer(lambda: threads["write"].add(threading.current_thread().name) or time.sleep(0.01))
+
+    async def main():
+        streaks = await asyncio.gather(*(aio.get_current_streak_series(name, db_name) for name in names))
+        tracking = await asyncio.gather(*(aio.get_tracking_data(name, db_name) for name in names[:5]))
+
+        # writes run one after the other in the order they were started
+        results = await asyncio.gather(
+            *(aio.add_habit(name=f"new {i}", period="day", db_name=db_name) for i in range(10)),
+            *(aio.streak_complete(f"new {i}", "day", db_name=db_name) for i in range(10))
+        )
+        await asyncio.gather(*(record_read() for _ in range(8)), *(record_write() for _ in range(8)))
+        return streaks, tracking, results
+
+    streaks, tracking, results = asyncio.run(main())
+    aio.shutdown()
+
+    assert streaks == [analysis.get_current_streak_series(name, db_name) for name in names]
+    for name, frame in zip(names, tracking):
+        assert frame.equals(db.get_tracking_data(name, db_name))
+    assert results[10:] == [f"new {i} streak completed" for i in range(10)]
+    assert len(threads["read"]) > 1 and len(threads["write"]) == 1
+    assert aio.get_tracking_data.__doc__ == db.get_tracking_data.__doc__
+
+    result = bench_async.run("small", operations=40)
+    assert result["operations"] == 40 and result["speedup"] > 0
+
+
+def _rollups(db_name):
+    with db.connect_db(db_name) as con:
+        return sorted(con.execute("SELECT * FROM tracking_rollups ;").fetchall())
+
+
+def test_rollups(capsys, tmp_path):
+
+    db_name = str(tmp_path / "rollups.db")
+    generate_data.generate_database(db_name, habits=12, years=3, seed=3)
+    names = db.get_active(db_name)
+    generated = _rollups(db_name)
+    assert generated and db.rebuild_rollups(db_name, check=True)["differences"] == 0
+
+    # the triggers follow inserts, updates, renames and deletes
+    db.streak_complete(name=names[0], period=db.get_habit_data(names[0], db_name)["period"][0], db_name=db_name)
+    with db.connect_db(db_name) as con:
+        con.execute("UPDATE OR IGNORE tracking SET timestamp = datetime(timestamp, '-40 days') WHERE tracking_id % 7 = 0 ;")
+        con.execute("DELETE FROM tracking WHERE tracking_id % 11 = 0 ;")
+        con.commit()
+    db.modify_habit(names[1], new_name="renamed", db_name=db_name)
+    db.delete_habit(names[2], db_name=db_name)
+    triggered = _rollups(db_name)
+    assert db.rebuild_rollups(db_name, check=True) == {"rollups": len(triggered), "differences": 0}
+
+    # the completions per year add up to the tracking data
+    tracking = db.get_tracking_data(db_name=db_name)
+    completed = tracking[tracking["status"] == "streak complete"]
+    counts = analysis.get_completions_per_period("year", db_name=db_name)
+    assert counts.sum().sum() == len(completed[completed["name"].isin(counts.columns)])
+    assert (counts.index == counts.index.normalize()).all()
+    assert list(counts.index.month.unique()) == [1]
+    months = db.get_rollups(names=[names[0]], granularity="month", db_name=db_name)
+    assert months["completions"].sum() == (completed["name"] == names[0]).sum()
+    with pytest.raises(ValueError):
+        db.get_rollups(granularity="day", db_name=db_name)
+
+    # check mode reports a difference, the rebuild repairs it
+    with db.connect_db(db_name) as con:
+        con.execute("UPDATE tracking_rollups SET completions = completions + 1 WHERE rowid = 1 ;")
+        con.commit()
+    assert cli.main(["--db", db_name, "rollups", "--check"]) == 1
+    assert db.rebuild_rollups(db_name)["differences"] == 2
+    assert _rollups(db_name) == triggered
+    assert cli.main(["--db", db_name, "rollups", "--check"]) == 0
+    capsys.readouterr()
+
+
+def test_archive_tracking(tmp_path):
+
+    db_name = str(tmp_path / "archive.db")
+    generate_data.generate_database(db_name, habits=12, years=2)
+    names = db.get_active(db_name)
+
+    before = db.get_tracking_data(db_name=db_name)
+    series = {name: analysis.get_habits_series(name, all_series=True, db_name=db_name) for name in names}
+    exported = db.export_data(db_name)
+    rollups_before = _rollups(db_name)
+
+    result = db.archive_tracking(older_than_days=180, db_name=db_name)
+    cutoff = datetime.now() - timedelta(days=180)
+    assert os.path.exists(db.archive_name(db_name)) and db.archive_name(db_name).endswith("archive.archive.db")
+
+    # hot reads only see recent rows, the full history all of them
+    hot = db.get_tracking_data(db_name=db_name)
+    archived_ids = set(before["tracking_id"]) - set(hot["tracking_id"])
+    assert result["archived"] == len(archived_ids) > 0
+    assert hot["timestamp"].min() >= cutoff - timedelta(minutes=1)
+    assert len(db.get_tracking_data(db_name=db_name, full_history=True)) == len(before)
+    assert db.export_data(db_name) == exported
+    for name in names:
+        full = analysis.get_habits_series(name, all_series=True, db_name=db_name, full_history=True)
+        assert full.equals(series[name])
+
+    # archiving moves rows without changing the rollups
+    assert rollups_before == _rollups(db_name)
+    assert db.rebuild_rollups(db_name, check=True)["differences"] == 0
+
+    # renames and deletes reach the archive
+    db.modify_habit(names[0], new_name="renamed", db_name=db_name)
+    db.delete_habit(names[1], db_name=db_name)
+    full = db.get_tracking_data(db_name=db_name, full_history=True)
+    assert names[0] not in set(full["name"]) and names[1] not in set(full["name"])
+    assert (full["name"] == "renamed").sum() == (before["name"] == names[0]).sum()
+
+    with pytest.raises(ValueError):
+        db.archive_tracking(db_name=":memory:")
+
+
+##############################
+#     Data generator TESTS   #
+##############################
+
+def test_generate_database(tmp_path):
+
+    options = dict(habits=50, years=2, seed=7, end=datetime(2025, 3, 1))
+    first = generate_data.generate_rows(**options)
+    assert first == generate_data.generate_rows(**options)
+    assert first != generate_data.generate_rows(**{**options, "seed": 8})
+
+    db_name = str(tmp_path / "generated.db")
+    result = generate_data.generate_database(db_name, **options)
+
+    assert result["habits"] == 50
+    with db.connect_db(db_name) as con:
+        assert con.execute("SELECT COUNT(*) FROM tracking").fetchone()[0] == result["tracking_rows"]
+        assert con.execute("SELECT MAX(timestamp) FROM tracking").fetchone()[0] < "2025-03-02"
+        assert con.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='trigger'").fetchone()[0] == 11
+
+    with pytest.raises(FileExistsError):
+        generate_data.generate_database(db_name, **options)
+
+
+def test_generate_database_drops_new_triggers(tmp_path, monkeypatch):
+
+    create_tables = db.create_tables
+
+    def create_tables_with_log(db_name):
+        # a trigger db.create_tables might get in the future
+        create_tables(db_name)
+        with db.connect_db(db_name) as con:
+            con.execute("CREATE TABLE IF NOT EXISTS inserted (tracking_id INTEGER) ;")
+            con.execute(
+                """CREATE TRIGGER IF NOT EXISTS tracking_insert_log AFTER INSERT ON tracking
+                BEGIN INSERT INTO inserted VALUES (NEW.tracking_id); END ;"""
+            )
+            con.commit()
+
+    monkeypatch.setattr(db, "create_tables", create_tables_with_log)
+    db_name = str(tmp_path / "generated.db")
+    generate_data.generate_database(db_name, habits=5, years=1)
+
+    with db.connect_db(db_name) as con:
+        assert con.execute("SELECT COUNT(*) FROM inserted").fetchone()[0] == 0
+        assert con.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'tracking_insert_log'").fetchone()[0] == 1
+
+
+def test_bench_compare():
+
+    baseline = {"small": {"a": {"median_ms": 10.0}, "b": {"median_ms": 10.0}}}
+    results = {"small": {"a": {"median_ms": 11.0}, "b": {"median_ms": 13.0}, "c": {"median_ms": 1.0}}}
+
+    regressions = bench.compare(results, baseline, threshold=20)
+
+    assert [(size, name) for size, name, *_ in regressions] == [("small", "b")]
+
+
+@pytest.mark.parametrize("mode, users, write_behind", [("thread", 4, False), ("process", 2, False), ("thread", 4, True)])
+def test_load_test(mode, users, write_behind, tmp_path):
+
+    db_name = str(tmp_path / "load.db")
+    generate_data.generate_database(db_name, habits=20, inactive_fraction=0)
+
+    result = loadtest.run_load_test(db_name, users=users, duration=0.5, mode=mode, write_behind=write_behind)
+    assert not writebehind.enabled
+
+    assert result["errors"] == {}
+    assert result["lock_errors"] == 0
+    assert result["operations"] == sum(entry["count"] for entry in result["per_operation"].values())
+    assert result["per_operation"]["check_completion_status"]["count"] > 0
+    for entry in result["per_operation"].values():
+        assert entry["p50_ms"] <= entry["p95_ms"] <= entry["p99_ms"] <= entry["max_ms"]
+
+    with db.connect_db(db_name) as con:
+        completions = con.execute(
+            "SELECT COUNT(*) FROM tracking WHERE timestamp >= ? ;",
+            (datetime.now().strftime("%Y-%m-%d 00:00:00"), )
+        ).fetchone()[0]
+    # a habit is completed once per period, however often it is marked
+    assert completions >= min(result["per_operation"]["mark_as_complete"]["count"], 1)
+
+    with pytest.raises(ValueError):
+        loadtest.run_load_test(db_name, mode="fiber")
+
+    # a user stopped by another error than a sqlite3.Error fails the run
+    with pytest.raises(RuntimeError, match="Invalid operation 'dance'"):
+        loadtest.run_load_test(db_name, users=users, duration=0.2, mode=mode, mix={"dance": 1})
+
+
+##############################
+#         API TESTS          #
+##############################
+
+def test_api(database):
+
+    create_complete_db(database)
+    db.create_tables(database)
+
+    server = api.create_server(port=0, db_name=database, workers=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def request(method, path, body=None, headers={}):
+        con = http.client.HTTPConnection("127.0.0.1", server.server_port, timeout=10)
+        con.request(method, path, body=body, headers=headers)
+        response = con.getresponse()
+        data = response.read()
+        con.close()
+        return response.status, response.getheader("ETag"), json.loads(data) if data else None
+
+    try:
+        status, etag, habits = request("GET", "/habits?active=true")
+        assert status == 200
+        assert [habit["name"] for habit in habits] == ["Eat healthy", "Drink Enough", "Workout"]
+
+        status, _, streak = request("GET", "/habits/Workout/streak")
+        assert status == 200 and streak["current_streak"] == 2
+
+        # unchanged data is not sent again
+        status, _, _ = request("GET", "/habits?active=true", headers={"If-None-Match": etag})
+        assert status == 304
+
+        status, _, result = request("POST", "/complete", json.dumps({"names": ["Drink Enough", "Nonexistent"]}))
+        assert result["results"] == ["Drink Enough streak completed", "Nonexistent not in database"]
+
+        status, new_etag, _ = request("GET", "/habits?active=true", headers={"If-None-Match": etag})
+        assert status == 200 and new_etag != etag
+
+        status, _, _ = request("POST", "/habits/Nonexistent/complete")
+        assert status == 404
+
+        status, _, series = request("GET", "/series?period=day")
+        assert status == 200 and {row["name"] for row in series} == {"Eat healthy", "Drink Enough"}
+
+        # invalid input is answered with 400
+        for body in ("[]", '"x"', "1"):
+            status, _, result = request("POST", "/complete", body)
+            assert status == 400 and "error" in result
+        status, _, _ = request("GET", "/series?period=(")
+        assert status == 400
+
+    finally:
+        server.shutdown()
+        server.server_close()
+        db.enable_connection_pool(False)
+
+
+def test_api_idle_connections(database):
+
+    create_complete_db(database)
+    db.create_tables(database)
+
+    server = api.create_server(port=0, db_name=database, workers=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        # more idle keep-alive clients than workers
+        idle = []
+        for _ in range(3):
+            con = http.client.HTTPConnection("127.0.0.1", server.server_port, timeout=10)
+            con.request("GET", "/habits")
+            con.getresponse().read()
+            idle.append(con)
+
+        started = time.perf_counter()
+        con = http.client.HTTPConnection("127.0.0.1", server.server_port, timeout=3)
+        con.request("GET", "/habits")
+        assert con.getresponse().status == 200
+        assert time.perf_counter() - started < 2
+        con.close()
+
+        # an invalid date is not stored
+        for date in ("yesterday", 20240101, "2024-13-01"):
+            con = http.client.HTTPConnection("127.0.0.1", server.server_port, timeout=3)
+            con.request("POST", "/habits/Read/complete", json.dumps({"date": date}))
+            assert con.getresponse().status == 400
+            con.close()
+        con = http.client.HTTPConnection("127.0.0.1", server.server_port, timeout=3)
+        con.request("POST", "/habits/Drink Enough/complete".replace(" ", "%20"), json.dumps({"date": "2024-01-01"}))
+        assert con.getresponse().status == 200
+        con.close()
+        timestamps = db.get_tracking_data("Drink Enough", database)["timestamp"]
+        assert (timestamps == datetime(2024, 1, 1)).sum() == 1
+        for con in idle:
+            con.close()
+
+    finally:
+        server.shutdown()
+        started = time.perf_counter()
+        server.server_close()
+        assert time.perf_counter() - started < 2
+        db.enable_connection_pool(False)
+
+
+def test_core_imports_without_pandas():
+
+    # the write and lookup paths must not pay for importing pandas
+    result = subprocess.run(
+        [sys.executable, "-c", 
+         "import sys, db, habit, analysis, cli, aio, writebehind; "
+         "print(sorted({'pandas', 'dateutil', 'streamlit'} & set(sys.modules)))"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        check=True
+    )
+
+    assert result.stdout.strip() == "[]"
+
+
+##############################
+#          CLI TESTS         #
+##############################
+
+def test_cli(capsys, monkeypatch, tmp_path, database):
+
+    db_table_only(database)
+    db.create_tables(database)
+
+    assert cli.main(["--db", database, "add", "Read", "--period", "week"]) == 0
+    assert cli.main(["--db", database, "add", "Read"]) == 1
+
+    monkeypatch.setattr("sys.stdin", io.StringIO("Read\nNonexistent\n"))
+    assert cli.main(["--db", database, "complete", "-"]) == 1
+
+    capsys.readouterr()
+    assert cli.main(["--db", database, "list"]) == 0
+    assert capsys.readouterr().out == "Read\n"
+
+    # an invalid date exits before anything is written
+    with pytest.raises(SystemExit) as exit_info:
+        cli.main(["--db", database, "complete", "Read", "--date", "yesterday"])
+    assert exit_info.value.code == 2
+    assert "invalid date 'yesterday'" in capsys.readouterr().err
+
+    export_file = str(tmp_path / "export.json")
+    assert cli.main(["--db", database, "export", export_file]) == 0
+
+    import_db = str(tmp_path / "import.db")
+    assert cli.main(["--db", import_db, "import", export_file]) == 0
+    assert capsys.readouterr().out == "1 habits and 2 tracking entries imported\n"
+
+    assert cli.main(["--db", import_db, "streak", "Read"]) == 0
+    assert "current: 1" in capsys.readouterr().out
+
+    assert cli.main(["--db", database, "complete", "Read", "--date", "2024-03-04"]) == 0
+    assert (db.get_tracking_data("Read", database)["timestamp"] == datetime(2024, 3, 4)).sum() == 1
+
+
+@pytest.mark.parametrize("extension", ["npz", "parquet"])
+def test_columnar_export(extension, capsys, tmp_path, database):
+
+    if extension == "parquet":
+        pytest.importorskip("pyarrow")
+
+    create_complete_db(database)
+    db.create_tables(database)
+    with db.connect_db(database) as con:
+        con.execute("INSERT INTO tracking (name, status) VALUES ('Workout', NULL) ;")
+        con.commit()
+
+    expected = db.export_data(database)
+    habits, rows = len(expected["habits"]), len(expected["tracking"])
+
+    path = str(tmp_path / f"export.{extension}")
+    assert db.export_columnar(path, database) == {"habits": habits, "tracking": rows}
+
+    data = db.load_columnar(path)
+    tracking = data["tracking"]
+    assert list(tracking.columns) == ["tracking_id", "name", "status", "current_period", "timestamp"]
+    assert tracking["name"].dtype == "category"
+    assert tracking["timestamp"].dtype == "datetime64[s]"
+    assert tracking["timestamp"].isna().sum() == 1
+    assert tracking["status"].isna().sum() == 1
+    assert sorted(data["habits"]["name"]) == sorted(habit["name"] for habit in expected["habits"])
+
+    import_db = str(tmp_path / "import.db")
+    db.create_tables(import_db)
+    assert db.import_columnar(path, import_db) == f"{habits} habits and {rows} tracking entries imported"
+    assert db.export_data(import_db) == expected
+
+    # importing again skips the completions of completed periods, like import_data
+    completions = sum(
+        row["status"] == "streak complete" and row["timestamp"] is not None
+        for row in expected["tracking"]
+    )
+    assert db.import_columnar(path, import_db) == f"0 habits and {rows - completions} tracking entries imported"
+
+    cli_db = str(tmp_path / "cli.db")
+    assert cli.main(["--db", cli_db, "import", path]) == 0
+    assert cli.main(["--db", cli_db, "export", str(tmp_path / f"cli.{extension}")]) == 0
+    assert capsys.readouterr().out.splitlines()[-1] == f"{habits} habits and {rows} tracking entries exported"
 
-    """Hook to run a function after all tests are executed."""
-    
-    print("\n[pytest] All tests finished. Running final cleanup...")
-    remove_db()
\ No newline at end of file
@@ -0,0 +1,270 @@
+import db
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Opt-in write-behind queue for completions. Every streak_complete commits
+# and syncs its own transaction, under bursts of completions the database
+# is bound by these syncs. With the queue, one writer thread per database
+# commits the completions of many callers in one transaction.
+
+enabled = os.environ.get("HABIT_TRACKER_WRITE_BEHIND") == "1"
+
+# a batch is committed after this many completions or milliseconds
+batch_size = int(os.environ.get("HABIT_TRACKER_WRITE_BEHIND_BATCH", 500))
+flush_ms = float(os.environ.get("HABIT_TRACKER_WRITE_BEHIND_MS", 20))
+
+# seconds db.streak_complete waits for the commit of its completion
+timeout = float(os.environ.get("HABIT_TRACKER_WRITE_BEHIND_TIMEOUT", 30))
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+class CompletionQueue(threading.Thread):
+
+    """ Background thread writing the completions of a database in batches.
+
+    submit puts a completion into the queue and returns a Future. The
+    writer takes the first waiting completion, collects more until
+    batch_size are waiting or flush_ms have passed, writes them in one
+    transaction and then resolves the futures with the message of
+    db.streak_complete, or with the error of the failed batch. A Future
+    is resolved only after its completion is committed. If the writer
+    stops, e.g. because the database cannot be opened, the futures still
+    queued and those submitted afterwards fail with its error, and
+    get_queue starts a new writer.
+
+    Attributes:
+    -----------
+        db_name (str):
+            The name of the database file.
+
+        batch_size (int):
+            Most completions committed in one transaction.
+
+        flush_ms (float):
+            Milliseconds a batch waits for more completions.
+
+        batches (int):
+            The number of batches committed so far.
+
+    """
+
+    def __init__(
+        self,
+        db_name: str = "main.db",
+        batch_size: int = batch_size,
+        flush_ms: float = flush_ms
+    ):
+
+        """ Initializes a CompletionQueue instance, start begins the writing.
+
+        Parameter:
+        ----------
+            db_name (str, optional):
+                Database file name. Defaults to 'main.db'.
+
+            batch_size (int, optional):
+                Most completions per transaction. Defaults to
+                HABIT_TRACKER_WRITE_BEHIND_BATCH or 500.
+
+            flush_ms (float, optional):
+                Milliseconds a batch waits for more completions. Defaults
+                to HABIT_TRACKER_WRITE_BEHIND_MS or 20.
+
+        Raises:
+        -------
+            ValueError:
+                If the database is in memory.
+        """
+
+        if db_name == ":memory:":
+            raise ValueError("An in-memory database is not shared with the writer thread")
+
+        super().__init__(name=f"write-behind {db_name}", daemon=True)
+        self.db_name = db_name
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self.batches = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._error = None
+        self._lock = threading.Lock()
+
+
+    def submit(self, name: str, period: str = None, timestamp: str = None) -> Future:
+
+        """ Queues a completion of a habit.
+
+        Parameter:
+        ----------
+            name (str):
+                The name of the habit.
+
+            period (str, optional):
+                The period of the completion. Defaults to the period of the habit.
+
+            timestamp (str, optional):
+                Timestamp "YYYY-MM-DD HH:MM:SS" of the completion. Defaults
+                to now, the time of the call and not of the commit.
+
+        Returns:
+        --------
+            Future:
+                Resolves to the message of db.streak_complete after the commit.
+
+        Raises:
+        -------
+            RuntimeError:
+                If the queue is closed.
+
+        """
+
+        timestamp = timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        future = Future()
+
+        with self._lock:
+            if self._error is not None:
+                # the writer died after the caller got the queue
+                future.set_exception(self._error)
+            elif self._closed:
+                raise RuntimeError("The write-behind queue is closed")
+            else:
+                self._queue.put((name, period, timestamp, future))
+
+        return future
+
+
+    def _next_batch(self) -> list:
+
+        """ Waits for a completion, then collects a batch. None once closed and drained. """
+
+        first = self._queue.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = time.monotonic() + self.flush_ms / 1000
+        while len(batch) < self.batch_size:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                # closed, the batch is written right away and the next call stops
+                self._queue.put(None)
+                break
+            batch.append(item)
+
+        return batch
+
+
+    def run(self):
+
+        """ Writes batches until closed and every queued completion is written. """
+
+        con = None
+        error = None
+
+        try:
+            con = db.connect_db(self.db_name)
+            while (batch := self._next_batch()) is not None:
+                try:
+                    results = db._write_completions(
+                        con,
+                        [(name, period, timestamp) for name, period, timestamp, _ in batch]
+                    )
+                    con.commit()
+                except Exception as e:
+                    con.rollback()
+                    logger.exception("Writing %d completions failed", len(batch))
+                    for *_, future in batch:
+                        future.set_exception(e)
+                    continue
+
+                self.batches += 1
+                for (*_, future), result in zip(batch, results):
+                    future.set_result(result)
+        except Exception as e:
+            logger.exception("The write-behind writer of %s stopped", self.db_name)
+            error = e
+        finally:
+            if con is not None:
+                db.close_db(con)
+            self._fail_pending(error)
+
+
+    def _fail_pending(self, error: Exception = None):
+
+        """ Closes the queue and fails the futures of the completions still queued. """
+
+        with self._lock:
+            self._closed = True
+            self._error = error
+        error = error or RuntimeError("The write-behind writer stopped")
+
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None and not item[3].done():
+                item[3].set_exception(error)
+
+
+    def close(self, timeout: float = None):
+
+        """ Stops taking completions, writes the queued ones and waits for the writer. """
+
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(None)
+        if self.is_alive():
+            self.join(timeout)
+
+
+def get_queue(db_name: str = "main.db") -> CompletionQueue:
+
+    """ Returns the running CompletionQueue of a database, one per database and process. """
+
+    with _queues_lock:
+        completion_queue = _queues.get(db_name)
+        if completion_queue is None or completion_queue._closed or not completion_queue.is_alive():
+            completion_queue = _queues[db_name] = CompletionQueue(db_name)
+            completion_queue.start()
+        return completion_queue
+
+
+def submit(
+    name: str,
+    period: str = None,
+    timestamp: str = None,
+    db_name: str = "main.db"
+) -> Future:
+
+    """ Queues a completion in the queue of db_name, see CompletionQueue.submit. """
+
+    return get_queue(db_name).submit(name, period, timestamp)
+
+
+@atexit.register
+def close_all(timeout: float = None):
+
+    """ Writes all queued completions and stops the writers, also run at exit. """
+
+    with _queues_lock:
+        queues = list(_queues.values())
+        _queues.clear()
+
+    for completion_queue in queues:
+        completion_queue.close(timeout)